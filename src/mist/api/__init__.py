@@ -161,6 +161,7 @@ def add_routes(configurator):
         return False
 
     configurator.add_route('version', '/version')
+    configurator.add_route('metrics', '/metrics')
 
     configurator.add_route('ui_routes', '/{section}*fizzle',
                            custom_predicates=[valid_ui_section])
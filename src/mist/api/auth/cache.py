@@ -0,0 +1,213 @@
+"""In-process cache of resolved auth tokens
+
+Resolving the session of a request takes a query for the token, one for its
+user and one for its org. This module keeps these documents, along with the
+user's compiled IP whitelist, in a bounded LRU cache with a TTL, keyed by the
+hash of the token.
+
+Cached documents are stored as BSON and rebuilt on every hit, so requests
+never share document instances. Entries are invalidated across all processes
+by a broadcast over AMQP whenever a token, user or org is changed. While the
+process is not listening for these broadcasts, the cache is bypassed.
+
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+import collections
+
+import bson
+import kombu
+import netaddr
+
+from mist.api import config
+
+
+log = logging.getLogger(__name__)
+
+EXCHANGE = 'mist_auth_sessions'
+
+
+def token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def build_ip_whitelist(user):
+    """Return an IPSet of the user's whitelisted CIDRs
+
+    Returns None if the user hasn't whitelisted any IPs, in which case
+    requests from any IP are allowed.
+
+    """
+    if user is None or not user.ips:
+        return None
+    return netaddr.IPSet([ip.cidr for ip in user.ips] +
+                         list(config.WHITELIST_CIDR))
+
+
+class SessionCache(object):
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.listening = False
+        self.listener = None
+        self.pid = None
+
+    @property
+    def enabled(self):
+        return config.AUTH_SESSION_CACHE_TTL > 0
+
+    def get(self, token, classes):
+        """Return the cached session of `token`, or None
+
+        Only sessions that are instances of `classes` are returned, so that a
+        token is never accepted in place of a token of another kind, e.g. an
+        ApiToken sent as a session cookie. Other sessions are a cache miss.
+
+        """
+        if not self.enabled:
+            return None
+        self.start_listener()
+        if not self.listening:
+            return None
+        key = token_hash(token)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry['expires'] < time.time():
+                return None
+            self.entries[key] = entry
+        if not issubclass(entry['cls'], classes):
+            return None
+        return self._load(entry)
+
+    def add(self, session):
+        """Cache a valid session, along with its users and org"""
+        if not self.enabled or not self.listening or session.id is None:
+            return
+        users = {}
+        for effective in (False, True):
+            user = session.get_user(effective=effective)
+            if user is not None:
+                users[user.id] = bson.encode(user.to_mongo())
+        org = session.org
+        entry = {
+            'expires': time.time() + config.AUTH_SESSION_CACHE_TTL,
+            'session': bson.encode(session.to_mongo()),
+            'cls': type(session),
+            'users': users,
+            'org': bson.encode(org.to_mongo()) if org is not None else None,
+            'owner_ids': set(users) | ({org.id} if org is not None else set()),
+            'whitelist': build_ip_whitelist(session.get_user()),
+        }
+        with self.lock:
+            self.entries.pop(token_hash(session.token), None)
+            self.entries[token_hash(session.token)] = entry
+            while len(self.entries) > config.AUTH_SESSION_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def touch(self, session):
+        """Update the last access time of a cached session"""
+        if not self.enabled:
+            return
+        with self.lock:
+            entry = self.entries.get(token_hash(session.token))
+            if entry is not None:
+                son = bson.decode(entry['session'])
+                son['last_accessed_at'] = session.last_accessed_at
+                entry['session'] = bson.encode(son)
+
+    def invalidate(self, tokens=(), owners=()):
+        """Remove the entries of the given token hashes and owner ids"""
+        owners = set(owners)
+        with self.lock:
+            for key in tokens:
+                self.entries.pop(key, None)
+            if owners:
+                for key, entry in list(self.entries.items()):
+                    if entry['owner_ids'] & owners:
+                        del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def _load(self, entry):
+        from mist.api.users.models import User, Organization
+        session = entry['cls']._from_son(bson.decode(entry['session']))
+        if entry['org'] is not None:
+            session._data['org'] = Organization._from_son(
+                bson.decode(entry['org']))
+        session._cached_users = {
+            user_id: User._from_son(bson.decode(son))
+            for user_id, son in entry['users'].items()
+        }
+        session._ip_whitelist = entry['whitelist']
+        return session
+
+    def start_listener(self):
+        # The listener thread doesn't survive forking, so start a new one in
+        # each process.
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.listening = False
+            self.entries.clear()
+            self.listener = threading.Thread(target=self._listen,
+                                             name='SessionCacheListener')
+            self.listener.daemon = True
+            self.listener.start()
+
+    def _listen(self):
+        exchange = kombu.Exchange(EXCHANGE, type='fanout', durable=False,
+                                  auto_delete=True)
+        while True:
+            try:
+                with kombu.Connection(config.BROKER_URL) as connection:
+                    queue = kombu.Queue('', exchange, exclusive=True)
+                    with connection.Consumer([queue], no_ack=True,
+                                             callbacks=[self._on_message]):
+                        # Invalidations may have been missed while not
+                        # listening.
+                        self.clear()
+                        self.listening = True
+                        while True:
+                            connection.drain_events()
+            except Exception as exc:
+                log.warning('Session cache listener got %r', exc)
+            finally:
+                self.listening = False
+                self.clear()
+            time.sleep(5)
+
+    def _on_message(self, body, msg):
+        self.invalidate(tokens=body.get('tokens', []),
+                        owners=body.get('owners', []))
+
+
+session_cache = SessionCache()
+
+
+def invalidate_sessions(tokens=(), owners=()):
+    """Invalidate cached sessions of all processes
+
+    Removes the sessions of the given tokens and the sessions whose user or
+    org is one of the given owner ids.
+
+    """
+    if not session_cache.enabled:
+        return
+    from mist.api.helpers import amqp_publish
+    tokens = [token_hash(token) for token in tokens]
+    owners = list(owners)
+    session_cache.invalidate(tokens=tokens, owners=owners)
+    try:
+        amqp_publish(EXCHANGE, '', {'tokens': tokens, 'owners': owners},
+                     ex_declare=True)
+    except Exception as exc:
+        log.error('Failed to broadcast session invalidation: %r', exc)
@@ -1,5 +1,8 @@
+import atexit
 import random
 import string
+import logging
+import threading
 import urllib.request
 import urllib.parse
 import urllib.error
@@ -23,21 +26,29 @@ from mist.api.portal.models import Portal
 
 from mist.api.auth.tasks import revoke_token
 from mist.api.auth.models import ApiToken
+from mist.api.auth.models import AuthToken
 from mist.api.auth.models import SessionToken
+from mist.api.auth.cache import session_cache
 
 from mist.api import config
 
 if config.HAS_RBAC:
     from mist.rbac.tokens import SuperToken
     from mist.rbac.methods import AuthContext
+    # Tokens accepted in the Authorization header.
+    API_TOKEN_CLASSES = (ApiToken, SuperToken)
 else:
     from mist.api.dummy.rbac import AuthContext
+    API_TOKEN_CLASSES = (ApiToken, )
 
 if 'auth' in config.PLUGINS:
     # Required to initialize OAuth2SessionToken model, subclass of AuthToken.
     from mist.auth.social.models import OAuth2SessionToken  # noqa: F401
 
 
+log = logging.getLogger(__name__)
+
+
 def migrate_old_api_token(request):
     """Migrate old API tokens (aka mist_1: email:token) to new ApiTokens"""
 
@@ -117,32 +128,43 @@ def session_from_request(request):
                             session = session_token
         elif auth_value:
             token_from_request = auth_value
-            try:
-                api_token = ApiToken.objects.get(
-                    token=token_from_request
-                )
-            except DoesNotExist:
-                api_token = None
-            try:
-                if not api_token and config.HAS_RBAC:
-                    api_token = SuperToken.objects.get(
-                        token=token_from_request)
-            except DoesNotExist:
-                pass
+            api_token = session_cache.get(token_from_request,
+                                          API_TOKEN_CLASSES)
+            if api_token is None:
+                try:
+                    api_token = ApiToken.objects.get(
+                        token=token_from_request
+                    )
+                except DoesNotExist:
+                    api_token = None
+                try:
+                    if not api_token and config.HAS_RBAC:
+                        api_token = SuperToken.objects.get(
+                            token=token_from_request)
+                except DoesNotExist:
+                    pass
+                if api_token and api_token.is_valid():
+                    session_cache.add(api_token)
             if api_token and api_token.is_valid():
                 session = api_token
             else:
                 session = ApiToken()
                 session.name = 'dummy_token'
-    if session is None:
-        try:
-            session_token = SessionToken.objects.get(
-                token=request.cookies.get('session.id')
-            )
-            if session_token.is_valid():
-                session = session_token
-        except DoesNotExist:
-            pass
+    if session is None and request.cookies.get('session.id'):
+        session_token = session_cache.get(request.cookies['session.id'],
+                                          SessionToken)
+        if session_token is None:
+            try:
+                session_token = SessionToken.objects.get(
+                    token=request.cookies.get('session.id')
+                )
+            except DoesNotExist:
+                pass
+            else:
+                if session_token.is_valid():
+                    session_cache.add(session_token)
+        if session_token is not None and session_token.is_valid():
+            session = session_token
     if session is None:
         session = SessionToken(
             user_agent=request.user_agent,
@@ -153,6 +175,64 @@ def session_from_request(request):
     return session
 
 
+# Last access times of tokens, pending to be written.
+_pending_touches = {}
+_pending_touches_lock = threading.Lock()
+
+
+def touch_session(session):
+    """Update the last access time of `session`
+
+    The session is saved right away, unless AUTH_TOKEN_TOUCH_INTERVAL is set
+    and the last access time is the only change of an already accessed
+    session. In that case the touch is kept in memory and written along with
+    the touches of all other sessions by `flush_session_touches`, at most
+    AUTH_TOKEN_TOUCH_INTERVAL seconds later.
+
+    """
+    last_accessed_at = session.last_accessed_at
+    session.touch()
+    session_cache.touch(session)
+    changed = set(session._get_changed_fields()) - {'last_accessed_at'}
+    if not config.AUTH_TOKEN_TOUCH_INTERVAL or not last_accessed_at or \
+            session.id is None or changed:
+        session.save()
+        return
+    with _pending_touches_lock:
+        if not _pending_touches:
+            timer = threading.Timer(config.AUTH_TOKEN_TOUCH_INTERVAL,
+                                    flush_session_touches)
+            timer.daemon = True
+            timer.start()
+        _pending_touches[session.id] = session.last_accessed_at
+
+
+@atexit.register
+def flush_session_touches():
+    """Write pending last access times with a single bulk write
+
+    Each token is set to its own pending access time, unless it has been
+    set to a later one meanwhile.
+
+    """
+    from pymongo import UpdateOne
+
+    with _pending_touches_lock:
+        pending = dict(_pending_touches)
+        _pending_touches.clear()
+    if not pending:
+        return
+    try:
+        AuthToken._get_collection().bulk_write([
+            UpdateOne({'_id': token_id},
+                      {'$max': {'last_accessed_at': last_accessed_at}})
+            for token_id, last_accessed_at in pending.items()
+        ], ordered=False)
+    except Exception as exc:
+        log.error('Failed to update last access time of %d tokens: %r',
+                  len(pending), exc)
+
+
 def user_from_request(request, admin=False, redirect=False):
     """Given request, initiate User instance (mist.api.users.model.User)
 
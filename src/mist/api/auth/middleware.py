@@ -10,6 +10,8 @@ from mist.api.auth.models import SessionToken
 
 from mist.api.auth.methods import session_from_request
 from mist.api.auth.methods import reissue_cookie_session
+from mist.api.auth.methods import touch_session
+from mist.api.auth.cache import build_ip_whitelist
 
 from mist.api import config
 
@@ -51,8 +53,7 @@ class AuthMiddleware(object):
             if not (isinstance(session, ApiToken) and
                     'dummy' in session.name or
                     getattr(session, 'internal', False)):
-                session.touch()
-                session.save()
+                touch_session(session)
             # CORS
             if (
                 environ.get('HTTP_ORIGIN') and
@@ -83,15 +84,13 @@ class AuthMiddleware(object):
         if session and user is not None and request.path != '/logout' and \
                 not getattr(session, 'internal', False):
             current_user_ip = netaddr.IPAddress(ip_from_request(request))
-            saved_wips = [netaddr.IPNetwork(ip.cidr) for ip in user.ips]
-            config_wips = [netaddr.IPNetwork(cidr)
-                           for cidr in config.WHITELIST_CIDR]
-            wips = saved_wips + config_wips
-            if len(saved_wips) > 0:
-                for ipnet in wips:
-                    if current_user_ip in ipnet:
-                        break
-                else:
+            # Whitelists are precompiled for sessions from the cache.
+            try:
+                wips = session._ip_whitelist
+            except AttributeError:
+                wips = build_ip_whitelist(user)
+            if wips is not None:
+                if current_user_ip not in wips:
                     log_event(
                         owner_id=session.org.id,
                         user_id=user.id,
@@ -77,7 +77,10 @@ class AuthToken(me.Document):
             return self.last_accessed_at + timedelta(seconds=self.timeout)
 
     def is_timedout(self):
-        return self.timeout and self.timesout() < datetime.utcnow()
+        # The last access time may be written up to AUTH_TOKEN_TOUCH_INTERVAL
+        # seconds late, see `mist.api.auth.methods.touch_session`.
+        grace = timedelta(seconds=config.AUTH_TOKEN_TOUCH_INTERVAL)
+        return self.timeout and self.timesout() + grace < datetime.utcnow()
 
     def is_valid(self):
         return not (self.revoked or self.is_expired() or self.is_timedout())
@@ -85,18 +88,33 @@ class AuthToken(me.Document):
     def invalidate(self):
         self.revoked = True
 
+    def save(self, *args, **kwargs):
+        changed = set(self._get_changed_fields()) - {'last_accessed_at'}
+        created = self._created or self.id is None
+        result = super(AuthToken, self).save(*args, **kwargs)
+        if changed and not created:
+            from mist.api.auth.cache import invalidate_sessions
+            invalidate_sessions(tokens=[self.token])
+        return result
+
+    def delete(self, *args, **kwargs):
+        super(AuthToken, self).delete(*args, **kwargs)
+        from mist.api.auth.cache import invalidate_sessions
+        invalidate_sessions(tokens=[self.token])
+
     def touch(self):
         self.last_accessed_at = datetime.utcnow()
 
     def get_user(self, effective=True):
         """Return `su` user, if `effective` else `user`"""
         if self.user_id:
+            user_id = self.su if effective and self.su else self.user_id
+            # Users are preloaded for sessions from `mist.api.auth.cache`.
+            cached_users = getattr(self, '_cached_users', {})
+            if user_id in cached_users:
+                return cached_users[user_id]
             try:
-                if effective and self.su:
-                    user = User.objects.get(id=self.su)
-                else:
-                    user = User.objects.get(id=self.user_id)
-                return user
+                return User.objects.get(id=user_id)
             except me.DoesNotExist:
                 pass
         return None
@@ -4,6 +4,8 @@ import logging
 
 from libcloud.common.types import InvalidCredsError
 
+from mist.api import config
+
 from mist.api.exceptions import CloudUnavailableError
 from mist.api.exceptions import CloudUnauthorizedError
 from mist.api.exceptions import SSLError
@@ -117,7 +119,12 @@ class BaseController(object):
 
         """
         if self._conn is None:
-            self._conn = ConnectionProxy(self.connect())
+            conn = self.connect()
+            if config.PROVIDER_METRICS:
+                from mist.api.instrumentation import InstrumentedConnection
+                conn = InstrumentedConnection(conn, self.provider,
+                                              self.cloud.id)
+            self._conn = ConnectionProxy(conn)
         return self._conn.conn
 
     def check_connection(self):
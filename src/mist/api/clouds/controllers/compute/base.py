@@ -8,11 +8,13 @@ to db etc. Cloud specific controllers are in `mist.api.clouds.controllers`.
 
 import ssl
 import json
+import time
 import copy
 import socket
 import logging
 import datetime
 import calendar
+import threading
 from typing import Any, Dict, List, Tuple, Union
 import requests
 import re
@@ -52,10 +54,14 @@ from mist.api.helpers import amqp_publish_user
 from mist.api.helpers import amqp_owner_listening
 from mist.api.helpers import node_to_dict
 
+from mist.api.instrumentation import PhaseTimer
+
 from mist.api.concurrency.models import PeriodicTaskInfo
 from mist.api.concurrency.models import PeriodicTaskThresholdExceeded
 
 from mist.api.clouds.controllers.base import BaseController
+from mist.api.mongoengine_extras import bulk_save
+from mist.api.mongoengine_extras import sanitize_dict
 from mist.api.tag.models import Tag
 
 if config.HAS_VPN:
@@ -75,6 +81,38 @@ __all__ = [
     "BaseComputeController",
 ]
 
+# Persistent process pool, lazily started, see `_get_process_pool`.
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+# Pricing data shared by all clouds of a provider, see `get_cached_pricing`.
+_pricing_cache = {}
+_pricing_cache_lock = threading.Lock()
+
+# Locations and sizes of each cloud that image constraints were last
+# updated for, see `_list_images__reconcile_images`.
+_image_constraints_fingerprints = {}
+
+
+def get_cached_pricing(key, func):
+    """Return the pricing data of `key`, as returned by `func`
+
+    Pricing data don't depend on the cloud's credentials, so they're cached
+    in process for `config.PRICING_CACHE_TTL` seconds and shared among all
+    clouds of the same provider.
+
+    """
+    now = time.time()
+    with _pricing_cache_lock:
+        cached = _pricing_cache.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    value = func()
+    with _pricing_cache_lock:
+        _pricing_cache[key] = (now + config.PRICING_CACHE_TTL, value)
+    return value
+
 
 def _update_machine_from_node_in_process_pool(params):
     from mist.api.clouds.models import Cloud
@@ -91,6 +129,132 @@ def _update_machine_from_node_in_process_pool(params):
         node_dict, locations_map, sizes_map, images_map, now)
 
 
+def _init_process_pool_worker():
+    """Initialize a persistent process pool worker
+
+    Workers are spawned rather than forked, so they don't inherit the
+    parent's mongo client. A connection is established once here and reused
+    for the lifetime of the worker.
+
+    """
+    from mongoengine.connection import get_connection, ConnectionFailure
+    from mist.api import mongo_connect
+    import mist.api.models  # noqa
+    try:
+        get_connection()
+    except ConnectionFailure:
+        mongo_connect()
+
+
+def _get_process_pool():
+    """Return the process pool of this process, creating it if needed"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            log.info("Starting process pool with %d workers",
+                     config.PROCESS_POOL_WORKERS)
+            _process_pool = ProcessPoolExecutor(
+                max_workers=config.PROCESS_POOL_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_process_pool_worker)
+        return _process_pool
+
+
+def _reset_process_pool():
+    """Discard the process pool, eg. after one of its workers died"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False)
+            _process_pool = None
+
+
+def _update_machines_from_nodes_in_process_pool(params):
+    """Update the machines of a chunk of nodes in a process pool worker
+
+    The lookup maps are received as dicts of keys to document ids, so that
+    they are cheap to pickle, and they are resolved to documents with one
+    query per collection. Returns a list of (machine id, is_new) tuples.
+
+    """
+    from mist.api.clouds.models import Cloud, CloudLocation, CloudSize
+    from mist.api.images.models import CloudImage
+
+    cloud = Cloud.objects.get(id=params['cloud_id'])
+    lookup_maps = []
+    for model, ids_map in ((CloudLocation, params['locations_map']),
+                           (CloudSize, params['sizes_map']),
+                           (CloudImage, params['images_map'])):
+        docs = {doc.id: doc
+                for doc in model.objects(id__in=set(ids_map.values()))}
+        lookup_maps.append({key: docs[doc_id]
+                            for key, doc_id in ids_map.items()
+                            if doc_id in docs})
+
+    results = []
+    for node in params['nodes']:
+        machine, is_new = cloud.ctl.compute._update_machine_from_node(
+            node, *lookup_maps, params['now'])
+        if machine:
+            results.append((machine.id, is_new))
+    return results
+
+
+def _patch_content(machine):
+    """Return a shallow copy of a machine dict with the fields to be patched
+
+    Fields that change on every poll, such as `last_seen` and `probe`, are
+    excluded and exposed ports are sorted so that the result is stable.
+
+    """
+    machine = dict(machine)
+    machine.pop('last_seen', None)
+    machine.pop('probe', None)
+    if machine.get('extra') and machine['extra'].get('ports'):
+        machine['extra'] = dict(machine['extra'])
+        machine['extra']['ports'] = sorted(
+            machine['extra']['ports'],
+            key=lambda x: x.get('PublicPort', 0) * 100000 + x.get(
+                'PrivatePort', 0))
+    return machine
+
+
+def _incremental_patch(old_resources, new_resources):
+    """Compute a json patch between two dicts of resources keyed by id
+
+    Applying the patch to `old_resources` yields `new_resources`, like the
+    patch of `jsonpatch.JsonPatch.from_diff` would, although operations may
+    differ in order and resources are never moved. Only resources that were
+    added, removed or are no longer equal are diffed. When nothing has
+    changed this boils down to comparing each pair of resources once.
+
+    """
+    patch = []
+    for key in old_resources.keys() - new_resources.keys():
+        patch.append({'op': 'remove', 'path': '/%s' % _escape_pointer(key)})
+    for key in new_resources.keys() - old_resources.keys():
+        patch.append({'op': 'add', 'path': '/%s' % _escape_pointer(key),
+                      'value': new_resources[key]})
+    for key in old_resources.keys() & new_resources.keys():
+        old, new = old_resources[key], new_resources[key]
+        if old == new:
+            continue
+        prefix = '/%s' % _escape_pointer(key)
+        for operation in jsonpatch.JsonPatch.from_diff(
+                copy.deepcopy(old), copy.deepcopy(new)).patch:
+            operation['path'] = prefix + operation['path']
+            if 'from' in operation:
+                operation['from'] = prefix + operation['from']
+            patch.append(operation)
+    return patch
+
+
+def _escape_pointer(key):
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
 def _decide_machine_cost(machine, tags=None, cost=(0, 0)):
     """Decide what the monthly and hourly machine cost is
 
@@ -114,9 +278,10 @@ def _decide_machine_cost(machine, tags=None, cost=(0, 0)):
     month_days = calendar.monthrange(now.year, now.month)[1]
 
     # Get machine tags from db
-    tags = tags or {tag.key: tag.value for tag in Tag.objects(
-        resource_id=machine.id, resource_type='machine'
-    )}
+    if tags is None:
+        tags = {tag.key: tag.value for tag in Tag.objects(
+            resource_id=machine.id, resource_type='machine'
+        )}
     percentage = 1
     try:
         cph = parse_num(tags.get('cost_per_hour'))
@@ -233,13 +398,14 @@ class BaseComputeController(BaseController):
         implementation.
 
         """
+        from mist.api.machines.models import machines_as_dict
         task_key = 'cloud:list_machines:%s' % self.cloud.id
         task = PeriodicTaskInfo.get_or_add(task_key)
         first_run = False if task.last_success else True
         try:
             with task.task_runner(persist=persist):
-                cached_machines = [m.as_dict()
-                                   for m in self.list_cached_machines()]
+                cached_machines = machines_as_dict(
+                    self.list_cached_machines())
                 machines = self._list_machines()
         except PeriodicTaskThresholdExceeded:
             self.cloud.ctl.disable()
@@ -248,12 +414,14 @@ class BaseComputeController(BaseController):
         self.produce_and_publish_patch(cached_machines, machines, first_run)
 
         # Push historic information for inventory and cost reporting.
+        phases = PhaseTimer(self, 'machines')
         for machine in machines:
             data = {'owner_id': self.cloud.owner.id,
                     'machine_id': machine.id,
                     'cost_per_month': machine.cost.monthly}
             amqp_publish(exchange='machines_inventory', routing_key='',
                          auto_delete=False, data=data)
+        phases.observe('inventory')
 
         if config.ENABLE_METERING:
             self._update_metering_data(cached_machines, machines)
@@ -262,22 +430,15 @@ class BaseComputeController(BaseController):
 
     def produce_and_publish_patch(self, cached_machines, fresh_machines,
                                   first_run=False):
-        old_machines = {'%s-%s' % (m['id'], m['machine_id']): copy.copy(m)
-                        for m in cached_machines}
-        new_machines = {'%s-%s' % (m.id, m.machine_id): m.as_dict()
-                        for m in fresh_machines}
+        from mist.api.machines.models import machines_as_dict
+        phases = PhaseTimer(self, 'machines')
         # Exclude last seen and probe fields from patch.
-        for md in old_machines, new_machines:
-            for m in list(md.values()):
-                m.pop('last_seen')
-                m.pop('probe')
-                if m.get('extra') and m['extra'].get('ports'):
-                    m['extra']['ports'] = sorted(
-                        m['extra']['ports'],
-                        key=lambda x: x.get('PublicPort', 0) * 100000 + x.get(
-                            'PrivatePort', 0))
-        patch = jsonpatch.JsonPatch.from_diff(old_machines,
-                                              new_machines).patch
+        old_machines = {'%s-%s' % (m['id'], m['machine_id']): _patch_content(m)
+                        for m in cached_machines}
+        new_machines = {'%s-%s' % (m['id'], m['machine_id']): _patch_content(m)
+                        for m in machines_as_dict(fresh_machines)}
+        patch = _incremental_patch(old_machines, new_machines)
+        phases.observe('patch')
         if patch:  # Publish patches to rabbitmq.
             if not first_run and self.cloud.observation_logs_enabled:
                 from mist.api.logs.methods import log_observations
@@ -288,6 +449,7 @@ class BaseComputeController(BaseController):
                                   routing_key='patch_machines',
                                   data={'cloud_id': self.cloud.id,
                                         'patch': patch})
+        phases.observe('publish')
 
     def _list_machines(self):
         """Core logic of list_machines method
@@ -312,12 +474,14 @@ class BaseComputeController(BaseController):
 
         """
         # Try to query list of machines from provider API.
+        phases = PhaseTimer(self, 'machines')
         try:
             from time import time
             start = time()
             nodes = self._list_machines__fetch_machines()
             log.info("List nodes returned %d results for %s in %d.",
                      len(nodes), self.cloud, time() - start)
+            phases.observe('fetch')
         except InvalidCredsError as exc:
             log.warning("Invalid creds on running list_nodes on %s: %s",
                         self.cloud, exc)
@@ -333,6 +497,9 @@ class BaseComputeController(BaseController):
         machines = []
         now = datetime.datetime.utcnow()
 
+        # Rebuild the pricing index on every poll.
+        self._pricing_index = None
+
         # This is a map of locations' external IDs and names to CloudLocation
         # mongoengine objects. It is used to lookup cached locations based on
         # a node's metadata in order to associate VM instances to their region.
@@ -359,12 +526,19 @@ class BaseComputeController(BaseController):
         for image in CloudImage.objects(cloud=self.cloud):
             images_map[image.external_id] = image
             images_map[image.name] = image
+        phases.observe('maps')
 
         from mist.api.machines.models import Machine
         # Process each machine in returned list.
         # Store previously unseen machines separately.
         new_machines = []
-        if config.PROCESS_POOL_WORKERS:
+        if config.MACHINES_BULK_RECONCILIATION:
+            machines, new_machines = self._list_machines__reconcile_machines(
+                nodes, locations_map, sizes_map, images_map, now)
+        elif config.PROCESS_POOL_WORKERS and config.PROCESS_POOL_PERSISTENT:
+            machines, new_machines = self._list_machines__update_in_pool(
+                nodes, locations_map, sizes_map, images_map, now)
+        elif config.PROCESS_POOL_WORKERS:
             from concurrent.futures import ProcessPoolExecutor
             cloud_id = self.cloud.id
 
@@ -398,6 +572,7 @@ class BaseComputeController(BaseController):
                 if is_new:
                     new_machines.append(machine)
                 machines.append(machine)
+        phases.observe('update')
 
         # Append generic-type machines, which aren't handled by libcloud.
         for machine in self._list_machines__fetch_generic_machines():
@@ -425,13 +600,23 @@ class BaseComputeController(BaseController):
             machines.append(machine)
 
         # Set missing_since on machine models we didn't see for the first time.
-        Machine.objects(cloud=self.cloud,
-                        id__nin=[m.id for m in machines],
-                        missing_since=None).update(missing_since=now)
+        # Machines whose parent couldn't be listed are not missing.
+        unreachable_parents = self._list_machines__get_unreachable_parents()
+        missing = Machine.objects(cloud=self.cloud,
+                                  id__nin=[m.id for m in machines],
+                                  missing_since=None)
+        if unreachable_parents:
+            missing = missing.filter(parent__nin=unreachable_parents)
+        missing.update(missing_since=now)
         # Set last_seen, unset missing_since on machine models we just saw
         Machine.objects(cloud=self.cloud,
                         id__in=[m.id for m in machines]).update(
                             last_seen=now, missing_since=None)
+        # Keep the machines of unreachable parents as they were last seen.
+        if unreachable_parents:
+            machines += list(Machine.objects(
+                cloud=self.cloud, parent__in=unreachable_parents,
+                id__nin=[m.id for m in machines], missing_since=None))
 
         # Update RBAC Mappings given the list of nodes seen for the first time.
         self.cloud.owner.mapper.update(new_machines, asynchronous=False)
@@ -447,6 +632,7 @@ class BaseComputeController(BaseController):
             )
         )
         self.cloud.owner.save()
+        phases.observe('persist')
 
         # Close libcloud connection
         try:
@@ -455,6 +641,126 @@ class BaseComputeController(BaseController):
             log.warning("Error while closing connection: %r", exc)
         return machines
 
+    def _list_machines__reconcile_machines(self, nodes, locations_map,
+                                           sizes_map, images_map, now):
+        """Reconcile fetched nodes with the machines stored in the db
+
+        All machines and machine tags of the cloud are prefetched with a
+        single query each, every node is diffed against its machine in
+        memory, changed machines are cleaned together and all resulting
+        inserts and updates are flushed with a single unordered bulk write.
+        This keeps the number of db roundtrips per poll constant, regardless
+        of the number of nodes.
+
+        Returns a two-tuple of the list of machines seen and the list of
+        those that were seen for the first time.
+
+        """
+        from mist.api.machines.models import Machine
+
+        existing_machines = {}
+        for machine in Machine.objects(cloud=self.cloud):
+            # Avoid dereferencing the cloud of every machine.
+            machine._data['cloud'] = self.cloud
+            existing_machines[machine.machine_id] = machine
+        machine_tags = {}
+        for tag in Tag.objects(
+                resource_type='machine',
+                resource_id__in=[m.id for m in existing_machines.values()]
+        ).only('resource_id', 'key', 'value'):
+            machine_tags.setdefault(tag.resource_id, {})[tag.key] = tag.value
+
+        machines, to_save = [], []
+        seen_ids = set()
+        for node in nodes:
+            # Guard against duplicate node ids in the provider response.
+            if node['id'] in seen_ids:
+                continue
+            seen_ids.add(node['id'])
+            machine = existing_machines.get(node['id'])
+            if machine is None:
+                machine = Machine(cloud=self.cloud, owner=self.cloud.owner,
+                                  machine_id=node['id'])
+            updated = self._update_machine_fields_from_node(
+                machine, node, locations_map, sizes_map, images_map,
+                tags=machine_tags.get(machine.id, {}))
+            machine.last_seen = now
+            if machine._created or updated:
+                to_save.append(machine)
+            else:
+                log.debug("Not saving machine %s (%s)",
+                          machine.name, machine.id)
+            machines.append(machine)
+
+        new_machines = [machine for machine in machines if machine._created]
+        # Clean all machines at once, instead of a few queries per machine.
+        Machine.clean_many(to_save)
+        failed = bulk_save(to_save, clean=False)
+        if failed:
+            log.error("Failed to save %d of %d machines of %s",
+                      len(failed), len(to_save), self.cloud)
+        # New machines that failed to be saved don't exist in the db, while
+        # existing ones are still seen, even though their changes weren't
+        # saved.
+        failed = set(id(machine) for machine in failed)
+        machines = [machine for machine in machines
+                    if not (machine._created and id(machine) in failed)]
+        new_machines = [machine for machine in new_machines
+                        if id(machine) not in failed]
+        for machine in machines:
+            machine._clear_changed_fields()
+        return machines, new_machines
+
+    def _list_machines__update_in_pool(self, nodes, locations_map,
+                                       sizes_map, images_map, now):
+        """Update machines from nodes in the persistent process pool
+
+        Nodes are split in chunks of `config.PROCESS_POOL_CHUNK_SIZE` and
+        each chunk is processed by a single pool task, along with id-only
+        versions of the lookup maps. The updated machines are then loaded
+        back with a single query.
+
+        Returns a two-tuple of the list of machines seen and the list of
+        those that were seen for the first time.
+
+        """
+        from concurrent.futures.process import BrokenProcessPool
+        from mist.api.machines.models import Machine
+
+        def ids_map(lookup_map):
+            return {key: doc.id for key, doc in lookup_map.items()}
+
+        params = {
+            'cloud_id': self.cloud.id,
+            'now': now,
+            'locations_map': ids_map(locations_map),
+            'sizes_map': ids_map(sizes_map),
+            'images_map': ids_map(images_map),
+        }
+        chunk_size = max(config.PROCESS_POOL_CHUNK_SIZE, 1)
+        chunks = [dict(params, nodes=nodes[i:i + chunk_size])
+                  for i in range(0, len(nodes), chunk_size)]
+        try:
+            results = [result for chunk_results in _get_process_pool().map(
+                _update_machines_from_nodes_in_process_pool, chunks)
+                for result in chunk_results]
+        except BrokenProcessPool:
+            _reset_process_pool()
+            raise
+
+        machines_map = {machine.id: machine for machine in Machine.objects(
+            id__in=[machine_id for machine_id, _ in results])}
+        machines, new_machines = [], []
+        for machine_id, is_new in results:
+            machine = machines_map.get(machine_id)
+            if not machine:
+                continue
+            machine.last_seen = now
+            machines.append(machine)
+            if is_new:
+                new_machines.append(machine)
+        return machines, new_machines
+
     def _update_machine_image(self, node, machine, images_map):
         updated = False
         try:
@@ -482,7 +788,6 @@ class BaseComputeController(BaseController):
     def _update_machine_from_node(self, node, locations_map, sizes_map,
                                   images_map, now):
         is_new = False
-        updated = False
         # Fetch machine mongoengine model from db, or initialize one.
         from mist.api.machines.models import Machine
         try:
@@ -498,6 +803,40 @@ class BaseComputeController(BaseController):
                          exc)
                 return None, is_new
 
+        updated = self._update_machine_fields_from_node(
+            machine, node, locations_map, sizes_map, images_map)
+
+        # Save all changes to machine model on the database.
+        if is_new or updated:
+            try:
+                machine.save()
+            except me.ValidationError as exc:
+                log.error("Error adding %s: %s", machine.name, exc.to_dict())
+                raise BadRequestError({"msg": str(exc),
+                                       "errors": exc.to_dict()})
+            except me.NotUniqueError as exc:
+                log.error("Machine %s not unique error: %s", machine.name, exc)
+                raise ConflictError("Machine with this name already exists")
+        else:
+            log.debug("Not saving machine %s (%s) %s" % (
+                machine.name, machine.id, is_new))
+
+        machine.last_seen = now
+
+        return machine, is_new
+
+    def _update_machine_fields_from_node(self, machine, node, locations_map,
+                                         sizes_map, images_map, tags=None):
+        """Update a machine model in place from a libcloud node dict
+
+        This does not persist the machine, it returns True if any of its
+        fields have been modified. `tags` may be a dict of the machine's tags
+        when these have already been fetched, otherwise they are queried
+        when deciding the machine's cost.
+
+        """
+        updated = False
+
         # Discover location of machine.
         try:
             location_id = self._list_machines__get_location(node)
@@ -633,6 +972,7 @@ class BaseComputeController(BaseController):
         try:
             cph, cpm = _decide_machine_cost(
                 machine,
+                tags=tags,
                 cost=self._list_machines__cost_machine(machine, node),
             )
             if machine.cost.hourly != cph or machine.cost.monthly != cpm:
@@ -644,24 +984,7 @@ class BaseComputeController(BaseController):
                           "for machine %s:%s for %s \n%r",
                           machine.id, node['name'], self.cloud, exc)
 
-        # Save all changes to machine model on the database.
-        if is_new or updated:
-            try:
-                machine.save()
-            except me.ValidationError as exc:
-                log.error("Error adding %s: %s", machine.name, exc.to_dict())
-                raise BadRequestError({"msg": str(exc),
-                                       "errors": exc.to_dict()})
-            except me.NotUniqueError as exc:
-                log.error("Machine %s not unique error: %s", machine.name, exc)
-                raise ConflictError("Machine with this name already exists")
-        else:
-            log.debug("Not saving machine %s (%s) %s" % (
-                machine.name, machine.id, is_new))
-
-        machine.last_seen = now
-
-        return machine, is_new
+        return updated
 
     def _list_machines__update_generic_machine_state(self, machine):
         """Helper method to update the machine state
@@ -828,6 +1151,50 @@ class BaseComputeController(BaseController):
         """
         return 0, 0
 
+    def _list_machines__get_unreachable_parents(self):
+        """Return the machines whose children couldn't be listed
+
+        This is called after `self._list_machines__fetch_machines`. Children
+        of the returned machines, eg. the VMs of an unreachable hypervisor,
+        are neither marked as missing nor updated.
+
+        Subclasses MAY override this method.
+
+        """
+        return []
+
+    def _list_machines__get_pricing_index(self):
+        """Return the pricing index of the current `_list_machines` call
+
+        The index is built by `self._list_machines__build_pricing_index` the
+        first time it's requested during a `_list_machines` call, so that
+        `self._list_machines__cost_machine` can look up the price of each
+        machine in constant time.
+
+        Subclasses SHOULD NOT override this method.
+
+        """
+        if getattr(self, '_pricing_index', None) is None:
+            self._pricing_index = self._list_machines__build_pricing_index()
+        return self._pricing_index
+
+    def _list_machines__build_pricing_index(self):
+        """Build an index of the pricing of the cloud's sizes
+
+        Returns a dict of (size id, os type, region) tuples to the provider
+        specific pricing of each size. Parts of the key that the pricing
+        does not depend on are set to None.
+
+        The default implementation indexes the cloud's CloudSize documents,
+        which include the price in their extra, by external id.
+
+        Subclasses MAY override this method.
+
+        """
+        from mist.api.clouds.models import CloudSize
+        return {(size.external_id, None, None): size
+                for size in CloudSize.objects(cloud=self.cloud)}
+
     def _list_machines__fetch_generic_machines(self):
         """Return list of machine models that aren't handled by libcloud"""
         return []
@@ -941,13 +1308,31 @@ class BaseComputeController(BaseController):
         Subclasses MAY override this method.
 
         """
-        from mist.api.images.models import CloudImage
         # Fetch images, usually from libcloud connection.
         libcloud_images = self._list_images__fetch_images(search=search)
 
         log.info("List images returned %d results for %s.",
                  len(libcloud_images), self.cloud)
 
+        if config.IMAGES_BULK_RECONCILIATION:
+            images = self._list_images__reconcile_images(libcloud_images,
+                                                         search=search)
+        else:
+            images = self._list_images__update_images(libcloud_images,
+                                                      search=search)
+
+        # Sort images: Starred first, then alphabetically.
+        images.sort(key=lambda image: (not image.starred, image.name))
+
+        return images
+
+    def _list_images__update_images(self, libcloud_images, search=None):
+        """Store fetched images in the db one by one
+
+        Returns the images of the cloud that are not missing.
+
+        """
+        from mist.api.images.models import CloudImage
         images = []
 
         for img in libcloud_images:
@@ -957,41 +1342,14 @@ class BaseComputeController(BaseController):
             except CloudImage.DoesNotExist:
                 _image = CloudImage(cloud=self.cloud,
                                     external_id=img.id)
-            _image.name = img.name
-            _image.extra = copy.deepcopy(img.extra)
-            _image.missing_since = None
-            _image.os_type = self._list_images__get_os_type(img)
-            _image.os_distro = self._list_images__get_os_distro(img)
-            _image.min_disk_size = self._list_images__get_min_disk_size(img)
-            _image.min_memory_size = self._list_images__get_min_memory_size(img)  # noqa
-            _image.architecture = self._list_images__get_architecture(img)
-            _image.origin = self._list_images__get_origin(img)
-
-            try:
-                self._list_images__postparse_image(_image, img)
-            except Exception as exc:
-                log.exception("Error while post parsing image %s:%s for \
-                              %s\n%r", _image.id, img.name, self.cloud, exc)
-
-            if search:
-                _image.stored_after_search = True
+            self._list_images__update_image_fields(_image, img, search=search)
             try:
                 _image.save()
             except me.ValidationError as exc:
                 log.error("Error adding %s: %s", _image.name, exc.to_dict())
                 raise BadRequestError({"msg": exc.message,
                                        "errors": exc.to_dict()})
-            try:
-                self._list_images__get_available_locations(_image)
-            except Exception as exc:
-                log.error('Error adding image-location constraint: %s'
-                          % repr(exc))
-            try:
-                self._list_images__get_allowed_sizes(_image)
-            except Exception as exc:
-                log.error('Error adding image-size constraint: %s'
-                          % repr(exc))
-
+            self._list_images__update_constraints(_image)
             images.append(_image)
 
         # update missing_since for images not returned by libcloud
@@ -1009,12 +1367,131 @@ class BaseComputeController(BaseController):
             all_images = CloudImage.objects(cloud=self.cloud,
                                             missing_since=None)
             images = [img for img in all_images]
+        return images
 
-        # Sort images: Starred first, then alphabetically.
-        images.sort(key=lambda image: (not image.starred, image.name))
+    def _list_images__reconcile_images(self, libcloud_images, search=None):
+        """Reconcile fetched images with the images stored in the db
+
+        All images of the cloud are prefetched with a single query and
+        updated in memory. Only new and changed images are written, with a
+        single unordered bulk write that only sets the changed fields of
+        existing images. Only these have their location and size constraints
+        updated, unless the locations or sizes of the cloud have changed
+        since the last poll of this process, in which case all images do.
+
+        Returns the images of the cloud that are not missing, without
+        querying the db again.
+
+        """
+        from mist.api.clouds.models import CloudLocation, CloudSize
+        from mist.api.images.models import CloudImage
+
+        existing_images = {image.external_id: image
+                           for image in CloudImage.objects(cloud=self.cloud)}
+        constraints_fingerprint = (
+            sorted(CloudLocation.objects(cloud=self.cloud,
+                                         missing_since=None).scalar('id')),
+            sorted(CloudSize.objects(cloud=self.cloud,
+                                     missing_since=None).scalar('id')),
+        )
+        refresh_constraints = _image_constraints_fingerprints.get(
+            self.cloud.id) != constraints_fingerprint
+        images, changed = [], []
+        seen_ids = set()
+        for img in libcloud_images:
+            # Guard against duplicate image ids in the provider response.
+            if img.id in seen_ids:
+                continue
+            seen_ids.add(img.id)
+            _image = existing_images.get(img.id)
+            if _image is None:
+                _image = CloudImage(cloud=self.cloud, external_id=img.id)
+            self._list_images__update_image_fields(_image, img, search=search)
+            if _image._created or _image._get_changed_fields():
+                changed.append(_image)
+            images.append(_image)
+
+        # New images are upserted, in case another poll inserted them
+        # first, and existing ones only have their changed fields set, to
+        # not overwrite concurrent changes of other fields, such as starring
+        # the image.
+        failed = set(id(image) for image in bulk_save(
+            changed, upsert_on=('cloud', 'external_id')))
+        log.debug("Stored %d new or changed out of %d images for %s",
+                  len(changed) - len(failed), len(seen_ids), self.cloud)
+
+        images = [image for image in images if id(image) not in failed]
+        if refresh_constraints:
+            for image in images:
+                self._list_images__update_constraints(image)
+            if not failed:
+                _image_constraints_fingerprints[self.cloud.id] = \
+                    constraints_fingerprint
+        else:
+            for image in changed:
+                if id(image) not in failed:
+                    self._list_images__update_constraints(image)
 
+        if not search:
+            # update missing_since for images not returned by libcloud, but
+            # keep images stored after search, or imported from external repo
+            missing = []
+            for external_id, image in existing_images.items():
+                if external_id in seen_ids or image.missing_since is not None:
+                    continue
+                if image.stored_after_search:
+                    images.append(image)
+                else:
+                    missing.append(image.id)
+            if missing:
+                CloudImage.objects(id__in=missing).update(
+                    missing_since=datetime.datetime.utcnow())
         return images
 
+    def _list_images__update_image_fields(self, image, image_libcloud,
+                                          search=None):
+        """Update a CloudImage model in place from a libcloud image
+
+        This does not persist the image.
+
+        """
+        image.name = image_libcloud.name
+        # Sanitize keys the way validation would, so that unchanged extra
+        # compares equal to the stored one.
+        image.extra = sanitize_dict(copy.deepcopy(image_libcloud.extra))
+        image.missing_since = None
+        image.os_type = self._list_images__get_os_type(image_libcloud)
+        image.os_distro = self._list_images__get_os_distro(image_libcloud)
+        image.min_disk_size = self._list_images__get_min_disk_size(
+            image_libcloud)
+        image.min_memory_size = self._list_images__get_min_memory_size(
+            image_libcloud)
+        image.architecture = self._list_images__get_architecture(
+            image_libcloud)
+        image.origin = self._list_images__get_origin(image_libcloud)
+
+        try:
+            self._list_images__postparse_image(image, image_libcloud)
+        except Exception as exc:
+            log.exception("Error while post parsing image %s:%s for \
+                          %s\n%r", image.id, image_libcloud.name, self.cloud,
+                          exc)
+
+        if search:
+            image.stored_after_search = True
+
+    def _list_images__update_constraints(self, image):
+        try:
+            self._list_images__get_available_locations(image)
+        except Exception as exc:
+            log.error('Error adding image-location constraint: %s'
+                      % repr(exc))
+        try:
+            self._list_images__get_allowed_sizes(image)
+        except Exception as exc:
+            log.error('Error adding image-size constraint: %s'
+                      % repr(exc))
+
     def _list_images__fetch_images(self, search=None):
         """Fetch image listing in a libcloud compatible format
 
@@ -3410,6 +3887,11 @@ class BaseComputeController(BaseController):
         cached_machines_map = {
             machine["id"]: machine for machine in cached_machines}
 
+        if config.METERING_SINGLE_PASS:
+            self._update_metering_data__single_pass(cached_machines_map,
+                                                    machines_map)
+            return
+
         read_queries, metering_metrics = self._generate_metering_queries(
             cached_machines_map, machines_map)
 
@@ -3649,12 +4131,8 @@ class BaseComputeController(BaseController):
                 f" on metric: {metric_name}"
                 f" with machine_id: {machine_id}")
         if current_value is not None:
-            return (
-                f"{metric_name}{{org=\"{self.cloud.owner.id}\""
-                f",machine_id=\"{machine_id}\",metering=\"true\""
-                f",value_type=\"{properties['type']}\"}}"
-                f" {current_value} "
-                f"{int(datetime.datetime.timestamp(new_dt))}\n")
+            return self._format_metering_sample(
+                metric_name, machine_id, properties, current_value, new_dt)
         else:
             log.warning(
                 f"None value on metric: "
@@ -3706,6 +4184,153 @@ class BaseComputeController(BaseController):
         loop.close()
         return "".join(metering_data_list)
 
+    def _format_metering_sample(self, metric_name, machine_id, properties,
+                                value, dt):
+        return (
+            f"{metric_name}{{org=\"{self.cloud.owner.id}\""
+            f",machine_id=\"{machine_id}\",metering=\"true\""
+            f",value_type=\"{properties['type']}\"}}"
+            f" {value} "
+            f"{int(datetime.datetime.timestamp(dt))}\n")
+
+    def _get_cloud_metering_metrics(self):
+        """Return the metering metrics of the machines of this cloud
+
+        These are the default metrics, overridden by the metrics of the
+        cloud's provider and then by the metrics of the cloud's owner.
+        """
+        metrics = dict(config.METERING_METRICS.get("default", {}))
+        metrics.update(config.METERING_METRICS.get(self.cloud.provider, {}))
+        metrics.update(config.METERING_METRICS.get(self.cloud.owner.id, {}))
+        return metrics
+
+    def _update_metering_data__single_pass(self, cached_machines_map,
+                                           machines_map):
+        """Compute and send the metering data of all machines at once
+
+        The metering metrics are resolved once for the whole cloud and the
+        values of all machines are computed in a single pass. The last
+        values of counters that are missing from the samples stored at the
+        time of the previous poll are fetched with one query per metric for
+        all machines, instead of one per machine and metric.
+        """
+        metrics = self._get_cloud_metering_metrics()
+        owner_id = self.cloud.owner.id
+
+        # Fetch the counters stored at the time of the previous poll, with
+        # one query per distinct timestamp.
+        counters = "|".join(name for name, properties in metrics.items()
+                            if properties['type'] == "counter")
+        machines_by_dt = {}
+        for machine_id in machines_map:
+            cached_machine = cached_machines_map.get(machine_id)
+            if not cached_machine:
+                continue
+            dt = cached_machine["last_seen"] or cached_machine["missing_since"]
+            if dt:
+                machines_by_dt.setdefault(dt, []).append(machine_id)
+        read_queries = {}
+        if counters:
+            for dt, machine_ids in machines_by_dt.items():
+                read_queries[(dt, "cloud")] = (
+                    f"{{__name__=~\"{counters}\",org=\"{owner_id}\","
+                    f"machine_id=~\"{'|'.join(machine_ids)}\","
+                    f"metering=\"true\"}}")
+        last_metering_data = self._fetch_metering_data(read_queries,
+                                                       machines_map)
+
+        samples = []
+        missing_counters = {}
+        for machine_id, machine in machines_map.items():
+            if not machine.last_seen:
+                continue
+            new_dt = machine.last_seen
+            old_dt = None
+            cached_machine = cached_machines_map.get(machine_id)
+            if cached_machine and cached_machine["last_seen"]:
+                old_dt = datetime.datetime.strptime(
+                    cached_machine["last_seen"], '%Y-%m-%d %H:%M:%S.%f')
+            last_values = last_metering_data.get(machine_id, {})
+            for metric_name, properties in metrics.items():
+                value = None
+                if properties["type"] == "counter":
+                    old_value = last_values.get(metric_name)
+                    if not old_value:
+                        missing_counters.setdefault(
+                            metric_name, []).append(machine_id)
+                    else:
+                        value = float(old_value)
+                        # Take into account the time range only
+                        # if the machine was not missing
+                        if old_dt:
+                            delta_in_hours = (
+                                new_dt - old_dt).total_seconds() / (60 * 60)
+                            value += properties["value"](machine,
+                                                         delta_in_hours)
+                elif properties["type"] == "gauge":
+                    value = properties["value"](machine)
+                else:
+                    log.warning(
+                        f"Unknown metric type: {properties['type']}"
+                        f" on metric: {metric_name}"
+                        f" with machine_id: {machine_id}")
+                    continue
+                samples.append((metric_name, machine_id, properties, value,
+                                new_dt))
+
+        old_counter_values = {
+            metric_name: self._find_old_counter_values(
+                metric_name, machine_ids, metrics[metric_name])
+            for metric_name, machine_ids in missing_counters.items()}
+
+        def generate_lines():
+            for metric_name, machine_id, properties, value, dt in samples:
+                if value is None:
+                    value = old_counter_values.get(metric_name, {}).get(
+                        machine_id)
+                if value is None:
+                    log.warning(
+                        f"None value on metric: "
+                        f"{metric_name} with machine_id: {machine_id}")
+                    continue
+                yield self._format_metering_sample(
+                    metric_name, machine_id, properties, value, dt).encode()
+
+        self._send_metering_data(generate_lines())
+
+    def _find_old_counter_values(self, metric_name, machine_ids, properties):
+        """Return the last values of a counter for the given machines
+
+        Machines without any value in the lookback window get 0, whereas an
+        empty dict is returned if the query fails.
+        """
+        tenant = str(int(self.cloud.owner.id[:8], 16))
+        read_uri = config.VICTORIAMETRICS_URI.replace("<org_id>", tenant)
+        query = (
+            f"last_over_time("
+            f"{metric_name}{{org=\"{self.cloud.owner.id}\""
+            f",machine_id=~\"{'|'.join(machine_ids)}\",metering=\"true\""
+            f",value_type=\"{properties['type']}\"}}"
+            f"[{config.METERING_PROMQL_LOOKBACK}])"
+        )
+        error_msg = f"Could not fetch old counter values with query: {query}"
+        try:
+            data = requests.post(
+                f"{read_uri}/api/v1/query", data={"query": query}, timeout=20)
+        except requests.exceptions.RequestException as e:
+            error_details = str(e)
+            self._report_metering_error(error_msg, error_details)
+            return {}
+        if data and not data.ok:
+            error_details = f"code: {data.status_code} response: {data.text}"
+            self._report_metering_error(error_msg, error_details)
+            return {}
+
+        old_values = {machine_id: 0 for machine_id in machine_ids}
+        for result in data.json().get("data", {}).get("result", []):
+            old_values[result["metric"]["machine_id"]] = result["value"][1]
+        return old_values
+
     def _send_metering_data(self, fresh_metering_data):
         tenant = str(int(self.cloud.owner.id[:8], 16))
         error_msg = "Could not send metering data"
@@ -26,14 +26,17 @@ import socket
 import logging
 import datetime
 import netaddr
+import threading
 import tempfile
 import iso8601
 import pytz
 import asyncio
 import os
+import queue
 import json
 import time
 import secrets
+import hashlib
 import requests
 import ipaddress
 
@@ -73,9 +76,9 @@ from mist.api.exceptions import InternalServerError
 from mist.api.exceptions import MachineNotFoundError
 from mist.api.exceptions import BadRequestError
 from mist.api.exceptions import NotFoundError
+from mist.api.exceptions import CloudUnavailableError
 from mist.api.exceptions import ForbiddenError
 from mist.api.exceptions import CloudUnauthorizedError
-from mist.api.exceptions import CloudUnavailableError
 from mist.api.exceptions import MachineCreationError
 
 from mist.api.helpers import sanitize_host
@@ -84,6 +87,7 @@ from mist.api.helpers import node_to_dict
 from mist.api.helpers import generate_secure_password, validate_password
 
 from mist.api.clouds.controllers.main.base import BaseComputeController
+from mist.api.clouds.controllers.compute.base import get_cached_pricing
 
 from mist.api import config
 
@@ -207,23 +211,36 @@ class AmazonComputeController(BaseComputeController):
         if node_dict['state'] == NodeState.STOPPED.value:
             return 0, 0
 
-        sizes = self.connection.list_sizes()
+        pricing = self._list_machines__get_pricing_index()
         size = node_dict['extra'].get('instance_type')
-        for node_size in sizes:
-            if node_size.id == size and node_size.price:
-                if isinstance(node_size.price, dict):
-                    plan_price = node_size.price.get(machine.os_type)
-                    if not plan_price:
-                        # Use the default which is linux.
-                        plan_price = node_size.price.get('linux')
-                else:
-                    plan_price = node_size.price
-                if isinstance(plan_price, float) or isinstance(plan_price,
-                                                               int):
-                    return plan_price, 0
+        region = self.cloud.region
+        plan_price = pricing.get((size, machine.os_type, region)) or \
+            pricing.get((size, None, region))
+        if not plan_price:
+            # Use the default which is linux.
+            plan_price = pricing.get((size, 'linux', region))
+        if not plan_price:
+            return 0, 0
+        if isinstance(plan_price, float) or isinstance(plan_price, int):
+            return plan_price, 0
+        return plan_price.replace('/hour', '').replace('$', ''), 0
+
+    def _list_machines__build_pricing_index(self):
+        region = self.cloud.region
+
+        def build_index():
+            index = {}
+            for size in self.connection.list_sizes():
+                if not size.price:
+                    continue
+                if isinstance(size.price, dict):
+                    for os_type, price in size.price.items():
+                        index.setdefault((size.id, os_type, region), price)
                 else:
-                    return plan_price.replace('/hour', '').replace('$', ''), 0
-        return 0, 0
+                    index.setdefault((size.id, None, region), size.price)
+            return index
+
+        return get_cached_pricing(('ec2', region), build_index)
 
     def _list_machines__get_location(self, node):
         return node['extra'].get('availability')
@@ -584,8 +601,10 @@ class AlibabaComputeController(AmazonComputeController):
     def _list_machines__cost_machine(self, machine, node_dict):
         size = node_dict['extra'].get('instance_type', {})
         driver_name = 'ecs-' + node_dict['extra'].get('zone_id')
-        price = get_pricing(
-            driver_type='compute', driver_name=driver_name).get(size, {})
+        price = get_cached_pricing(
+            ('compute', driver_name),
+            lambda: get_pricing(driver_type='compute',
+                                driver_name=driver_name)).get(size, {})
         image = node_dict['extra'].get('image_id', '')
         if 'win' in image:
             price = price.get('windows', '')
@@ -1194,11 +1213,10 @@ class LinodeComputeController(BaseComputeController):
             return 0, price or 0
         else:
             size = node_dict.get('size')
-            from mist.api.clouds.models import CloudSize
+            pricing = self._list_machines__get_pricing_index()
             try:
-                _size = CloudSize.objects.get(external_id=size,
-                                              cloud=self.cloud)
-            except CloudSize.DoesNotExist:
+                _size = pricing[(size, None, None)]
+            except KeyError:
                 raise NotFoundError()
 
             price_per_month = _size.extra.get('monthly_price', 0.0)
@@ -2195,10 +2213,14 @@ class GoogleComputeController(BaseComputeController):
         elif 'ssd' in disk_type:
             disk_type = 'SSD'
 
-        disk_prices = get_pricing(driver_type='compute',
-                                  driver_name='gce_disks')[disk_type]
-        gce_instance = get_pricing(driver_type='compute',
-                                   driver_name='gce_instances')[size_type]
+        disk_prices = get_cached_pricing(
+            ('compute', 'gce_disks'),
+            lambda: get_pricing(driver_type='compute',
+                                driver_name='gce_disks'))[disk_type]
+        gce_instance = get_cached_pricing(
+            ('compute', 'gce_instances'),
+            lambda: get_pricing(driver_type='compute',
+                                driver_name='gce_instances'))[size_type]
         cpu_price = 0
         ram_price = 0
         os_price = 0
@@ -2682,17 +2704,17 @@ class EquinixMetalComputeController(BaseComputeController):
 
     def _list_machines__cost_machine(self, machine, node_dict):
         size = node_dict['extra'].get('plan')
-        from mist.api.clouds.models import CloudSize
+        pricing = self._list_machines__get_pricing_index()
         try:
-            _size = CloudSize.objects.get(external_id=size, cloud=self.cloud)
-        except CloudSize.DoesNotExist:
+            _size = pricing[(size, None, None)]
+        except KeyError:
             # for some sizes, part of the name instead of id is returned
             # eg. t1.small.x86 for size is returned for size with external_id
             # baremetal_0 and name t1.small.x86 - 8192 RAM
-            try:
-                _size = CloudSize.objects.get(cloud=self.cloud,
-                                              name__contains=size)
-            except CloudSize.DoesNotExist:
+            for _size in pricing.values():
+                if size in (_size.name or ''):
+                    break
+            else:
                 raise NotFoundError()
         price = _size.extra.get('price', 0.0)
         if machine.extra.get('billing_cycle') == 'hourly':
@@ -2935,12 +2957,11 @@ class VultrComputeController(BaseComputeController):
         return created_at
 
     def _list_machines__cost_machine(self, machine, node_dict):
-        from mist.api.clouds.models import CloudSize
         external_id = node_dict.get('size')
         try:
-            size_ = CloudSize.objects.get(external_id=external_id,
-                                          cloud=self.cloud)
-        except CloudSize.DoesNotExist:
+            size_ = self._list_machines__get_pricing_index()[
+                (external_id, None, None)]
+        except KeyError:
             log.error("Machine's size with external_id: %s not found",
                       external_id)
             return 0, 0
@@ -4375,6 +4396,105 @@ class LXDComputeController(BaseComputeController):
                                                          ca_cert=ca_cert)
 
 
+# Libvirt drivers of hypervisors reused across polls, see
+# `LibvirtComputeController._get_cached_host_driver`.
+_libvirt_drivers = {}
+_libvirt_drivers_lock = threading.Lock()
+# Listings of hypervisors that are still running, by hypervisor id, so that a
+# hypervisor that hangs isn't listed again by every poll.
+_libvirt_listings = {}
+_libvirt_event_loop = None
+_libvirt_pool = None
+_libvirt_pool_pid = None
+
+
+def _close_libvirt_driver(driver):
+    try:
+        driver.disconnect()
+    except AttributeError:
+        pass
+    except Exception as exc:
+        log.error("Error disconnecting libvirt driver '%s': %r", driver, exc)
+
+
+def start_libvirt_event_loop():
+    """Run libvirt's event loop in a thread, needed to send keepalives
+
+    It's started once per process, before the first libvirt connection of
+    the process is opened, see `LibvirtComputeController._connect_host`.
+    Connections opened without it have no keepalive, so calls to a
+    hypervisor that stops responding may block forever.
+
+    """
+    global _libvirt_event_loop
+    with _libvirt_drivers_lock:
+        if _libvirt_event_loop is not None and \
+                _libvirt_event_loop.is_alive():
+            return
+        import libvirt
+        # The implementation is inherited by forked processes, but not the
+        # thread running it.
+        if _libvirt_event_loop is None:
+            libvirt.virEventRegisterDefaultImpl()
+
+        def run():
+            while True:
+                libvirt.virEventRunDefaultImpl()
+
+        _libvirt_event_loop = threading.Thread(target=run,
+                                               name='LibvirtEventLoop')
+        _libvirt_event_loop.daemon = True
+        _libvirt_event_loop.start()
+
+
+class _LibvirtListingPool(object):
+    """A bounded pool of daemon threads listing hypervisors
+
+    Unlike the threads of a ThreadPoolExecutor, daemon threads are not joined
+    when the interpreter exits, so a listing that hangs can't keep a worker
+    from exiting or restarting.
+
+    """
+
+    def __init__(self, workers):
+        self.queue = queue.Queue()
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work,
+                                      name='list_libvirt_%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, func, *args):
+        from concurrent.futures import Future
+        future = Future()
+        self.queue.put((future, func, args))
+        return future
+
+    def _work(self):
+        while True:
+            future, func, args = self.queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args))
+            except BaseException as exc:
+                future.set_exception(exc)
+
+
+def _get_libvirt_pool():
+    """Return the pool shared by all libvirt listings of the process"""
+    global _libvirt_pool, _libvirt_pool_pid
+    with _libvirt_drivers_lock:
+        # Threads don't survive forking, so start a new pool in each process.
+        if _libvirt_pool is None or _libvirt_pool_pid != os.getpid():
+            _libvirt_pool = _LibvirtListingPool(
+                config.LIBVIRT_MAX_CONCURRENT_HOSTS)
+            _libvirt_pool_pid = os.getpid()
+        return _libvirt_pool
+
+
 class LibvirtComputeController(BaseComputeController):
 
     def _connect(self, **kwargs):
@@ -4395,6 +4515,11 @@ class LibvirtComputeController(BaseComputeController):
         libvirt_driver = libcloud.compute.drivers.libvirt_driver
         libvirt_driver.ALLOW_LIBVIRT_LOCALHOST = config.ALLOW_LIBVIRT_LOCALHOST
 
+        machine, key_association = self._get_host_key_association(machine)
+        return self._connect_host(machine, key_association)
+
+    def _get_host_key_association(self, machine):
+        """Return the hypervisor of `machine` and the key to connect with"""
         if not machine.extra.get('tags', {}).get('type') == 'hypervisor':
             machine = machine.parent
 
@@ -4407,13 +4532,34 @@ class LibvirtComputeController(BaseComputeController):
             or KeyMachineAssociation.objects(machine=machine)
         if not key_associations:
             raise ForbiddenError()
+        return machine, key_associations[0]
 
+    def _connect_host(self, machine, key_association):
         host, port = dnat(machine.cloud.owner,
                           machine.hostname, machine.ssh_port)
+        try:
+            start_libvirt_event_loop()
+        except Exception as exc:
+            log.warning('Failed to start the libvirt event loop: %r', exc)
+        if host not in ('localhost', '127.0.0.1'):
+            # Libvirt's SSH transport has no connect timeout of its own.
+            socket.create_connection(
+                (host, int(port)),
+                timeout=config.LIBVIRT_CONNECT_TIMEOUT).close()
         driver = get_driver(Provider.LIBVIRT)(
             host, hypervisor=machine.hostname, ssh_port=int(port),
-            user=key_associations[0].ssh_user,
-            ssh_key=key_associations[0].key.private)
+            user=key_association.ssh_user,
+            ssh_key=key_association.key.private)
+        try:
+            # Calls on a connection that stops responding fail, instead of
+            # blocking forever. Libvirt closes the connection after
+            # LIBVIRT_KEEPALIVE_COUNT keepalives are left unanswered, which
+            # requires its event loop, see `start_libvirt_event_loop`.
+            driver.connection.setKeepAlive(config.LIBVIRT_KEEPALIVE_INTERVAL,
+                                           config.LIBVIRT_KEEPALIVE_COUNT)
+        except Exception as exc:
+            log.warning('Failed to set keepalive of libvirt connection to '
+                        '%s: %r', machine, exc)
 
         return driver
 
@@ -4421,15 +4567,57 @@ class LibvirtComputeController(BaseComputeController):
         driver = self._get_host_driver(host)
         return driver.list_nodes()
 
-    async def list_machines_all_hosts(self, hosts, loop):
-        vms = [
-            loop.run_in_executor(None, self.list_machines_single_host, host)
-            for host in hosts
-        ]
-        return await asyncio.gather(*vms)
+    def _get_cached_host_driver(self, host):
+        """Return a driver of `host`, reusing the one of a previous poll
+
+        Drivers are kept for `config.LIBVIRT_DRIVER_TTL` seconds, so that
+        polls don't have to reconnect every time. A driver is replaced as
+        soon as the host's address, ssh user or key changes.
+
+        """
+        host, key_association = self._get_host_key_association(host)
+        key = key_association.key
+        credentials = (host.hostname, host.ssh_port, key_association.ssh_user,
+                       key.id, hashlib.sha256(
+                           (key.private or '').encode()).hexdigest())
+        now = time.time()
+        with _libvirt_drivers_lock:
+            cached = _libvirt_drivers.get(host.id)
+        if cached is not None and cached[0] > now and \
+                cached[1] == credentials:
+            return cached[2]
+        driver = self._connect_host(host, key_association)
+        with _libvirt_drivers_lock:
+            replaced = _libvirt_drivers.get(host.id)
+            _libvirt_drivers[host.id] = (now + config.LIBVIRT_DRIVER_TTL,
+                                         credentials, driver)
+        if replaced is not None:
+            _close_libvirt_driver(replaced[2])
+        return driver
+
+    def _evict_cached_host_driver(self, host):
+        with _libvirt_drivers_lock:
+            evicted = _libvirt_drivers.pop(host.id, None)
+        if evicted is not None:
+            _close_libvirt_driver(evicted[2])
+
+    def _list_nodes_of_host(self, host):
+        try:
+            return self._get_cached_host_driver(host).list_nodes()
+        except ForbiddenError:
+            raise
+        except Exception as exc:
+            # The cached connection may have been closed, retry once.
+            log.warning('Failed to list nodes of %s, reconnecting: %r',
+                        host, exc)
+            self._evict_cached_host_driver(host)
+            return self._get_cached_host_driver(host).list_nodes()
 
     def _list_machines__fetch_machines(self):
+        if config.LIBVIRT_CONCURRENT_LISTING:
+            return self._list_machines__fetch_machines_concurrently()
         from mist.api.machines.models import Machine
+        self._unreachable_hosts = []
         nodes = []
         for machine in Machine.objects.filter(cloud=self.cloud,
                                               missing_since=None):
@@ -4437,9 +4625,98 @@ class LibvirtComputeController(BaseComputeController):
                 driver = self._get_host_driver(machine)
                 nodes += [node_to_dict(node)
                           for node in driver.list_nodes()]
+        return nodes
+
+    def _list_machines__fetch_machines_concurrently(self):
+        """List the nodes of all hypervisors concurrently
 
+        Hypervisors are listed on a pool shared by all polls of the process,
+        so at most `config.LIBVIRT_MAX_CONCURRENT_HOSTS` hypervisors are
+        listed at a time. Hypervisors that fail or don't respond within
+        `config.LIBVIRT_HOST_TIMEOUT` seconds of being contacted are
+        skipped, and their VMs are not marked as missing. So are hypervisors
+        whose listing by a previous poll is still running. A listing that
+        hangs is left running until the connection's keepalive fails it.
+
+        """
+        from concurrent.futures import wait
+        from concurrent.futures import FIRST_COMPLETED
+        from mist.api.machines.models import Machine
+        hosts = [machine for machine in Machine.objects(cloud=self.cloud,
+                                                        missing_since=None)
+                 if machine.extra.get('tags', {}).get('type') == 'hypervisor']
+        self._unreachable_hosts = []
+        if not hosts:
+            return []
+
+        started = {}
+
+        def list_nodes(host):
+            started[host.id] = time.time()
+            return self._list_nodes_of_host(host)
+
+        workers = min(len(hosts), config.LIBVIRT_MAX_CONCURRENT_HOSTS)
+        # Hosts wait in the pool's queue for a free worker, but hosts that
+        # time out keep their worker busy, so also bound the whole run.
+        rounds = -(-len(hosts) // workers)
+        deadline = time.time() + config.LIBVIRT_HOST_TIMEOUT * rounds
+        pool = _get_libvirt_pool()
+        futures = {}
+        busy_hosts = []
+        with _libvirt_drivers_lock:
+            for host in hosts:
+                if host.id in _libvirt_listings:
+                    busy_hosts.append(host)
+                    continue
+                future = pool.submit(list_nodes, host)
+                _libvirt_listings[host.id] = future
+                future.add_done_callback(
+                    lambda future, host_id=host.id: _libvirt_listings.pop(
+                        host_id, None))
+                futures[future] = host
+        for host in busy_hosts:
+            log.warning('Still listing nodes of %s from a previous poll',
+                        host)
+            self._unreachable_hosts.append(host)
+        pending = set(futures)
+        while pending:
+            now = time.time()
+            if now >= deadline:
+                break
+            for future in list(pending):
+                host_started = started.get(futures[future].id)
+                if host_started is not None and \
+                        now - host_started >= config.LIBVIRT_HOST_TIMEOUT:
+                    pending.discard(future)
+            # Hosts start while waiting, so check them at least every second.
+            _, pending = wait(pending, timeout=min(1, deadline - now),
+                              return_when=FIRST_COMPLETED)
+
+        nodes = []
+        for future, host in futures.items():
+            if future.cancel():
+                # Still waiting for a free worker, busy with other polls.
+                log.warning('Timed out waiting to list nodes of %s', host)
+                self._unreachable_hosts.append(host)
+            elif not future.done():
+                # Left running until the connection's keepalive fails it.
+                log.warning('Timed out listing nodes of %s', host)
+                self._evict_cached_host_driver(host)
+                self._unreachable_hosts.append(host)
+            elif future.exception() is not None:
+                log.warning('Failed to list nodes of %s: %r',
+                            host, future.exception())
+                self._unreachable_hosts.append(host)
+            else:
+                nodes += [node_to_dict(node) for node in future.result()]
+
+        if len(self._unreachable_hosts) == len(hosts):
+            raise CloudUnavailableError('All hypervisors are unreachable')
         return nodes
 
+    def _list_machines__get_unreachable_parents(self):
+        return [host.id for host in getattr(self, '_unreachable_hosts', [])]
+
     def _list_machines__fetch_generic_machines(self):
         machines = []
         from mist.api.machines.models import Machine
@@ -4727,8 +5004,9 @@ class LibvirtComputeController(BaseComputeController):
             self.cloud.hosts.remove(machine.id)
             self.cloud.save()
         if amqp_owner_listening(self.cloud.owner.id):
-            old_machines = [m.as_dict() for m in
-                            self.cloud.ctl.compute.list_cached_machines()]
+            from mist.api.machines.models import machines_as_dict
+            old_machines = machines_as_dict(
+                self.cloud.ctl.compute.list_cached_machines())
             new_machines = self.cloud.ctl.compute.list_machines()
             self.cloud.ctl.compute.produce_and_publish_patch(
                 old_machines, new_machines)
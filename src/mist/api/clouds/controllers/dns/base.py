@@ -16,6 +16,8 @@ import mongoengine as me
 
 import mist.api.exceptions
 
+from mist.api import config
+
 from mist.api.concurrency.models import PeriodicTaskInfo
 
 from mist.api.clouds.controllers.base import BaseController
@@ -23,6 +25,8 @@ from mist.api.clouds.controllers.base import BaseController
 from mist.api.helpers import amqp_publish_user
 from mist.api.helpers import amqp_owner_listening
 
+from mist.api.mongoengine_extras import bulk_save
+
 from libcloud.common.types import InvalidCredsError
 from libcloud.dns.types import ZoneDoesNotExistError, RecordDoesNotExistError
 
@@ -212,13 +216,16 @@ class BaseDNSController(BaseController):
         """
         Public method to return a list of  records under a specific zone.
         """
+        if config.DNS_RECORDS_BULK_RECONCILIATION:
+            return self._list_records__reconcile_records(zone)
+
         # Fetch records from libcloud connection.
         pr_records = self._list_records__fetch_records(zone.zone_id)
 
         # TODO: Adding here for circular dependency issue. Need to fix this.
         from mist.api.dns.models import Record, RECORDS
 
-        records = []
+        records = {}
         new_records = []
         for pr_record in pr_records:
             dns_cls = RECORDS[pr_record.type]
@@ -272,11 +279,9 @@ class BaseDNSController(BaseController):
             # There's a chance that we have received duplicate records as for
             # example for Route NS records, so skip adding it to the list if we
             # already have it
-            for rec in records:
-                if rec.record_id == record.record_id:
-                    records.remove(rec)
-                    break
-            records.append(record)
+            records.pop(record.record_id, None)
+            records[record.record_id] = record
+        records = list(records.values())
         self.cloud.owner.mapper.update(new_records)
 
         # Then delete any records that are in the DB for this zone but were not
@@ -290,18 +295,112 @@ class BaseDNSController(BaseController):
         # Format zone information.
         return records
 
+    def _list_records__reconcile_records(self, zone):
+        """Reconcile the records of a zone with the records stored in the db
+
+        The zone's records are prefetched with a single query and indexed by
+        their provider id. Records are fetched from the provider in pages
+        when it supports it, each page is diffed against the index in memory
+        and the resulting inserts and updates are flushed with one unordered
+        bulk write per `DNS_RECORDS_BATCH_SIZE` changed records. Records that
+        were not returned by the provider are soft deleted in batches.
+
+        """
+        from mist.api.dns.models import Record, RECORDS
+
+        existing = {}
+        for record in Record.objects(zone=zone, deleted=None):
+            # Avoid dereferencing the zone of every record.
+            record._data['zone'] = zone
+            existing[record.record_id] = record
+
+        records = {}
+        new_records = []
+        # Changed records by provider id, so that a record returned more than
+        # once is written once, with the data of all its occurrences.
+        pending = {}
+        failed = set()
+
+        def flush():
+            failed.update(id(record) for record in bulk_save(
+                list(pending.values())))
+            pending.clear()
+
+        for pr_record in self._list_records__iterate_records(zone.zone_id):
+            # Duplicate records, as for example Route53 NS records, update
+            # the same record.
+            record = records.get(pr_record.id)
+            if record is None:
+                record = existing.get(pr_record.id)
+            if record is None:
+                if pr_record.type not in RECORDS:
+                    log.error("Unsupported record type '%s'", pr_record.type)
+                    continue
+                log.info("Record: %s not in the database, creating.",
+                         pr_record.id)
+                record = RECORDS[pr_record.type](record_id=pr_record.id,
+                                                 zone=zone)
+                new_records.append(record)
+            record.name = pr_record.name or ""
+            record.type = pr_record.type
+            record.ttl = pr_record.ttl
+            record.extra = pr_record.extra
+            self._list_records__postparse_data(pr_record, record)
+            records[pr_record.id] = record
+
+            if record._created or record._get_changed_fields():
+                pending[pr_record.id] = record
+                if len(pending) >= config.DNS_RECORDS_BATCH_SIZE:
+                    flush()
+        flush()
+
+        # Records that failed to be inserted don't exist in the db.
+        seen = set(records)
+        records = [record for record in records.values()
+                   if not (record._created and id(record) in failed)]
+        new_records = [record for record in new_records
+                       if id(record) not in failed]
+        self.cloud.owner.mapper.update(new_records)
+
+        # Then soft delete any records that are in the DB for this zone but
+        # were not returned by the provider.
+        deleted = [record.id for record_id, record in existing.items()
+                   if record_id not in seen]
+        now = datetime.datetime.utcnow()
+        for i in range(0, len(deleted), config.DNS_RECORDS_BATCH_SIZE):
+            Record.objects(
+                id__in=deleted[i:i + config.DNS_RECORDS_BATCH_SIZE],
+                deleted=None).update(set__deleted=now)
+        return records
+
     def _list_records__fetch_records(self, zone_id):
         """Returns all available records on a specific zone. """
+        return list(self._list_records__iterate_records(zone_id))
+
+    def _list_records__iterate_records(self, zone_id):
+        """Iterate over the records of a specific zone
+
+        Records are fetched in pages from providers whose libcloud driver
+        supports it, otherwise they are all fetched at once.
+
+        """
 
         # Try to get the list of DNS records under a specific zone from
         # the provider API.
         # We cannot call list_records() with the zone_id, we need to provide
         # a zone object. We will get that by calling the get_zone() method.
+        num_records = 0
         try:
-            records = self.connection.get_zone(zone_id).list_records()
+            pr_zone = self.connection.get_zone(zone_id)
+            try:
+                pr_records = self.connection.iterate_records(pr_zone)
+            except NotImplementedError:
+                pr_records = pr_zone.list_records()
+            for pr_record in pr_records:
+                num_records += 1
+                yield pr_record
             log.info("List records returned %d results for %s.",
-                     len(records), self.cloud)
-            return records
+                     num_records, self.cloud)
         except InvalidCredsError as exc:
             log.warning("Invalid creds on running list_recordss on %s: %s",
                         self.cloud, exc)
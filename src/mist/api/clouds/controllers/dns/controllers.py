@@ -161,13 +161,13 @@ class LinodeDNSController(BaseDNSController):
                 zone.extra['updated'] = zone.extra['updated'].isoformat()
         return zones
 
-    def _list_records__fetch_records(self, zone_id):
+    def _list_records__iterate_records(self, zone_id):
         """
         Overridden to convert datetime objects to isoformat in order to
         be json serializable
         """
         records = super(
-            LinodeDNSController, self)._list_records__fetch_records(zone_id)
+            LinodeDNSController, self)._list_records__iterate_records(zone_id)
         from datetime import datetime
         for record in records:
             if 'created' in record.extra and \
@@ -176,7 +176,7 @@ class LinodeDNSController(BaseDNSController):
             if 'updated' in record.extra and \
                     isinstance(record.extra['updated'], datetime):
                 record.extra['updated'] = record.extra['updated'].isoformat()
-        return records
+            yield record
 
 
 class RackSpaceDNSController(BaseDNSController):
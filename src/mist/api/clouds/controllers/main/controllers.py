@@ -321,7 +321,7 @@ class LibvirtMainController(BaseMainController):
     # TODO: fail_on_error True or False by default?
     def add(self, fail_on_error=True, fail_on_invalid_params=False, **kwargs):
         self.cloud.hosts = []
-        from mist.api.machines.models import Machine
+        from mist.api.machines.models import Machine, machines_as_dict
         if not kwargs.get('hosts'):
             raise RequiredParameterMissingError('hosts')
         try:
@@ -432,8 +432,8 @@ class LibvirtMainController(BaseMainController):
         # if not, delete the cloud and raise
         if Machine.objects(cloud=self.cloud):
             if amqp_owner_listening(self.cloud.owner.id):
-                old_machines = [m.as_dict() for m in
-                                self.cloud.ctl.compute.list_cached_machines()]
+                old_machines = machines_as_dict(
+                    self.cloud.ctl.compute.list_cached_machines())
                 new_machines = self.cloud.ctl.compute.list_machines()
                 self.cloud.ctl.compute.produce_and_publish_patch(
                     old_machines, new_machines)
@@ -481,7 +481,7 @@ class LibvirtMainController(BaseMainController):
             'username': ssh_user
         }
 
-        from mist.api.machines.models import Machine
+        from mist.api.machines.models import Machine, machines_as_dict
         # Create and save machine entry to database.
         # first check if the host has already been added to the cloud
         try:
@@ -545,8 +545,7 @@ class LibvirtMainController(BaseMainController):
                 # make sure that host just added becomes visible
                 if cached_machine.id != machine.id:
                     old_machines.append(cached_machine)
-            old_machines = [m.as_dict() for m in
-                            old_machines]
+            old_machines = machines_as_dict(old_machines)
             self.cloud.ctl.compute.produce_and_publish_patch(
                 old_machines, new_machines)
 
@@ -707,9 +706,10 @@ class OtherMainController(BaseMainController):
 
         This is a special method that exists only on this Cloud subclass.
         """
+        from mist.api.machines.models import machines_as_dict
 
-        old_machines = [m.as_dict() for m in
-                        self.cloud.ctl.compute.list_cached_machines()]
+        old_machines = machines_as_dict(
+            self.cloud.ctl.compute.list_cached_machines())
 
         # FIXME: Move ssh command to Machine controller once it is migrated.
         from mist.api.methods import ssh_command
@@ -8,19 +8,25 @@ are in `mist.api.clouds.controllers.network.controllers`.
 
 """
 
+import os
 import asyncio
 import json
 import copy
 import logging
 import time
 import datetime
+import threading
 import mongoengine.errors
 
+from concurrent.futures import ThreadPoolExecutor
+
 import jsonpatch
 from requests import ConnectionError
 
 import mist.api.exceptions
 
+from mist.api import config
+
 from mist.api.clouds.utils import LibcloudExceptionHandler
 from mist.api.clouds.controllers.base import BaseController
 
@@ -29,8 +35,28 @@ from mist.api.concurrency.models import PeriodicTaskInfo
 from mist.api.helpers import amqp_publish_user
 from mist.api.helpers import amqp_owner_listening
 
+from mist.api.mongoengine_extras import bulk_save
+
 log = logging.getLogger(__name__)
 
+_subnets_executor = None
+_subnets_executor_pid = None
+_subnets_executor_lock = threading.Lock()
+
+
+def _get_subnets_executor():
+    """Return the executor shared by all subnet listings of the process"""
+    global _subnets_executor, _subnets_executor_pid
+    with _subnets_executor_lock:
+        # Threads don't survive forking, so start a new executor in each
+        # process.
+        if _subnets_executor is None or _subnets_executor_pid != os.getpid():
+            _subnets_executor = ThreadPoolExecutor(
+                max_workers=config.SUBNETS_LISTING_WORKERS,
+                thread_name_prefix='list_subnets')
+            _subnets_executor_pid = os.getpid()
+        return _subnets_executor
+
 
 class BaseNetworkController(BaseController):
     """Abstract base class for networking-specific subcontrollers.
@@ -251,10 +277,18 @@ class BaseNetworkController(BaseController):
             except RuntimeError:
                 asyncio.set_event_loop(asyncio.new_event_loop())
                 loop = asyncio.get_event_loop()
-            subnets = [
-                loop.run_in_executor(None, network.ctl.list_subnets)
-                for network in networks
-            ]
+            # Subnets of all clouds are listed on a shared executor and
+            # each cloud may only occupy a limited number of its threads.
+            executor = _get_subnets_executor()
+            semaphore = asyncio.Semaphore(
+                config.SUBNETS_LISTING_CONCURRENCY_PER_CLOUD)
+
+            async def _list_subnets(network):
+                async with semaphore:
+                    return await loop.run_in_executor(
+                        executor, network.ctl.list_subnets)
+
+            subnets = [_list_subnets(network) for network in networks]
             return await asyncio.gather(*subnets)
 
         with task.task_runner(persist=persist):
@@ -262,14 +296,28 @@ class BaseNetworkController(BaseController):
             cached_networks = {'%s-%s' % (n.id, n.network_id): n.as_dict()
                                for n in self.list_cached_networks()}
             networks = self._list_networks()
-            try:
-                loop = asyncio.get_event_loop()
-                if loop.is_closed():
-                    raise RuntimeError('loop is closed')
-            except RuntimeError:
-                asyncio.set_event_loop(asyncio.new_event_loop())
-                loop = asyncio.get_event_loop()
-            loop.run_until_complete(_list_subnets_async(networks))
+            libcloud_subnets = None
+            if config.SUBNETS_BULK_RECONCILIATION:
+                libcloud_subnets = self._list_subnets__fetch_all_subnets()
+            if libcloud_subnets is not None:
+                # All subnets were fetched at once, no need for more calls.
+                subnets_by_network = {}
+                for subnet in libcloud_subnets:
+                    network_id = self._list_subnets__get_network_id(subnet)
+                    subnets_by_network.setdefault(network_id, []).append(
+                        subnet)
+                self._list_subnets__reconcile_subnets([
+                    (network, subnets_by_network.get(network.network_id, []))
+                    for network in networks])
+            else:
+                try:
+                    loop = asyncio.get_event_loop()
+                    if loop.is_closed():
+                        raise RuntimeError('loop is closed')
+                except RuntimeError:
+                    asyncio.set_event_loop(asyncio.new_event_loop())
+                    loop = asyncio.get_event_loop()
+                loop.run_until_complete(_list_subnets_async(networks))
 
         # Publish patches to rabbitmq.
         new_networks = {'%s-%s' % (n.id, n.network_id): n.as_dict()
@@ -431,7 +479,7 @@ class BaseNetworkController(BaseController):
         return
 
     @LibcloudExceptionHandler(mist.api.exceptions.SubnetListingError)
-    def list_subnets(self, network, **kwargs):
+    def list_subnets(self, network, libcloud_subnets=None, **kwargs):
         """Lists all Subnets attached to a Network present on the Cloud.
 
         Currently EC2, Openstack and GCE clouds are supported.
@@ -458,7 +506,12 @@ class BaseNetworkController(BaseController):
         # import issues are resolved
         from mist.api.networks.models import Subnet, SUBNETS
 
-        libcloud_subnets = self._list_subnets__fetch_subnets(network)
+        if libcloud_subnets is None:
+            libcloud_subnets = self._list_subnets__fetch_subnets(network)
+
+        if config.SUBNETS_BULK_RECONCILIATION:
+            return self._list_subnets__reconcile_subnets(
+                [(network, libcloud_subnets)])[network.id]
 
         # List of Subnet mongoengine objects to be returned to the API.
         subnets = []
@@ -470,29 +523,7 @@ class BaseNetworkController(BaseController):
                 subnet = SUBNETS[self.provider](network=network,
                                                 subnet_id=libcloud_subnet.id)
 
-            subnet.name = libcloud_subnet.name
-            subnet.extra = copy.copy(libcloud_subnet.extra)
-            subnet.missing_since = None
-
-            # Get the Subnet's CIDR.
-            try:
-                subnet.cidr = self._list_subnets__cidr_range(subnet,
-                                                             libcloud_subnet)
-            except Exception as exc:
-                log.exception('Failed to get the CIDR of %s: %s', subnet, exc)
-
-            # Apply cloud-specific processing.
-            try:
-                self._list_subnets__postparse_subnet(subnet, libcloud_subnet)
-            except Exception as exc:
-                log.exception('Error while post-parsing %s: %s', subnet, exc)
-
-            # Ensure JSON-encoding.
-            for key, value in subnet.extra.items():
-                try:
-                    json.dumps(value)
-                except TypeError:
-                    subnet.extra[key] = str(value)
+            self._list_subnets__update_subnet(subnet, libcloud_subnet)
 
             try:
                 subnet.save()
@@ -515,6 +546,90 @@ class BaseNetworkController(BaseController):
 
         return subnets
 
+    def _list_subnets__update_subnet(self, subnet, libcloud_subnet):
+        """Update a Subnet model in place from a libcloud subnet
+
+        This does not persist the subnet.
+
+        """
+        subnet.name = libcloud_subnet.name
+        subnet.extra = copy.copy(libcloud_subnet.extra)
+        subnet.missing_since = None
+
+        # Get the Subnet's CIDR.
+        try:
+            subnet.cidr = self._list_subnets__cidr_range(subnet,
+                                                         libcloud_subnet)
+        except Exception as exc:
+            log.exception('Failed to get the CIDR of %s: %s', subnet, exc)
+
+        # Apply cloud-specific processing.
+        try:
+            self._list_subnets__postparse_subnet(subnet, libcloud_subnet)
+        except Exception as exc:
+            log.exception('Error while post-parsing %s: %s', subnet, exc)
+
+        # Ensure JSON-encoding.
+        for key, value in subnet.extra.items():
+            try:
+                json.dumps(value)
+            except TypeError:
+                subnet.extra[key] = str(value)
+
+    def _list_subnets__reconcile_subnets(self, networks_subnets):
+        """Reconcile fetched subnets with the subnets stored in the db
+
+        `networks_subnets` is a list of networks, along with their libcloud
+        subnets. All subnets of these networks are prefetched with a single
+        query, every libcloud subnet is diffed against its subnet in memory
+        and all resulting inserts and updates, as well as the subnets no
+        longer returned that are marked as missing, are flushed with a single
+        unordered bulk write.
+
+        Returns the subnets of each network, by network id.
+
+        """
+        from mist.api.networks.models import Subnet, SUBNETS
+
+        networks = {network.id: network for network, _ in networks_subnets}
+        existing = {network_id: {} for network_id in networks}
+        for subnet in Subnet.objects(
+                network__in=list(networks.values())).no_dereference():
+            network = networks[subnet._data['network'].id]
+            # Avoid dereferencing the network of every subnet.
+            subnet._data['network'] = network
+            existing[network.id][subnet.subnet_id] = subnet
+
+        now = datetime.datetime.utcnow()
+        subnets = {network_id: [] for network_id in networks}
+        changed = []
+        for network, libcloud_subnets in networks_subnets:
+            seen_ids = set()
+            for libcloud_subnet in libcloud_subnets:
+                # Guard against duplicate subnet ids in the provider response.
+                if libcloud_subnet.id in seen_ids:
+                    continue
+                seen_ids.add(libcloud_subnet.id)
+                subnet = existing[network.id].get(libcloud_subnet.id)
+                if subnet is None:
+                    subnet = SUBNETS[self.provider](
+                        network=network, subnet_id=libcloud_subnet.id)
+                self._list_subnets__update_subnet(subnet, libcloud_subnet)
+                subnets[network.id].append(subnet)
+                if subnet._created or subnet._get_changed_fields():
+                    changed.append(subnet)
+
+            # Set missing_since for subnets not returned by libcloud.
+            for subnet_id, subnet in existing[network.id].items():
+                if subnet_id not in seen_ids and subnet.missing_since is None:
+                    subnet.missing_since = now
+                    changed.append(subnet)
+
+        failed = set(id(subnet) for subnet in bulk_save(changed))
+        return {network_id: [subnet for subnet in network_subnets
+                             if id(subnet) not in failed]
+                for network_id, network_subnets in subnets.items()}
+
     def list_cached_subnets(self, network):
         """Returns subnets stored in database
         for a specific network
@@ -541,6 +656,27 @@ class BaseNetworkController(BaseController):
                                   'subnet listings due to cloud-specific '
                                   'filtering needs.')
 
+    def _list_subnets__fetch_all_subnets(self):
+        """Fetches the subnets of all networks with a single call.
+
+        This method is meant to be called internally by `self.list_networks`
+        to avoid a subnet listing call per network.
+
+        Subclasses whose driver can list the subnets of all networks at once
+        SHOULD override this method, along with
+        `self._list_subnets__get_network_id`. By default it returns None, in
+        which case subnets are fetched separately for each network.
+        """
+        return None
+
+    def _list_subnets__get_network_id(self, libcloud_subnet):
+        """Returns the provider id of the network of a libcloud subnet.
+
+        Subclasses that override `self._list_subnets__fetch_all_subnets` MUST
+        override this method.
+        """
+        raise NotImplementedError()
+
     def _list_subnets__cidr_range(self, subnet, libcloud_subnet):
         """Returns the subnet's IP range in CIDR notation.
 
@@ -110,6 +110,12 @@ class AmazonNetworkController(BaseNetworkController):
         kwargs = {'filters': {'vpc-id': network.network_id}}
         return self.cloud.ctl.compute.connection.ex_list_subnets(**kwargs)
 
+    def _list_subnets__fetch_all_subnets(self):
+        return self.cloud.ctl.compute.connection.ex_list_subnets()
+
+    def _list_subnets__get_network_id(self, libcloud_subnet):
+        return libcloud_subnet.extra.get('vpc_id')
+
     def _list_subnets__cidr_range(self, subnet, libcloud_subnet):
         return subnet.extra.pop('cidr_block')
 
@@ -159,6 +165,12 @@ class GoogleNetworkController(BaseNetworkController):
         return self.cloud.ctl.compute.connection.ex_list_subnetworks(
             filter_expression=filter_expression)
 
+    def _list_subnets__fetch_all_subnets(self):
+        return self.cloud.ctl.compute.connection.ex_list_subnetworks()
+
+    def _list_subnets__get_network_id(self, libcloud_subnet):
+        return getattr(libcloud_subnet.network, 'id', None)
+
     def _list_subnets__postparse_subnet(self, subnet, libcloud_subnet):
         # Replace `GCERegion` object with the region's name.
         if hasattr(libcloud_subnet, 'region'):
@@ -234,6 +246,13 @@ class OpenStackNetworkController(BaseNetworkController):
         }
         return self.cloud.ctl.compute.connection.ex_list_subnets(**kwargs)
 
+    def _list_subnets__fetch_all_subnets(self):
+        kwargs = {'filters': {'ip_version': 4}}
+        return self.cloud.ctl.compute.connection.ex_list_subnets(**kwargs)
+
+    def _list_subnets__get_network_id(self, libcloud_subnet):
+        return libcloud_subnet.network_id
+
     def _list_subnets__postparse_subnet(self, subnet, libcloud_subnet):
         for field in subnet._subnet_specific_fields:
             if hasattr(libcloud_subnet, field):
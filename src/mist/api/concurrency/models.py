@@ -5,6 +5,7 @@ import datetime
 import contextlib
 
 import mongoengine as me
+from mongoengine.queryset.visitor import Q
 
 
 log = logging.getLogger(__name__)
@@ -60,19 +61,20 @@ class PeriodicTaskInfo(me.Document):
 
     @classmethod
     def get_or_add(cls, key):
+        """Return the task of the given key, creating it if it's missing
+
+        This is done with a single atomic upsert.
+
+        """
         try:
+            task = cls.objects(key=key).modify(
+                upsert=True, new=True, set_on_insert__failures_count=0)
+        except me.NotUniqueError:
+            # Work around race condition where document was created since
+            # we checked.
+            log.warning("PeriodicTaskInfo for '%s' creation race "
+                        "condition, will reload.", key)
             task = cls.objects.get(key=key)
-        except cls.DoesNotExist:
-            log.info("PeriodicTaskInfo for '%s' missing, will create.", key)
-            task = cls(key=key)
-            try:
-                task.save()
-            except me.NotUniqueError:
-                # Work around race condition where document was created since
-                # we checked.
-                log.warning("PeriodicTaskInfo for '%s' creation race "
-                            "condition, will reload.", key)
-                task = cls.objects.get(key=key)
         log.debug("Loaded PeriodicTaskInfo for '%s'.", key)
         return task
 
@@ -124,38 +126,69 @@ class PeriodicTaskInfo(me.Document):
                 if now - last_run < self.min_interval:
                     raise PeriodicTaskTooRecentLastRun()
 
-    def acquire_lock(self, attempts=1, retry_sleep=1):
-        """Acquire run lock"""
-        # Is another same task running?
+    def _lock_available(self, now, check_too_soon=False):
+        """Return a query matching the task if its lock can be acquired"""
+        query = Q(lock=None)
+        if self.break_lock_after:
+            query |= Q(lock__created_at__lt=now - self.break_lock_after)
+        if check_too_soon and self.min_interval:
+            before = now - self.min_interval
+            query &= Q(last_success=None) | Q(last_success__lt=before)
+            query &= Q(last_failure=None) | Q(last_failure__lt=before)
+        return Q(key=self.key) & query
+
+    def acquire_lock(self, attempts=1, retry_sleep=1, check_too_soon=False):
+        """Acquire run lock
+
+        The lock is set with an atomic compare-and-set, so that only one of
+        any concurrent runs of the same task may acquire it. If
+        `check_too_soon` is True, the lock is also only acquired if the
+        task hasn't run in the last `min_interval`.
+
+        """
         for i in range(attempts):
-            if not self.lock:
+            now = datetime.datetime.now()
+            lock = self.Lock(created_at=now)
+            previous = type(self).objects(
+                self._lock_available(now, check_too_soon)
+            ).modify(set__lock=lock)
+            if previous is not None:
                 break
-            if self.break_lock_after:
-                now = datetime.datetime.now()
-                if now - self.lock.created_at > self.break_lock_after:
-                    # Has been running for too long or has died. Ignore.
-                    log.error("Other task '%s' seems to have started, but "
-                              "it's been quite a while, will ignore and run.",
-                              self.key)
-                    break
             if i < attempts - 1:
                 time.sleep(retry_sleep)
-                self.reload()
         else:
+            # Find out why the lock couldn't be acquired.
+            self.reload()
+            if check_too_soon:
+                self.check_too_soon()
             log.warning("Lock for task '%s' is taken.", self.key)
             raise PeriodicTaskLockTakenError()
-        self.lock = self.Lock()
-        self.save()
+        if previous.lock:
+            # Has been running for too long or has died. Ignore.
+            log.error("Other task '%s' seems to have started, but "
+                      "it's been quite a while, will ignore and run.",
+                      self.key)
+        self._data['lock'] = lock
+
+    def release_lock(self, **update):
+        """Release run lock
+
+        Any given update, eg. of the task's success or failure counters, is
+        applied atomically along with the release of the lock.
 
-    def release_lock(self):
+        """
         lock_id = self.lock.id
-        self.reload()
-        if not self.lock or lock_id != self.lock.id:
+        task = type(self).objects(key=self.key, lock__id=lock_id).modify(
+            unset__lock=True, new=True, **update)
+        if task is None:
             log.error("Someone broke our lock for task '%s' since we "
                       "acquired it!", self.key)
-            return
-        self.lock = None
-        self.save()
+            if not update:
+                return
+            task = type(self).objects(key=self.key).modify(new=True, **update)
+            if task is None:
+                return
+        self._data.update(task._data)
 
     @contextlib.contextmanager
     def task_runner(self, persist=False):
@@ -177,21 +210,21 @@ class PeriodicTaskInfo(me.Document):
         if not persist:
             self.check_failures_threshold_exceeded()
             self.check_too_soon()
-        self.acquire_lock(attempts=60 if persist else 1)
+        self.acquire_lock(attempts=60 if persist else 1,
+                          check_too_soon=not persist)
 
         try:
             yield
         except Exception:
-            self.last_failure = datetime.datetime.now()
-            self.failures_count += 1
+            self.release_lock(set__last_failure=datetime.datetime.now(),
+                              inc__failures_count=1)
             raise
-        else:
-            self.last_success = datetime.datetime.now()
-            self.failures_count = 0
-        finally:
-            self.last_attempt_started = None
-            self.save()
+        except BaseException:
             self.release_lock()
+            raise
+        else:
+            self.release_lock(set__last_success=datetime.datetime.now(),
+                              set__failures_count=0)
 
     def __str__(self):
         return '%s: %s' % (self.__class__.__name__, self.id)
@@ -59,6 +59,10 @@ BLOG_CDN_URI = ""
 
 METERING_PROMQL_LOOKBACK = "2h"
 METERING_NOTIFICATIONS_WEBHOOK = ""
+# Compute the metering data of all machines of a cloud in a single pass,
+# fetching missing counter values with one query per metric, and stream them
+# to VictoriaMetrics.
+METERING_SINGLE_PASS = False
 METERING_METRICS = {
     "default": {
         'core_hours': {'type': 'counter', 'value': lambda machine, dt: dt * (
@@ -126,6 +130,24 @@ OWNER_POLICY = {}
 SAFE_EXPIRATION = False
 SAFE_EXPIRATION_DURATION = 60 * 60 * 24 * 7
 
+# Run the machine actions of a schedule from a single task, which lists each
+# cloud once and runs the actions concurrently, bounded per cloud and per
+# provider, retrying the ones that hit rate limits.
+SCHEDULES_GROUP_MACHINE_ACTIONS = False
+SCHEDULES_MAX_CONCURRENT_ACTIONS = 20
+SCHEDULES_MAX_ACTIONS_PER_CLOUD = 5
+SCHEDULES_MAX_ACTIONS_PER_PROVIDER = 10
+SCHEDULES_RATE_LIMIT_RETRIES = 3
+# Run the script of a schedule on all its machines from a single task, which
+# resolves hosts from the stored machines, uploads inline scripts once per
+# host and content and runs them concurrently, bounded overall, per cloud and
+# per host. Output is logged every SCHEDULES_SCRIPT_OUTPUT_INTERVAL seconds.
+SCHEDULES_GROUP_RUN_SCRIPT = False
+SCHEDULES_MAX_CONCURRENT_SCRIPTS = 50
+SCHEDULES_MAX_SCRIPTS_PER_CLOUD = 20
+SCHEDULES_MAX_SCRIPTS_PER_HOST = 1
+SCHEDULES_SCRIPT_OUTPUT_INTERVAL = 5
+
 MONGO_URI = "mongodb:27017"
 MONGO_DB = "mist2"
 
@@ -1202,6 +1224,9 @@ GRAPHITE_URI = "http://graphite"
 VICTORIAMETRICS_URI = "http://vmselect:8481/select/<org_id>/prometheus"
 VICTORIAMETRICS_WRITE_URI = (f"http://vminsert:8480/insert/<org_id>/"
                              f"prometheus/api/v1/import/prometheus")
+# Maximum number of concurrent queries of a single stats request, which is
+# also the size of each tenant's connection pool.
+VICTORIAMETRICS_MAX_CONCURRENT_QUERIES = 8
 
 # Alert service's settings.
 CILIA_TRIGGER_API = "http://api"
@@ -1218,11 +1243,23 @@ CILIA_FOUNDATIONDB_NODATA_TARGETS = (
 CILIA_VICTORIAMETRICS_NODATA_TARGETS = (
     "system_load1", "system_n_cpus", 'cpu_usage_user{cpu="cpu0"}'
 )
+# Maximum number of resources a rule is evaluated for with a single query,
+# when the rule's backend plugin supports batched queries.
+CILIA_EVALUATION_BATCH_SIZE = 200
 
 # Shard Manager settings. Can also be set through env variables.
 SHARD_MANAGER_INTERVAL = 10
 SHARD_MANAGER_MAX_SHARD_PERIOD = 60
 SHARD_MANAGER_MAX_SHARD_CLAIMS = 500
+# Assign schedules to the schedulers that are alive using a consistent hash
+# ring, instead of resetting and claiming all of them on startup.
+SHARD_MANAGER_CONSISTENT_HASHING = False
+
+# Reload only the schedules that changed since the last iteration of the
+# scheduler, from change streams if available, and do a full reload every
+# SCHEDULER_FULL_RESYNC_INTERVAL seconds.
+SCHEDULER_INCREMENTAL_RELOAD = False
+SCHEDULER_FULL_RESYNC_INTERVAL = 300
 
 # NoData alert suppression.
 NO_DATA_ALERT_SUPPRESSION = False
@@ -1232,11 +1269,34 @@ NO_DATA_MACHINES_RATIO = .2
 
 # number of api tokens user can have
 ACTIVE_APITOKEN_NUM = 20
+# Write the last access time of unchanged auth tokens at most once every
+# that many seconds, instead of on every request. Token timeouts are
+# extended by the same amount. Set to 0 to write it on every request.
+AUTH_TOKEN_TOUCH_INTERVAL = 0
+# Cache resolved auth tokens, along with their user and org, for that many
+# seconds in each API process. Set to 0 to disable the cache.
+AUTH_SESSION_CACHE_TTL = 0
+AUTH_SESSION_CACHE_SIZE = 10000
 ALLOW_CONNECT_LOCALHOST = True
 ALLOW_CONNECT_PRIVATE = True
 
 # allow mist.io to connect to KVM hypervisor running on the same server
 ALLOW_LIBVIRT_LOCALHOST = False
+# List the KVM hypervisors of a cloud concurrently, skipping the ones that
+# fail or time out, instead of one after the other.
+LIBVIRT_CONCURRENT_LISTING = False
+# Number of KVM hypervisors listed concurrently by each worker process,
+# seconds to wait for each one and seconds to reuse their connections across
+# polls.
+LIBVIRT_MAX_CONCURRENT_HOSTS = 8
+LIBVIRT_HOST_TIMEOUT = 60
+LIBVIRT_DRIVER_TTL = 600
+# Seconds to wait for the SSH port of a KVM hypervisor to accept connections,
+# and keepalive interval and count after which unresponsive connections are
+# closed.
+LIBVIRT_CONNECT_TIMEOUT = 10
+LIBVIRT_KEEPALIVE_INTERVAL = 5
+LIBVIRT_KEEPALIVE_COUNT = 3
 
 # Docker related
 DOCKER_IP = "socat"
@@ -3022,6 +3082,89 @@ MACHINE_PATCHES = True
 ACCELERATE_MACHINE_POLLING = True
 DEFAULT_CLOUD_POLLING_INTERVAL = 30 * 60
 PROCESS_POOL_WORKERS = 0
+# Keep the process pool alive across polls instead of starting a new one for
+# every poll, and send it nodes in chunks of this size.
+PROCESS_POOL_PERSISTENT = False
+PROCESS_POOL_CHUNK_SIZE = 250
+# Seconds to cache provider pricing data, shared among clouds of the same
+# provider.
+PRICING_CACHE_TTL = 3600
+# Reconcile listed machines with the db using one prefetch query per
+# collection and a single bulk write per poll.
+MACHINES_BULK_RECONCILIATION = False
+# Only write new or changed images, with a single bulk upsert per poll.
+IMAGES_BULK_RECONCILIATION = False
+# Reconcile DNS records with one prefetch query per zone and bulk writes of
+# DNS_RECORDS_BATCH_SIZE records, fetching records in pages when supported.
+DNS_RECORDS_BULK_RECONCILIATION = False
+DNS_RECORDS_BATCH_SIZE = 1000
+# Subnets of all clouds are listed on a shared pool of SUBNETS_LISTING_WORKERS
+# threads, each cloud using at most SUBNETS_LISTING_CONCURRENCY_PER_CLOUD.
+SUBNETS_LISTING_WORKERS = 32
+SUBNETS_LISTING_CONCURRENCY_PER_CLOUD = 4
+# Fetch the subnets of all networks of a cloud at once where supported and
+# reconcile them with the db using bulk writes.
+SUBNETS_BULK_RECONCILIATION = False
+# Export Prometheus metrics of provider API calls and of the phases of
+# listing machines. The API serves them on /metrics, set the
+# PROMETHEUS_MULTIPROC_DIR env variable to aggregate all its processes. Each
+# dramatiq worker process serves its own metrics on the first free port from
+# METRICS_WORKER_PORT to METRICS_WORKER_PORT + METRICS_WORKER_PORT_RANGE.
+# /metrics requires METRICS_TOKEN as a bearer token, if set, or an admin.
+PROVIDER_METRICS = False
+METRICS_WORKER_PORT = 9200
+METRICS_WORKER_PORT_RANGE = 64
+METRICS_TOKEN = ''
+# Back off the polling of clouds whose resources don't change. The interval
+# is doubled, up to POLLING_ADAPTIVE_MAX_FACTOR times, after every
+# POLLING_ADAPTIVE_STABLE_RUNS runs that listed no changes and is reset on any
+# change or user action. The adapted interval stays between
+# POLLING_ADAPTIVE_MIN_INTERVAL and POLLING_ADAPTIVE_MAX_INTERVAL seconds, or
+# the original interval if longer, and is at least
+# POLLING_ADAPTIVE_DURATION_RATIO times the average duration of a run.
+POLLING_ADAPTIVE_INTERVALS = False
+POLLING_ADAPTIVE_STABLE_RUNS = 3
+POLLING_ADAPTIVE_MAX_FACTOR = 16
+POLLING_ADAPTIVE_MIN_INTERVAL = 10
+POLLING_ADAPTIVE_MAX_INTERVAL = 3600
+POLLING_ADAPTIVE_DURATION_RATIO = 2
+# Publish messages to owners on a pool of up to AMQP_PUBLISHER_POOL_SIZE
+# connections with publisher confirms, caching whether an owner is listening
+# for AMQP_OWNER_LISTENING_TTL seconds and coalescing patches of the same
+# resource that are published within AMQP_PUBLISH_COALESCE_WINDOW_MS
+# milliseconds.
+AMQP_USER_PUBLISHER_POOLED = False
+AMQP_PUBLISHER_POOL_SIZE = 4
+AMQP_OWNER_LISTENING_TTL = 5
+AMQP_PUBLISH_COALESCE_WINDOW_MS = 200
+# Run ping probes in batches of up to PING_PROBE_BATCH_SIZE machines, sent
+# once that many are due or PING_PROBE_BATCH_WINDOW seconds after the first.
+# Each batch is pinged by a single fping process, if installed, or by up to
+# PING_PROBE_CONCURRENCY concurrent ping processes.
+PING_PROBE_BATCHING = False
+PING_PROBE_BATCH_SIZE = 200
+PING_PROBE_BATCH_WINDOW = 5
+PING_PROBE_CONCURRENCY = 50
+# Reuse authenticated SSH connections, and parsed private keys, across the
+# shells of a process. A connection is shared by up to SSH_POOL_MAX_SESSIONS
+# shells and closed after SSH_POOL_IDLE_TTL seconds without any.
+SSH_CONNECTION_POOL = False
+SSH_POOL_MAX_SESSIONS = 8
+SSH_POOL_IDLE_TTL = 60
+SSH_KEY_CACHE_SIZE = 256
+# Log events from a background thread. log_event only prepares an event and
+# puts it in a queue of up to LOG_EVENTS_QUEUE_SIZE events, waiting at most
+# LOG_EVENTS_QUEUE_TIMEOUT_MS milliseconds for space before dropping it. The
+# queue is flushed every LOG_EVENTS_FLUSH_INTERVAL_MS milliseconds, or once
+# LOG_EVENTS_BATCH_SIZE events are queued, closing incidents with one search
+# per owner and set of incident terms, and publishing the batch on a single
+# connection. User emails are cached for LOG_EVENTS_EMAIL_CACHE_TTL seconds.
+LOG_EVENTS_ASYNC = False
+LOG_EVENTS_QUEUE_SIZE = 10000
+LOG_EVENTS_QUEUE_TIMEOUT_MS = 100
+LOG_EVENTS_BATCH_SIZE = 500
+LOG_EVENTS_FLUSH_INTERVAL_MS = 200
+LOG_EVENTS_EMAIL_CACHE_TTL = 300
 PLUGINS = []
 PRE_ACTION_HOOKS = {}
 POST_ACTION_HOOKS = {}
@@ -3107,15 +3250,48 @@ FROM_ENV_STRINGS = [
     'DOCKER_PORT', 'DOCKER_TLS_KEY', 'DOCKER_TLS_CERT', 'DOCKER_TLS_CA',
     'UI_TEMPLATE_URL', 'LANDING_TEMPLATE_URL', 'THEME',
     'DEFAULT_MONITORING_METHOD', 'LICENSE_KEY', 'AWS_ACCESS_KEY',
-    'AWS_SECRET_KEY', 'AWS_MONGO_BUCKET'
+    'AWS_SECRET_KEY', 'AWS_MONGO_BUCKET', 'METRICS_TOKEN',
 ] + PLUGIN_ENV_STRINGS
 FROM_ENV_INTS = [
     'SHARD_MANAGER_MAX_SHARD_PERIOD', 'SHARD_MANAGER_MAX_SHARD_CLAIMS',
-    'SHARD_MANAGER_INTERVAL',
+    'SHARD_MANAGER_INTERVAL', 'SCHEDULER_FULL_RESYNC_INTERVAL',
+    'CILIA_EVALUATION_BATCH_SIZE', 'VICTORIAMETRICS_MAX_CONCURRENT_QUERIES',
+    'AUTH_TOKEN_TOUCH_INTERVAL', 'AUTH_SESSION_CACHE_TTL',
+    'AUTH_SESSION_CACHE_SIZE', 'DNS_RECORDS_BATCH_SIZE',
+    'SUBNETS_LISTING_WORKERS', 'SUBNETS_LISTING_CONCURRENCY_PER_CLOUD',
+    'METRICS_WORKER_PORT', 'METRICS_WORKER_PORT_RANGE',
+    'POLLING_ADAPTIVE_STABLE_RUNS',
+    'POLLING_ADAPTIVE_MIN_INTERVAL', 'POLLING_ADAPTIVE_MAX_INTERVAL',
+    'AMQP_OWNER_LISTENING_TTL', 'AMQP_PUBLISH_COALESCE_WINDOW_MS',
+    'AMQP_PUBLISHER_POOL_SIZE',
+    'PING_PROBE_BATCH_SIZE', 'PING_PROBE_BATCH_WINDOW',
+    'PING_PROBE_CONCURRENCY', 'SSH_POOL_MAX_SESSIONS', 'SSH_POOL_IDLE_TTL',
+    'SSH_KEY_CACHE_SIZE', 'LOG_EVENTS_QUEUE_SIZE',
+    'LOG_EVENTS_QUEUE_TIMEOUT_MS', 'LOG_EVENTS_BATCH_SIZE',
+    'LOG_EVENTS_FLUSH_INTERVAL_MS', 'LOG_EVENTS_EMAIL_CACHE_TTL',
+    'LIBVIRT_MAX_CONCURRENT_HOSTS', 'LIBVIRT_HOST_TIMEOUT',
+    'LIBVIRT_DRIVER_TTL', 'LIBVIRT_CONNECT_TIMEOUT',
+    'LIBVIRT_KEEPALIVE_INTERVAL', 'LIBVIRT_KEEPALIVE_COUNT',
+    'SCHEDULES_MAX_CONCURRENT_ACTIONS',
+    'SCHEDULES_MAX_ACTIONS_PER_CLOUD', 'SCHEDULES_MAX_ACTIONS_PER_PROVIDER',
+    'SCHEDULES_RATE_LIMIT_RETRIES', 'SCHEDULES_MAX_CONCURRENT_SCRIPTS',
+    'SCHEDULES_MAX_SCRIPTS_PER_CLOUD', 'SCHEDULES_MAX_SCRIPTS_PER_HOST',
+    'SCHEDULES_SCRIPT_OUTPUT_INTERVAL', 'PROCESS_POOL_CHUNK_SIZE',
+    'PRICING_CACHE_TTL', 'POLLING_ADAPTIVE_MAX_FACTOR',
+    'POLLING_ADAPTIVE_DURATION_RATIO',
 ] + PLUGIN_ENV_INTS
 FROM_ENV_BOOLS = [
     'SSL_VERIFY', 'ALLOW_CONNECT_LOCALHOST', 'ALLOW_CONNECT_PRIVATE',
     'ALLOW_LIBVIRT_LOCALHOST', 'JS_BUILD', 'VERSION_CHECK', 'USAGE_SURVEY',
+    'MACHINES_BULK_RECONCILIATION', 'IMAGES_BULK_RECONCILIATION',
+    'DNS_RECORDS_BULK_RECONCILIATION', 'SUBNETS_BULK_RECONCILIATION',
+    'PROVIDER_METRICS', 'POLLING_ADAPTIVE_INTERVALS',
+    'SHARD_MANAGER_CONSISTENT_HASHING', 'SCHEDULER_INCREMENTAL_RELOAD',
+    'SCHEDULES_GROUP_MACHINE_ACTIONS', 'SCHEDULES_GROUP_RUN_SCRIPT',
+    'AMQP_USER_PUBLISHER_POOLED',
+    'METERING_SINGLE_PASS', 'PING_PROBE_BATCHING', 'SSH_CONNECTION_POOL',
+    'LOG_EVENTS_ASYNC', 'PROCESS_POOL_PERSISTENT',
+    'LIBVIRT_CONCURRENT_LISTING',
 ] + PLUGIN_ENV_BOOLS
 FROM_ENV_ARRAYS = [
     'PLUGINS'
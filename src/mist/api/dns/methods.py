@@ -1,4 +1,5 @@
 from mist.api.clouds.models import Cloud
+from mist.api.tag.models import Tag
 
 from mist.api.exceptions import PolicyUnauthorizedError, CloudNotFoundError
 
@@ -54,7 +55,12 @@ def filter_list_zones(auth_context, cloud_id, zones=None, perm='read',
 def list_records(owner, zone, cached=False):
     """List records returning all records for an owner"""
     records = zone.ctl.list_records(cached=cached)
-    return [r.as_dict() for r in records]
+    tags = {}
+    for tag in Tag.objects(resource_type='record',
+                           resource_id__in=[r.id for r in records]).only(
+                               'resource_id', 'key', 'value'):
+        tags.setdefault(tag.resource_id, {})[tag.key] = tag.value
+    return [r.as_dict(tags=tags.get(r.id, {})) for r in records]
 
 
 def filter_list_records(auth_context, zone, records=None, perm='read'):
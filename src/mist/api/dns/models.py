@@ -272,8 +272,13 @@ class Record(OwnershipMixin, me.Document):
                 for tag in Tag.objects(resource_id=self.id,
                                        resource_type='record')}
 
-    def as_dict(self):
-        """ Return a dict with the model values."""
+    def as_dict(self, tags=None):
+        """ Return a dict with the model values.
+
+        `tags` may be a dict of the record's tags when these have already
+        been fetched, otherwise they are queried.
+
+        """
         return {
             'id': self.id,
             'record_id': self.record_id,
@@ -285,7 +290,7 @@ class Record(OwnershipMixin, me.Document):
             'zone': self.zone.id,
             'owned_by': self.owned_by.id if self.owned_by else '',
             'created_by': self.created_by.id if self.created_by else '',
-            'tags': self.tags
+            'tags': self.tags if tags is None else tags
         }
 
 
@@ -93,9 +93,19 @@ class MongoConnectMiddleware(Middleware):
         mongo_connect()
 
 
+class MetricsMiddleware(Middleware):
+    """Expose the metrics of each worker process over HTTP"""
+
+    def after_worker_boot(self, broker, worker):
+        from mist.api.instrumentation import start_metrics_server
+        start_metrics_server()
+
+
 broker = RabbitmqBroker(url=config.BROKER_URL + '?heartbeat=600')
 broker.add_middleware(LoggingMiddleware())
 broker.add_middleware(MongoConnectMiddleware())
+if config.PROVIDER_METRICS:
+    broker.add_middleware(MetricsMiddleware())
 result_backend = MemcachedBackend(servers=config.MEMCACHED_HOST)
 broker.add_middleware(Results(backend=result_backend))
 dramatiq.set_broker(broker)
@@ -85,6 +85,7 @@ from mist.api.exceptions import PolicyUnauthorizedError, ForbiddenError
 from mist.api.exceptions import WorkflowExecutionError, BadRequestError
 
 from mist.api import config
+from mist.api.publisher import owner_publisher
 
 from functools import reduce
 
@@ -306,6 +307,21 @@ def amqp_publish(exchange, routing_key, data,
                          serializer='json', retry=True)
 
 
+def amqp_publish_batch(exchange, messages,
+                       ex_type='fanout', ex_declare=False,
+                       durable=False, auto_delete=True):
+    """Publish a list of (routing_key, data) tuples on a single producer"""
+    exchange = kombu.Exchange(exchange, type=ex_type, auto_delete=auto_delete,
+                              durable=False)
+    with kombu.pools.producers[kombu.Connection(config.BROKER_URL)].acquire(
+            block=True, timeout=10) as producer:
+        if ex_declare:
+            producer.maybe_declare(exchange)
+        for routing_key, data in messages:
+            producer.publish(data, exchange=exchange, routing_key=routing_key,
+                             serializer='json', retry=True)
+
+
 def amqp_subscribe(exchange, callback, queue='',
                    ex_type='fanout', routing_keys=None, durable=False,
                    auto_delete=True):
@@ -337,6 +353,9 @@ def _amqp_owner_exchange(owner):
 
 
 def amqp_publish_user(owner, routing_key, data):
+    if config.AMQP_USER_PUBLISHER_POOLED:
+        return owner_publisher.publish(_amqp_owner_exchange(owner),
+                                       routing_key, data)
     with kombu.Connection(config.BROKER_URL) as connection:
         channel = connection.channel()
         try:
@@ -367,6 +386,9 @@ def amqp_subscribe_user(owner, queue, callback):
 
 
 def amqp_owner_listening(owner, retries=3):
+    if config.AMQP_USER_PUBLISHER_POOLED:
+        return owner_publisher.is_listening(_amqp_owner_exchange(owner),
+                                            retries=retries)
     exchange = kombu.Exchange(_amqp_owner_exchange(owner), type='fanout')
     with kombu.pools.connections[kombu.Connection(config.BROKER_URL)].acquire(
             block=True, timeout=10) as connection:
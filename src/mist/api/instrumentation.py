@@ -0,0 +1,166 @@
+"""Prometheus metrics of provider API calls and polling
+
+When `config.PROVIDER_METRICS` is enabled, every call made through the
+`connection` of a cloud controller is counted and timed by provider, cloud
+and method, and the phases of listing machines (fetch, maps, update,
+persist, patch, publish and inventory) are timed. Log events handled by
+the asynchronous event pipeline are counted by outcome.
+
+Metrics are exposed in the Prometheus text format on the API's `/metrics`
+route and on an HTTP server started by each dramatiq worker process. The API
+aggregates the metrics of all its processes if the PROMETHEUS_MULTIPROC_DIR
+env variable is set.
+
+"""
+import os
+import time
+import inspect
+import logging
+import functools
+import contextlib
+
+from prometheus_client import Counter, Histogram
+from prometheus_client import REGISTRY, CollectorRegistry
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client import start_http_server
+
+from mist.api import config
+
+
+log = logging.getLogger(__name__)
+
+BUCKETS = (.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+PROVIDER_CALLS = Counter(
+    'mist_provider_api_calls_total',
+    'Number of calls made to provider APIs',
+    ['provider', 'cloud', 'method'])
+PROVIDER_ERRORS = Counter(
+    'mist_provider_api_errors_total',
+    'Number of calls to provider APIs that raised an error',
+    ['provider', 'cloud', 'method', 'error'])
+PROVIDER_LATENCY = Histogram(
+    'mist_provider_api_call_duration_seconds',
+    'Duration of calls made to provider APIs',
+    ['provider', 'cloud', 'method'], buckets=BUCKETS)
+POLL_PHASES = Histogram(
+    'mist_poll_phase_duration_seconds',
+    'Duration of each phase of listing the resources of a cloud',
+    ['provider', 'cloud', 'resource', 'phase'], buckets=BUCKETS)
+LOG_EVENTS = Counter(
+    'mist_log_events_total',
+    'Number of log events that were queued, delayed because the queue was '
+    'full, dropped, published or failed to be published',
+    ['outcome'])
+
+
+@contextlib.contextmanager
+def observe_call(provider, cloud_id, method):
+    """Count and time a call to a provider API"""
+    labels = (provider, cloud_id, method)
+    PROVIDER_CALLS.labels(*labels).inc()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as exc:
+        PROVIDER_ERRORS.labels(*labels, type(exc).__name__).inc()
+        raise
+    finally:
+        PROVIDER_LATENCY.labels(*labels).observe(time.perf_counter() - start)
+
+
+class PhaseTimer(object):
+    """Time the consecutive phases of listing the resources of a cloud
+
+    Each call to `observe` records the time elapsed since the previous call,
+    or since the timer was created, as the duration of the given phase.
+    Nothing is recorded unless `config.PROVIDER_METRICS` is enabled.
+
+    """
+
+    def __init__(self, controller, resource):
+        self.labels = (controller.provider, controller.cloud.id, resource)
+        self.last = time.perf_counter()
+
+    def observe(self, phase):
+        now = time.perf_counter()
+        if config.PROVIDER_METRICS:
+            POLL_PHASES.labels(*self.labels, phase).observe(now - self.last)
+        self.last = now
+
+
+def count_log_events(outcome, count=1):
+    """Count log events handled by the event pipeline"""
+    if config.PROVIDER_METRICS and count:
+        LOG_EVENTS.labels(outcome).inc(count)
+
+
+class InstrumentedConnection(object):
+    """Wraps a libcloud-like connection to time calls of its methods
+
+    Attributes other than public methods are passed through, so the wrapped
+    connection can be used in place of the original one.
+
+    """
+
+    def __init__(self, conn, provider, cloud_id):
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_labels', (provider, cloud_id))
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name.startswith('_') or not inspect.ismethod(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def wrapper(*args, **kwargs):
+            with observe_call(*self._labels, name):
+                return attr(*args, **kwargs)
+        return wrapper
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def __repr__(self):
+        return repr(self._conn)
+
+
+def get_registry():
+    """Return the registry to collect metrics from
+
+    If the PROMETHEUS_MULTIPROC_DIR env variable is set, this collects the
+    metrics of all processes sharing that directory.
+
+    """
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return REGISTRY
+    from prometheus_client import multiprocess
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics():
+    """Return the metrics in the Prometheus text format and its content type
+    """
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server():
+    """Start an HTTP server exposing the metrics of the current process
+
+    Worker processes can't share a port, so the first free port starting
+    from `config.METRICS_WORKER_PORT` is used. Returns the port, or None if
+    no port was free.
+
+    """
+    start = config.METRICS_WORKER_PORT
+    for port in range(start, start + config.METRICS_WORKER_PORT_RANGE):
+        try:
+            start_http_server(port, registry=get_registry())
+        except OSError:
+            continue
+        log.info('Serving metrics of process %s on port %s',
+                 os.getpid(), port)
+        return port
+    log.error('No free port to serve metrics of process %s', os.getpid())
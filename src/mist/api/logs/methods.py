@@ -36,6 +36,15 @@ else:
 logging.getLogger('elasticsearch').setLevel(logging.ERROR)
 log = logging.getLogger(__name__)
 
+# Fields of events that identify the resources whose incidents they close.
+INCIDENT_KEYS = ('rule_id', 'cloud_id', 'machine_id', 'schedule_id',
+                 'zone_id', 'record_id', 'subnet_id', 'network_id',
+                 'script_id', 'stack_id', 'template_id', 'key_id',
+                 'volume_id', )
+
+# Cache of user emails, used by the asynchronous event pipeline.
+_USER_EMAILS = {}
+
 
 # FIXME: Once we are consistent with machine_id, external_id
 # etc, sanitize all the chaos below
@@ -211,10 +220,9 @@ def log_event(owner_id, event_type, action, error=None, **kwargs):
             event['story_id'] = kwargs.pop('story_id')
 
         if 'user_id' in event:
-            try:
-                event['email'] = User.objects.get(id=event['user_id']).email
-            except User.DoesNotExist:
-                log.debug('User %s does not exist', event['user_id'])
+            email = get_user_email(event['user_id'])
+            if email is not None:
+                event['email'] = email
 
         # Associate event with relevant stories.
         for key in ('job_id', 'shell_id', 'session_id', 'incident_id'):
@@ -232,8 +240,9 @@ def log_event(owner_id, event_type, action, error=None, **kwargs):
             story = ('closes', 'incident', event['story_id'])
             event.setdefault('stories', []).append(story)
 
-        # Attempt to close open incidents.
-        if action in CLOSES_INCIDENT:
+        # Attempt to close open incidents. The event pipeline does this for
+        # whole batches of events.
+        if action in CLOSES_INCIDENT and not config.LOG_EVENTS_ASYNC:
             try:
                 close_open_incidents(event)
             except Exception as exc:
@@ -253,9 +262,17 @@ def log_event(owner_id, event_type, action, error=None, **kwargs):
         keys.append('true' if error else 'false')
         routing_key = '.'.join(map(str.lower, keys))
 
-        # Broadcast event to RabbitMQ's "events" exchange.
-        amqp_publish('events', routing_key, event,
-                     ex_type='topic', ex_declare=True, auto_delete=False)
+        if config.LOG_EVENTS_ASYNC:
+            from mist.api.logs.pipeline import event_pipeline
+            queued = dict(event)
+            if 'stories' in queued:
+                queued['stories'] = list(queued['stories'])
+            event_pipeline.put(routing_key, queued,
+                               close_incidents=action in CLOSES_INCIDENT)
+        else:
+            # Broadcast event to RabbitMQ's "events" exchange.
+            amqp_publish('events', routing_key, event,
+                         ex_type='topic', ex_declare=True, auto_delete=False)
 
         event.pop('extra')
         event.update(kwargs)
@@ -738,10 +755,7 @@ def close_open_incidents(event):
         'owner_id': event['owner_id'],
         'story_type': 'incident', 'pending': True,
     }
-    for key in ('rule_id', 'cloud_id', 'machine_id', 'schedule_id',
-                'zone_id', 'record_id', 'subnet_id', 'network_id',
-                'script_id', 'stack_id', 'template_id', 'key_id',
-                'volume_id', ):
+    for key in INCIDENT_KEYS:
         if key in event:
             kwargs[key] = event[key]
     incidents = get_stories(**kwargs)
@@ -750,6 +764,55 @@ def close_open_incidents(event):
     log.warn('%s incident(s) closed by %s', len(incidents), event['log_id'])
 
 
+def close_open_incidents_batch(events):
+    """Close any open incidents based on the events provided.
+
+    Like `close_open_incidents`, but events with the same owner and incident
+    terms share a single search for open incidents.
+
+    """
+    events_by_terms = {}
+    for event in events:
+        if not event['error']:
+            terms = tuple((key, event[key]) for key in INCIDENT_KEYS
+                          if key in event)
+            events_by_terms.setdefault((event['owner_id'], terms),
+                                       []).append(event)
+    for (owner_id, terms), terms_events in events_by_terms.items():
+        incidents = get_stories(owner_id=owner_id, story_type='incident',
+                                pending=True, **dict(terms))
+        for event in terms_events:
+            event.setdefault('stories', []).extend(
+                ('closes', 'incident', inc['story_id']) for inc in incidents)
+            log.warn('%s incident(s) closed by %s', len(incidents),
+                     event['log_id'])
+
+
+def get_user_email(user_id):
+    """Return the email of a user, or None if the user doesn't exist.
+
+    Emails are cached for `config.LOG_EVENTS_EMAIL_CACHE_TTL` seconds, if
+    the event pipeline is enabled.
+
+    """
+    cache = config.LOG_EVENTS_ASYNC and config.LOG_EVENTS_EMAIL_CACHE_TTL > 0
+    if cache:
+        email, expires = _USER_EMAILS.get(user_id, (None, 0))
+        if expires > time.time():
+            return email
+    try:
+        email = User.objects.only('email').get(id=user_id).email
+    except User.DoesNotExist:
+        log.debug('User %s does not exist', user_id)
+        email = None
+    if cache:
+        if len(_USER_EMAILS) > 10000:
+            _USER_EMAILS.clear()
+        expires = time.time() + config.LOG_EVENTS_EMAIL_CACHE_TTL
+        _USER_EMAILS[user_id] = (email, expires)
+    return email
+
+
 def get_story(owner_id, story_id, story_type=None, expand=True):
     """Fetch a single story given its story_id."""
     assert story_id
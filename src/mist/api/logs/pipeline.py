@@ -0,0 +1,141 @@
+"""Asynchronous pipeline of log events
+
+When `config.LOG_EVENTS_ASYNC` is enabled, `log_event` no longer closes
+incidents or publishes to RabbitMQ itself. It puts the prepared event in a
+bounded, per process queue, which is drained by a background thread.
+
+The thread takes up to `config.LOG_EVENTS_BATCH_SIZE` events at a time,
+closes the open incidents the events of the batch should close, searching
+Elasticsearch once per owner and distinct set of incident terms, and
+publishes the whole batch to the "events" exchange on a single producer.
+
+If the queue is full, `log_event` waits for up to
+`config.LOG_EVENTS_QUEUE_TIMEOUT_MS` milliseconds and then drops the event.
+Delayed and dropped events are counted, along with queued, published and
+failed ones, in `EventPipeline.stats` and in Prometheus metrics.
+
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+import collections
+
+from mist.api import config
+
+
+log = logging.getLogger(__name__)
+
+
+class EventPipeline(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue = None
+        self.flusher = None
+        self.pid = None
+        self.stats = collections.Counter()
+        self.last_drop_warning = 0
+
+    def put(self, routing_key, event, close_incidents=False):
+        """Queue an event to be published, returns False if dropped"""
+        self._start_flusher()
+        item = (routing_key, event, close_incidents)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self._count('delayed')
+            try:
+                self.queue.put(
+                    item, timeout=config.LOG_EVENTS_QUEUE_TIMEOUT_MS / 1000.0)
+            except queue.Full:
+                self._count('dropped')
+                now = time.time()
+                if now - self.last_drop_warning > 10:
+                    self.last_drop_warning = now
+                    log.warning('Event queue is full, dropped %s events',
+                                self.stats['dropped'])
+                return False
+        self._count('queued')
+        return True
+
+    def flush(self):
+        """Publish all queued events"""
+        while self.queue is not None and self.pid == os.getpid():
+            batch = self._get_batch(block=False)
+            if not batch:
+                return
+            self._process(batch)
+
+    def _get_batch(self, block=True):
+        try:
+            batch = [self.queue.get(
+                block=block,
+                timeout=config.LOG_EVENTS_FLUSH_INTERVAL_MS / 1000.0)]
+        except queue.Empty:
+            return []
+        while len(batch) < config.LOG_EVENTS_BATCH_SIZE:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _process(self, batch):
+        from mist.api.helpers import amqp_publish_batch
+        from mist.api.logs.methods import close_open_incidents_batch
+
+        try:
+            close_open_incidents_batch(
+                [event for _, event, close_incidents in batch
+                 if close_incidents])
+        except Exception as exc:
+            log.error('Failed to close incidents of %d events: %r',
+                      len(batch), exc)
+        try:
+            amqp_publish_batch('events', [(routing_key, event)
+                                          for routing_key, event, _ in batch],
+                               ex_type='topic', ex_declare=True,
+                               auto_delete=False)
+        except Exception as exc:
+            self._count('failed', len(batch))
+            log.error('Failed to publish %d events: %r', len(batch), exc)
+        else:
+            self._count('published', len(batch))
+
+    def _count(self, outcome, count=1):
+        from mist.api.instrumentation import count_log_events
+        with self.lock:
+            self.stats[outcome] += count
+        count_log_events(outcome, count)
+
+    def _start_flusher(self):
+        # The queue and its thread don't survive forking, so start new ones
+        # in each process.
+        if self.pid == os.getpid() and self.flusher.is_alive():
+            return
+        with self.lock:
+            if self.pid == os.getpid() and self.flusher.is_alive():
+                return
+            if self.pid != os.getpid():
+                self.queue = queue.Queue(maxsize=config.LOG_EVENTS_QUEUE_SIZE)
+                self.stats.clear()
+            self.flusher = threading.Thread(target=self._flush_forever,
+                                            name='EventPipelineFlusher')
+            self.flusher.daemon = True
+            self.flusher.start()
+            self.pid = os.getpid()
+
+    def _flush_forever(self):
+        while True:
+            batch = self._get_batch()
+            if batch:
+                self._process(batch)
+
+
+event_pipeline = EventPipeline()
+
+# Don't lose queued events when the process exits.
+atexit.register(event_pipeline.flush)
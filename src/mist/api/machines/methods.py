@@ -29,6 +29,7 @@ import mist.api.tasks
 
 from mist.api.clouds.models import Cloud
 from mist.api.machines.models import Machine, KeyMachineAssociation
+from mist.api.machines.models import machines_as_dict
 from mist.api.keys.models import Key, SignedSSHKey
 from mist.api.networks.models import Network
 from mist.api.networks.models import Subnet
@@ -223,7 +224,7 @@ def list_machines(owner, cloud_id, cached=False, as_dict=True):
         machines = cloud.ctl.compute.list_machines()
     if not as_dict:
         return machines
-    return [machine.as_dict() for machine in machines]
+    return machines_as_dict(machines)
 
 
 def create_machine(auth_context, cloud_id, key_id, machine_name, location_id,
@@ -418,8 +419,8 @@ def create_machine(auth_context, cloud_id, key_id, machine_name, location_id,
     if port_forwards:
         validate_portforwards(port_forwards)
 
-    cached_machines = [m.as_dict()
-                       for m in cloud.ctl.compute.list_cached_machines()]
+    cached_machines = machines_as_dict(
+        cloud.ctl.compute.list_cached_machines())
 
     if cloud.ctl.provider is Container_Provider.DOCKER:
         if public_key:
@@ -2606,3 +2607,86 @@ def prepare_ssh_uri(auth_context, machine):
         base_ws_uri, user,
         hostname, port, key_association_id, expiry, mac)
     return ssh_uri
+
+
+def ping_probe_machines(machines):
+    """Ping probe many machines at once
+
+    All hosts are pinged together with `ping_hosts`, or with `ping` on a
+    thread pool if the VPN plugin is enabled. The probes are stored with a
+    single bulk write and a single patch is published per cloud.
+
+    """
+    import jsonpatch
+    from concurrent.futures import ThreadPoolExecutor
+    from pymongo import UpdateOne
+    from mist.api.helpers import amqp_publish_user, amqp_owner_listening
+    from mist.api.methods import ping, ping_hosts
+    from mist.api.machines.models import PingProbe
+
+    machines = list(machines)
+    cloud_ids = {getattr(machine._data['cloud'], 'id', machine._data['cloud'])
+                 for machine in machines}
+    clouds = {cloud.id: cloud
+              for cloud in Cloud.objects(id__in=list(cloud_ids),
+                                         enabled=True, deleted=None)}
+
+    hosts = {}
+    for machine in machines:
+        cloud = clouds.get(
+            getattr(machine._data['cloud'], 'id', machine._data['cloud']))
+        if cloud is None:
+            continue
+        # Avoid dereferencing the cloud of every machine.
+        machine._data['cloud'] = cloud
+        try:
+            host = machine.ctl.get_host()
+        except Exception:
+            continue
+        if host not in ['localhost', '127.0.0.1']:
+            hosts[machine] = host
+
+    if config.HAS_VPN:
+        def ping_machine(item):
+            machine, host = item
+            try:
+                return host, ping(machine.cloud.owner, host)
+            except Exception as exc:
+                log.warning('Error while ping-probing %s: %r', machine, exc)
+                return host, None
+        with ThreadPoolExecutor(config.PING_PROBE_CONCURRENCY) as executor:
+            results = dict(executor.map(ping_machine, hosts.items()))
+    else:
+        results = ping_hosts(hosts.values())
+
+    updates = []
+    patches = {}
+    for machine, host in hosts.items():
+        key = '%s-%s' % (machine.id, machine.machine_id)
+        old_probe = machine.ping_probe
+        old_probe_data = {key: {'probe': {
+            'ping': old_probe.as_dict() if old_probe is not None else {}}}}
+        data = results.get(host)
+        if data is None:
+            # The host couldn't be pinged, which doesn't mean it's down. Only
+            # results with 100% packet loss mark machines as unreachable.
+            log.debug('No ping results for %s (%s)', machine, host)
+            continue
+        probe = PingProbe()
+        probe.update_from_dict(data)
+        machine.ping_probe = probe
+        updates.append(UpdateOne({'_id': machine.id},
+                                 {'$set': {'ping_probe': probe.to_mongo()}}))
+        new_probe_data = {key: {'probe': {'ping': probe.as_dict()}}}
+        patch = jsonpatch.JsonPatch.from_diff(old_probe_data,
+                                              new_probe_data).patch
+        if patch:
+            patches.setdefault(machine.cloud, []).extend(patch)
+
+    if updates:
+        Machine._get_collection().bulk_write(updates, ordered=False)
+    for cloud, patch in patches.items():
+        if amqp_owner_listening(cloud.owner.id):
+            amqp_publish_user(cloud.owner.id, routing_key='patch_machines',
+                              data={'cloud_id': cloud.id, 'patch': patch})
+    return len(updates)
@@ -6,6 +6,8 @@ import logging
 import datetime
 import mongoengine as me
 
+from bson import DBRef
+
 from mist.api.tag.models import Tag
 
 from future.utils import string_types
@@ -366,6 +368,33 @@ class Machine(OwnershipMixin, me.Document):
             if key_associations[ka].key.deleted:
                 key_associations[ka].delete()
 
+        self.clean_machine_fields()
+
+    @classmethod
+    def clean_many(cls, machines):
+        """Clean many machines with a constant number of queries
+
+        Does what `clean` does for each machine, removing the key
+        associations of deleted keys of all machines at once. Machines
+        cleaned this way may be validated with `clean=False`.
+
+        """
+        saved = [machine for machine in machines if machine.id]
+        if saved:
+            associations = list(KeyMachineAssociation.objects(
+                machine__in=saved).only('id', 'key').no_dereference())
+            deleted_keys = set(Key.objects(
+                id__in=list(set(ka.key.id for ka in associations)),
+                deleted__ne=None).scalar('id'))
+            deleted = [ka.id for ka in associations
+                       if ka.key.id in deleted_keys]
+            if deleted:
+                KeyMachineAssociation.objects(id__in=deleted).delete()
+        for machine in machines:
+            machine.clean_machine_fields()
+
+    def clean_machine_fields(self):
+        """Clean the fields of the machine, without querying the db"""
         # Reset key_associations in case self goes missing/destroyed. This is
         # going to prevent the machine from showing up as "missing" in the
         # corresponding keys' associated machines list.
@@ -406,7 +435,8 @@ class Machine(OwnershipMixin, me.Document):
         except (AttributeError, me.DoesNotExist) as exc:
             log.error(exc)
 
-    def as_dict_v2(self, deref='auto', only=''):
+    def as_dict_v2(self, deref='auto', only='', tags=None,
+                   key_associations=None):
         from mist.api.helpers import prepare_dereferenced_dict
         standard_fields = [
             'id', 'name', 'hostname', 'state', 'public_ips', 'private_ips',
@@ -437,10 +467,12 @@ class Machine(OwnershipMixin, me.Document):
                 ret['external_id'] = self.machine_id
 
         if 'tags' in only or not only:
-            ret['tags'] = {
-                tag.key: tag.value for tag in Tag.objects(
-                    resource_id=self.id, resource_type='machine').only(
-                        'key', 'value')}
+            if tags is None:
+                tags = {
+                    tag.key: tag.value for tag in Tag.objects(
+                        resource_id=self.id, resource_type='machine').only(
+                            'key', 'value')}
+            ret['tags'] = tags
 
         if 'cost' in only or not only:
             ret['cost'] = self.cost.as_dict()
@@ -452,9 +484,10 @@ class Machine(OwnershipMixin, me.Document):
                 ret['monitoring'] = ''
 
         if 'key_associations' in only or not only:
+            if key_associations is None:
+                key_associations = KeyMachineAssociation.objects(machine=self)
             ret['key_associations'] = [
-                ka.as_dict() for ka in KeyMachineAssociation.objects(
-                    machine=self)
+                ka.as_dict() for ka in key_associations
             ]
 
         if 'probe' in only or not only:
@@ -498,11 +531,14 @@ class Machine(OwnershipMixin, me.Document):
 
         return ret
 
-    def as_dict(self):
+    def as_dict(self, tags=None, key_associations=None):
         # Return a dict as it will be returned to the API
-        tags = {tag.key: tag.value for tag in Tag.objects(
-            resource_id=self.id, resource_type='machine'
-        ).only('key', 'value')}
+        if tags is None:
+            tags = {tag.key: tag.value for tag in Tag.objects(
+                resource_id=self.id, resource_type='machine'
+            ).only('key', 'value')}
+        if key_associations is None:
+            key_associations = KeyMachineAssociation.objects(machine=self)
         try:
             if self.expiration:
                 expiration = {
@@ -552,8 +588,7 @@ class Machine(OwnershipMixin, me.Document):
                 self.monitoring.as_dict() if self.monitoring and
                 self.monitoring.hasmonitoring else '',
             'key_associations':
-                {str(ka.id): ka.as_dict()
-                 for ka in KeyMachineAssociation.objects(machine=self)},
+                {str(ka.id): ka.as_dict() for ka in key_associations},
             'cloud': self.cloud.id,
             'location': self.location.id if self.location else '',
             'size': self.size.name if self.size else '',
@@ -623,3 +658,77 @@ class KeyMachineAssociation(me.Document):
             'user': self.ssh_user,
             'port': self.port
         }
+
+
+def _prefetch_references(documents, fields):
+    """Dereference reference fields of many documents with one query each
+
+    `fields` is a dict of reference field names to the model they point to.
+    Referenced documents are fetched with a single `$in` query per field and
+    cached on each document, the same way mongoengine caches a lazily
+    dereferenced field, so that subsequent attribute access will not hit the
+    database. Dangling references are left untouched.
+
+    """
+    for field, model in fields.items():
+        refs = {}
+        for doc in documents:
+            value = doc._data.get(field)
+            if isinstance(value, DBRef):
+                refs.setdefault(value.id, []).append(doc)
+        if not refs:
+            continue
+        for related in model.objects(id__in=list(refs.keys())):
+            for doc in refs[related.id]:
+                doc._data[field] = related
+
+
+def machines_as_dict(machines, v2=False, deref='auto', only=''):
+    """Serialize many machines at once
+
+    Returns the same list that calling `as_dict` (or `as_dict_v2` if `v2` is
+    True) on each machine would, but tags, key associations and referenced
+    documents are loaded in batch, with a constant number of queries
+    regardless of the number of machines.
+
+    """
+    from mist.api.clouds.models import Cloud, CloudLocation, CloudSize
+    from mist.api.images.models import CloudImage
+    from mist.api.networks.models import Network, Subnet
+    from mist.api.users.models import User
+
+    machines = list(machines)
+    if not machines:
+        return []
+    machine_ids = [machine.id for machine in machines]
+
+    _prefetch_references(machines, {
+        'cloud': Cloud, 'location': CloudLocation, 'size': CloudSize,
+        'image': CloudImage, 'network': Network, 'subnet': Subnet,
+        'parent': Machine, 'expiration': Schedule,
+        'owned_by': User, 'created_by': User,
+    })
+    expirations = [machine._data['expiration'] for machine in machines
+                   if isinstance(machine._data.get('expiration'), Schedule)]
+    _prefetch_references(expirations, {'reminder': Schedule})
+
+    tags = {machine_id: {} for machine_id in machine_ids}
+    for tag in Tag.objects(resource_type='machine',
+                           resource_id__in=machine_ids).only(
+                               'resource_id', 'key', 'value'):
+        tags[tag.resource_id][tag.key] = tag.value
+
+    key_associations = {machine_id: [] for machine_id in machine_ids}
+    for ka in KeyMachineAssociation.objects(machine__in=machine_ids):
+        if isinstance(ka._data.get('machine'), DBRef):
+            key_associations[ka._data['machine'].id].append(ka)
+
+    if v2:
+        return [machine.as_dict_v2(deref=deref, only=only,
+                                   tags=tags[machine.id],
+                                   key_associations=key_associations[
+                                       machine.id])
+                for machine in machines]
+    return [machine.as_dict(tags=tags[machine.id],
+                            key_associations=key_associations[machine.id])
+            for machine in machines]
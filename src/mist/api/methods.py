@@ -1,9 +1,12 @@
 import re
+import math
+import shutil
 import subprocess
 import distutils.util
 
 import pingparsing
 
+from concurrent.futures import ThreadPoolExecutor
 
 from mongoengine import DoesNotExist, Q, BooleanField
 
@@ -326,7 +329,10 @@ def ping(owner, host, pkts=10):
         result = _ping_host(host, pkts=pkts)
 
     # In both cases, the returned dict is formatted by pingparsing.
+    return _format_ping_result(result)
 
+
+def _format_ping_result(result):
     # Rename keys.
     final = {}
     for key, newkey in (('packet_transmit', 'packets_tx'),
@@ -342,6 +348,85 @@ def ping(owner, host, pkts=10):
     return final
 
 
+def _parse_fping_output(output, pkts):
+    """Parse the per host output of `fping -C`
+
+    Each line looks like `host : 0.05 0.04 - 0.06`, where `-` stands for a
+    lost packet. Results are formatted like pingparsing's.
+
+    """
+    results = {}
+    for line in output.splitlines():
+        host, sep, rtts = line.partition(' : ')
+        if not sep:
+            continue
+        rtts = [float(rtt) for rtt in rtts.split() if rtt != '-']
+        result = {
+            'packet_transmit': pkts,
+            'packet_receive': len(rtts),
+            'packet_loss_rate': (pkts - len(rtts)) * 100.0 / pkts,
+            'packet_duplicate_rate': 0.0,
+            'rtt_min': None, 'rtt_max': None, 'rtt_avg': None,
+            'rtt_mdev': None,
+        }
+        if rtts:
+            avg = sum(rtts) / len(rtts)
+            result.update({
+                'rtt_min': min(rtts),
+                'rtt_max': max(rtts),
+                'rtt_avg': avg,
+                'rtt_mdev': math.sqrt(max(sum(rtt * rtt for rtt in rtts) /
+                                          len(rtts) - avg * avg, 0)),
+            })
+        results[host.strip()] = result
+    return results
+
+
+def _fping_hosts(hosts, pkts):
+    proc = subprocess.run(
+        ['fping', '-q', '-C', str(pkts), '-p', '400', '-i', '1', '-t', '1000',
+         '-B', '1', '-r', '0', '-f', '-'],
+        input='\n'.join(hosts).encode(), stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE)
+    return _parse_fping_output(proc.stderr.decode(), pkts)
+
+
+def _ping_hosts(hosts, pkts):
+    def ping_host(host):
+        try:
+            return host, _ping_host(host, pkts=pkts)
+        except Exception as exc:
+            log.warning('Error while pinging %s: %r', host, exc)
+            return host, None
+
+    workers = min(len(hosts), config.PING_PROBE_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(ping_host, hosts))
+
+
+def ping_hosts(hosts, pkts=10):
+    """Ping many hosts at once
+
+    All hosts are pinged by a single fping process if fping is installed,
+    otherwise by up to `config.PING_PROBE_CONCURRENCY` concurrent ping
+    processes. Returns a dict of host to the result formatted like `ping`'s.
+    Hosts that couldn't be pinged are missing from the result.
+
+    """
+    hosts = list(set(hosts))
+    if not hosts:
+        return {}
+    if shutil.which('fping'):
+        results = _fping_hosts(hosts, pkts)
+    else:
+        results = _ping_hosts(hosts, pkts)
+    # Ping's output can't be parsed if it failed to run, eg. because the
+    # host couldn't be resolved.
+    return {host: _format_ping_result(result)
+            for host, result in results.items()
+            if result and result.get('packet_transmit')}
+
+
 def find_public_ips(ips):
     public_ips = []
     for ip in ips:
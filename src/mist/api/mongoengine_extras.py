@@ -1,6 +1,12 @@
+import logging
+import datetime
+
 import mongoengine as me
 
 
+log = logging.getLogger(__name__)
+
+
 class MistDictField(me.DictField):
     def validate(self, value):
         assert isinstance(value, dict), (type(value), value)
@@ -27,3 +33,91 @@ def sanitize_dict(value):
         k = key.replace('.', '_').replace('$', '_')
         value[k] = sanitize_dict(value.pop(key))
     return value
+
+
+def touch_updated_at(doc, ignored_fields=()):
+    """Set `doc.updated_at` to now if any meaningful field has changed
+
+    Fields in `ignored_fields`, such as bookkeeping fields updated on every
+    run of a task, do not count as a change. This is meant to be called from
+    a document's `clean` method, before it gets saved.
+
+    """
+    changed = set(field.split('.')[0] for field in doc._get_changed_fields())
+    if doc._created or not doc.updated_at or changed - set(ignored_fields):
+        doc.updated_at = datetime.datetime.utcnow()
+
+
+def bulk_save(documents, batch_size=None, upsert_on=(), clean=True):
+    """Save documents of a collection with unordered bulk writes
+
+    Documents are validated first, which runs their `clean` method like
+    saving them would, unless `clean` is False. New documents are inserted, or upserted on the
+    fields in `upsert_on` if given, while existing ones only have their
+    changed fields set or unset, to not overwrite concurrent changes of
+    other fields. Each document is written at most once, with a bulk write
+    per `batch_size` documents, or a single one if not given.
+
+    Saved documents are marked as not created and unchanged. Returns the
+    list of documents that failed to validate or be written.
+
+    """
+    from pymongo import InsertOne, UpdateOne
+    from pymongo.errors import BulkWriteError
+
+    failed = []
+    pending = []
+    seen = set()
+    for doc in documents:
+        if id(doc) in seen:
+            continue
+        seen.add(id(doc))
+        try:
+            doc.validate(clean=clean)
+        except me.ValidationError as exc:
+            log.error("Error validating %s: %s", doc, exc.to_dict())
+            failed.append(doc)
+            continue
+        if doc._created:
+            son = doc.to_mongo()
+            if upsert_on:
+                doc_id = son.pop('_id')
+                operation = UpdateOne(
+                    {field: son.get(field) for field in upsert_on},
+                    {'$set': son, '$setOnInsert': {'_id': doc_id}},
+                    upsert=True)
+            else:
+                operation = InsertOne(son)
+        else:
+            sets, unsets = doc._delta()
+            update = {}
+            if sets:
+                update['$set'] = sets
+            if unsets:
+                update['$unset'] = unsets
+            if not update:
+                doc._clear_changed_fields()
+                continue
+            operation = UpdateOne({'_id': doc.pk}, update)
+        pending.append((doc, operation))
+
+    batch_size = batch_size or len(pending)
+    for i in range(0, len(pending), batch_size or 1):
+        batch = pending[i:i + batch_size]
+        errors = []
+        try:
+            batch[0][0]._get_collection().bulk_write(
+                [operation for _, operation in batch], ordered=False)
+        except BulkWriteError as exc:
+            errors = exc.details.get('writeErrors', [])
+            log.error("Bulk write of %s failed for %d of %d documents: %s",
+                      batch[0][0]._get_collection_name(), len(errors),
+                      len(batch), errors)
+        failed_indexes = set(error['index'] for error in errors)
+        for index, (doc, _) in enumerate(batch):
+            if index in failed_indexes:
+                failed.append(doc)
+            else:
+                doc._created = False
+                doc._clear_changed_fields()
+    return failed
@@ -1,6 +1,8 @@
 import logging
 import requests
 import time
+import threading
+import collections
 
 from mist.api.exceptions import ForbiddenError
 from mist.api.exceptions import ServiceUnavailableError
@@ -13,6 +15,74 @@ from mist.api.monitoring.victoriametrics.helpers import (
 log = logging.getLogger(__name__)
 
 
+# Keep-alive sessions per tenant URI, least recently used first.
+_sessions = collections.OrderedDict()
+_sessions_lock = threading.Lock()
+MAX_SESSIONS = 100
+
+
+def get_tenant_uri(owner_id):
+    # Need to trim org due to 32 bit limitation of
+    # the accountID on victoria metrics tenants
+    return config.VICTORIAMETRICS_URI.replace(
+        "<org_id>", str(int(owner_id[:8], 16)))
+
+
+def get_session(uri):
+    """Return a shared session with a pool of connections to `uri`"""
+    with _sessions_lock:
+        session = _sessions.pop(uri, None)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_maxsize=config.VICTORIAMETRICS_MAX_CONCURRENT_QUERIES)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        _sessions[uri] = session
+        while len(_sessions) > MAX_SESSIONS:
+            _, old_session = _sessions.popitem(last=False)
+            old_session.close()
+    return session
+
+
+def use_deriv(metric_name):
+    return metric_name.startswith(
+        ("diskio", "net")) and not metric_name.startswith(
+            "diskio_iops_in_progress")
+
+
+def generate_queries(metrics, machine_id):
+    """Generate the queries that fetch `metrics` of a machine
+
+    Metrics that share the same labels are combined into a single
+    `{__name__=~"a|b"}` query, unless their rate is requested, since `rate`
+    drops the names of the series. Returns a list of (query, metric name)
+    tuples, where the metric name is None for combined queries.
+
+    """
+    groups = collections.OrderedDict()
+    queries = []
+    for metric in metrics:
+        metric_name, labels = parse_metric(metric)
+        labels["machine_id"] = machine_id
+        if use_deriv(metric_name):
+            metric_promql = generate_metric_promql(metric_name, labels)
+            queries.append((f"rate({metric_promql})", metric_name))
+        else:
+            key = tuple(sorted(labels.items()))
+            groups.setdefault(key, (labels, []))[1].append(metric_name)
+    for labels, metric_names in groups.values():
+        if len(metric_names) == 1:
+            queries.append(
+                (generate_metric_promql(metric_names[0], labels),
+                 metric_names[0]))
+        else:
+            selector = generate_metric_promql("", labels)
+            queries.append(('{__name__=~"%s",%s' % (
+                "|".join(metric_names), selector[1:]), None))
+    return queries
+
+
 def get_stats(machine, start="", stop="", step="", metrics=None):
     data = {}
     time_args = calculate_time_args(start, stop, step)
@@ -20,25 +90,13 @@ def get_stats(machine, start="", stop="", step="", metrics=None):
         metrics = list(find_metrics(machine).keys())
     if not isinstance(metrics, list):
         metrics = [metrics]
-    raw_machine_data_list = []
-    use_deriv = False
-    for metric in metrics:
-        metric_name, labels = parse_metric(metric)
-        labels["machine_id"] = machine.id
-        metric_promql = generate_metric_promql(metric_name, labels)
-        use_deriv = metric_name.startswith(
-            ("diskio", "net")) and not metric_name.startswith(
-                "diskio_iops_in_progress")
-        if use_deriv:
-            query = f"rate({metric_promql})"
-        else:
-            query = metric_promql
+    uri = get_tenant_uri(machine.owner.id)
+    session = get_session(uri)
+
+    def _run(query_args):
+        query, metric_name = query_args
         try:
-            # Need to trim org due to 32 bit limitation of
-            # the accountID on victoria metrics tenants
-            uri = config.VICTORIAMETRICS_URI.replace(
-                "<org_id>", str(int(machine.owner.id[:8], 16)))
-            raw_machine_data = requests.get(
+            raw_machine_data = session.get(
                 f"{uri}/api/v1/query_range"
                 f"?query={query}{time_args}", timeout=20)
         except Exception as exc:
@@ -53,10 +111,21 @@ def get_stats(machine, start="", stop="", step="", metrics=None):
             raise ServiceUnavailableError()
         raw_machine_data = raw_machine_data.json()
         for result in raw_machine_data.get("data", {}).get("result", []):
-            if result.get("metric"):
+            if result.get("metric") and metric_name:
                 if not result["metric"].get("__name__"):
                     result["metric"]["__name__"] = metric_name
-        raw_machine_data_list.append(raw_machine_data)
+        return raw_machine_data
+
+    queries = generate_queries(metrics, machine.id)
+    if len(queries) > 1:
+        # Fetch the metrics concurrently, over the tenant's connection pool.
+        from concurrent.futures import ThreadPoolExecutor
+        workers = min(len(queries),
+                      config.VICTORIAMETRICS_MAX_CONCURRENT_QUERIES)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            raw_machine_data_list = list(executor.map(_run, queries))
+    else:
+        raw_machine_data_list = list(map(_run, queries))
 
     for raw_machine_data in raw_machine_data_list:
         for result in raw_machine_data.get('data', {}).get('result', {}):
@@ -69,25 +138,95 @@ def get_stats(machine, start="", stop="", step="", metrics=None):
             }
 
     if not isinstance(machine, str):
-        # set activated_at for collectd/telegraf installation status
-        # if no data previously received for machine
-        from mist.api.monitoring.methods import notify_machine_monitoring
-        from mist.api.rules.tasks import add_nodata_rule
-
-        istatus = machine.monitoring.installation_status
-        if not istatus.activated_at:
-            for val in (point[0] for item in list(data.values())
-                        for point in item['datapoints']
-                        if int(float(point[1])) >= istatus.started_at):
-                if val is not None:
-                    if not istatus.finished_at:
-                        istatus.finished_at = time.time()
-                    istatus.activated_at = time.time()
-                    istatus.state = 'succeeded'
-                    machine.save()
-                    add_nodata_rule.send(machine.owner.id, 'victoriametrics')
-                    notify_machine_monitoring(machine)
-                    break
+        _update_installation_status(machine, data)
+
+    return data
+
+
+def _update_installation_status(machine, data):
+    """Set activated_at for collectd/telegraf installation status
+
+    if no data previously received for machine
+    """
+    from mist.api.monitoring.methods import notify_machine_monitoring
+    from mist.api.rules.tasks import add_nodata_rule
+
+    istatus = machine.monitoring.installation_status
+    if not istatus.activated_at:
+        for val in (point[0] for item in list(data.values())
+                    for point in item['datapoints']
+                    if int(float(point[1])) >= istatus.started_at):
+            if val is not None:
+                if not istatus.finished_at:
+                    istatus.finished_at = time.time()
+                istatus.activated_at = time.time()
+                istatus.state = 'succeeded'
+                machine.save()
+                add_nodata_rule.send(machine.owner.id, 'victoriametrics')
+                notify_machine_monitoring(machine)
+                break
+
+
+def get_stats_batch(owner_id, machines, start="", stop="", step="",
+                    metric=""):
+    """Get a single metric for multiple machines of the same org
+
+    All machines are selected by a single query with a `machine_id=~"a|b|c"`
+    label matcher. Returns a dict of machine ids to data in the same format
+    as `get_stats`.
+
+    """
+    if not machines:
+        return {}
+    time_args = calculate_time_args(start, stop, step)
+    metric_name, labels = parse_metric(metric)
+    labels.pop("machine_id", None)
+    metric_promql = generate_metric_promql(metric_name, labels)
+    if metric_promql.endswith("}"):
+        metric_promql = metric_promql[:-1] + ","
+    else:
+        metric_promql += "{"
+    metric_promql += 'machine_id=~"%s"}' % "|".join(
+        machine.id for machine in machines)
+    if use_deriv(metric_name):
+        query = f"rate({metric_promql})"
+    else:
+        query = metric_promql
+    try:
+        uri = get_tenant_uri(owner_id)
+        # Send the query in the request's body, since the list of machine
+        # ids may exceed the maximum length of a URL.
+        raw_data = get_session(uri).post(
+            f"{uri}/api/v1/query_range?{time_args[1:]}",
+            data={"query": query}, timeout=20)
+    except Exception as exc:
+        log.error('Got %r on get_stats_batch for %d machines of org %s',
+                  exc, len(machines), owner_id)
+        raise ServiceUnavailableError()
+
+    if not raw_data.ok:
+        log.error('Got %d on get_stats_batch: %s',
+                  raw_data.status_code, raw_data.content)
+        raise ServiceUnavailableError()
+
+    data = {}
+    for result in raw_data.json().get("data", {}).get("result", []):
+        result_labels = result.get("metric", {})
+        machine_id = result_labels.get("machine_id")
+        if not machine_id:
+            continue
+        if not result_labels.get("__name__"):
+            result_labels["__name__"] = metric_name
+        name = generate_metric_mist(result_labels)
+        data.setdefault(machine_id, {})[name] = {
+            "name": name,
+            "datapoints": [[parse_value(val), str(dt)]
+                           for dt, val in result.get("values")]
+        }
+
+    for machine in machines:
+        if machine.id in data:
+            _update_installation_status(machine, data[machine.id])
 
     return data
 
@@ -96,9 +235,8 @@ def find_metrics(machine):
     if not machine.monitoring.hasmonitoring:
         raise ForbiddenError("Machine doesn't have monitoring enabled.")
     try:
-        uri = config.VICTORIAMETRICS_URI.replace(
-            "<org_id>", str(int(machine.owner.id[:8], 16)))
-        data = requests.get(
+        uri = get_tenant_uri(machine.owner.id)
+        data = get_session(uri).get(
             f"{uri}/api/v1/series",
             params={"match[]": f"{{machine_id=\"{machine.id}\"}}"})
     except Exception as exc:
@@ -128,9 +266,8 @@ def get_load(org, machines, start, stop, step):
     data = {}
     time_args = calculate_time_args(start, stop, step)
     try:
-        uri = config.VICTORIAMETRICS_URI.replace(
-            "<org_id>", str(int(org.id[:8], 16)))
-        raw_load_data = requests.get(
+        uri = get_tenant_uri(org.id)
+        raw_load_data = get_session(uri).get(
             f"{uri}/api/v1/query_range?query="
             f"{{__name__=\"system_load1\"}}{time_args}", timeout=20)
     except Exception as exc:
@@ -168,9 +305,8 @@ def get_cores(org, machines, start, stop, step):
         promql_machine_ids += machine + "|"
     promql_machine_ids = promql_machine_ids[:-1]
     try:
-        uri = config.VICTORIAMETRICS_URI.replace(
-            "<org_id>", str(int(org.id[:8], 16)))
-        raw_machine_data = requests.get(
+        uri = get_tenant_uri(org.id)
+        raw_machine_data = get_session(uri).get(
             f"{uri}/api/v1/query_range?query="
             f"count({{__name__=\"cpu_usage_idle\", cpu=~\"cpu[0-9]*\","
             f" machine_id=~\"{promql_machine_ids}\"}}) by (machine_id)"
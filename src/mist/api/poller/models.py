@@ -1,3 +1,5 @@
+import json
+import hashlib
 import logging
 import datetime
 
@@ -8,6 +10,7 @@ from mist.api.clouds.models import Cloud
 from mist.api.machines.models import Machine
 from mist.api.containers.models import Cluster
 from mist.api.sharding.mixins import ShardedScheduleMixin
+from mist.api.mongoengine_extras import touch_updated_at
 
 
 log = logging.getLogger(__name__)
@@ -39,12 +42,55 @@ class PollingInterval(me.EmbeddedDocument):
         return msg
 
 
+class AdaptivePollingStats(me.EmbeddedDocument):
+    """Statistics of the runs of a polling schedule
+
+    Used to back off the polling of resources that rarely change, when
+    `config.POLLING_ADAPTIVE_INTERVALS` is enabled.
+
+    """
+
+    # The interval of the schedule is multiplied by this factor.
+    factor = me.FloatField(default=1)
+    # Number of runs since the listed resources last changed or since the
+    # factor was last increased.
+    stable_runs = me.IntField(default=0)
+    runs = me.IntField(default=0)
+    changed_runs = me.IntField(default=0)
+    last_changed_at = me.DateTimeField()
+    # Hash of the resources listed by the last run.
+    fingerprint = me.StringField()
+    # Exponentially weighted moving average of the duration of runs.
+    avg_duration = me.FloatField(default=0)
+
+
+# Fields of listed resources that are updated by every run or by probes,
+# without the resources themselves changing.
+FINGERPRINT_IGNORED_FIELDS = (
+    'last_seen', 'missing_since', 'updated_at', 'unreachable_since',
+    'ping_probe', 'ssh_probe', 'probe',
+)
+
+
+def resources_fingerprint(resources):
+    """Return a hash of listed resources, ignoring fields set on every run"""
+    docs = []
+    for resource in resources or []:
+        if hasattr(resource, 'to_mongo'):
+            resource = resource.to_mongo().to_dict()
+        if isinstance(resource, dict):
+            resource = {key: value for key, value in resource.items()
+                        if key not in FINGERPRINT_IGNORED_FIELDS}
+        docs.append(json.dumps(resource, sort_keys=True, default=str))
+    return hashlib.sha1('\n'.join(sorted(docs)).encode()).hexdigest()
+
+
 class PollingSchedule(ShardedScheduleMixin, me.Document):
 
     meta = {
         'allow_inheritance': True,
         'strict': False,
-        'indexes': ['shard_id', 'shard_update_at']
+        'indexes': ['shard_id', 'shard_update_at', 'shard_hash', 'updated_at']
     }
 
     # We use a unique name for easy identification and to avoid running the
@@ -70,6 +116,13 @@ class PollingSchedule(ShardedScheduleMixin, me.Document):
     total_run_count = me.IntField(min_value=0)
     run_immediately = me.BooleanField()
 
+    # Last time the schedule's definition changed, used by the scheduler to
+    # reload only the schedules that have changed.
+    updated_at = me.DateTimeField()
+
+    # Used to adapt the interval to how often the polled resources change.
+    adaptive_stats = me.EmbeddedDocumentField(AdaptivePollingStats)
+
     def get_name(self):
         """Construct name based on self.task"""
         try:
@@ -80,6 +133,8 @@ class PollingSchedule(ShardedScheduleMixin, me.Document):
     def clean(self):
         """Automatically set value of name"""
         self.name = self.get_name()
+        touch_updated_at(self, ('last_run_at', 'total_run_count',
+                                'shard_id', 'shard_update_at'))
 
     @property
     def task(self):
@@ -109,7 +164,9 @@ class PollingSchedule(ShardedScheduleMixin, me.Document):
         """Merge multiple intervals into one
 
         Returns a dynamic PollingInterval, with the highest frequency of any
-        override schedule or the default schedule.
+        override schedule or the default schedule. Only the default schedule
+        is backed off, overrides such as the one added while a user has the
+        UI open are returned unchanged.
 
         """
         interval = self.default_interval
@@ -117,7 +174,82 @@ class PollingSchedule(ShardedScheduleMixin, me.Document):
             if not i.expired():
                 if not interval.timedelta or i.timedelta < interval.timedelta:
                     interval = i
-        return interval
+        if interval is not self.default_interval:
+            return interval
+        return self.adapt_interval(interval)
+
+    def adapt_interval(self, interval):
+        """Back off the given interval if the polled resources are stable
+
+        The interval is multiplied by the backoff factor of the schedule and
+        is not allowed to be shorter than the configured multiple of the
+        average duration of a run. The result is bounded between
+        `config.POLLING_ADAPTIVE_MIN_INTERVAL` and the largest of
+        `config.POLLING_ADAPTIVE_MAX_INTERVAL` and the original interval.
+
+        """
+        stats = self.adaptive_stats
+        if not config.POLLING_ADAPTIVE_INTERVALS or stats is None or \
+                not interval.every:
+            return interval
+        ratio = config.POLLING_ADAPTIVE_DURATION_RATIO
+        every = max(interval.every * stats.factor, stats.avg_duration * ratio)
+        every = min(every, max(interval.every,
+                               config.POLLING_ADAPTIVE_MAX_INTERVAL))
+        every = max(int(every), config.POLLING_ADAPTIVE_MIN_INTERVAL)
+        if every == interval.every:
+            return interval
+        return PollingInterval(name=interval.name, every=every,
+                               expires=interval.expires)
+
+    def record_run(self, resources, duration):
+        """Update the adaptive stats of the schedule after a successful run
+
+        If the listed resources haven't changed for
+        `config.POLLING_ADAPTIVE_STABLE_RUNS` runs, the backoff factor is
+        doubled, whereas any change resets it. The stats are updated
+        atomically and `updated_at` is only touched if the interval changed,
+        so that the scheduler reloads the schedule.
+
+        """
+        if not config.POLLING_ADAPTIVE_INTERVALS:
+            return
+        previous = self.interval.every
+        stats = self.adaptive_stats or AdaptivePollingStats()
+        now = datetime.datetime.utcnow()
+        fingerprint = resources_fingerprint(resources)
+        stats.runs += 1
+        if stats.avg_duration:
+            stats.avg_duration = 0.7 * stats.avg_duration + 0.3 * duration
+        else:
+            stats.avg_duration = duration
+        if fingerprint != stats.fingerprint:
+            if stats.fingerprint is not None:
+                stats.changed_runs += 1
+                stats.last_changed_at = now
+            stats.fingerprint = fingerprint
+            stats.factor = 1
+            stats.stable_runs = 0
+        else:
+            stats.stable_runs += 1
+            if stats.stable_runs >= config.POLLING_ADAPTIVE_STABLE_RUNS:
+                stats.factor = min(stats.factor * 2,
+                                   config.POLLING_ADAPTIVE_MAX_FACTOR)
+                stats.stable_runs = 0
+        self.adaptive_stats = stats
+        update = {'set__adaptive_stats': stats}
+        if self.interval.every != previous:
+            log.info('Adapting interval of %s from %ss to %ss', self.name,
+                     previous, self.interval.every)
+            update['set__updated_at'] = now
+        type(self).objects(id=self.id).update(**update)
+
+    def reset_adaptive_interval(self):
+        """Poll at the original interval again, eg. after a user action"""
+        if self.adaptive_stats is not None and \
+                self.adaptive_stats.factor != 1:
+            self.adaptive_stats.factor = 1
+            self.adaptive_stats.stable_runs = 0
 
     @property
     def expires(self):
@@ -233,7 +365,15 @@ class CloudPollingSchedule(PollingSchedule):
                            self.cloud.id)
 
     @classmethod
-    def add(cls, cloud, run_immediately=True, interval=None, ttl=300):
+    def add(cls, cloud, run_immediately=True, interval=None, ttl=300,
+            name=''):
+        """Add or update the schedule of a cloud
+
+        Unless `name` is 'session', which marks the override interval added
+        while a user has the UI open, this is considered a user action and
+        any adaptive backoff of the schedule is reset.
+
+        """
         try:
             schedule = cls.objects.get(cloud=cloud)
         except cls.DoesNotExist:
@@ -246,7 +386,9 @@ class CloudPollingSchedule(PollingSchedule):
                 schedule = cls.objects.get(cloud=cloud)
         schedule.set_default_interval(cloud.polling_interval)
         if interval is not None:
-            schedule.add_interval(interval, ttl)
+            schedule.add_interval(interval, ttl, name=name)
+        if name != 'session':
+            schedule.reset_adaptive_interval()
         if run_immediately:
             schedule.run_immediately = True
         schedule.cleanup_expired_intervals()
@@ -1,3 +1,4 @@
+import time
 import logging
 import datetime
 
@@ -21,6 +22,7 @@ __all__ = [
     'list_volumes',
     'list_buckets',
     'ping_probe',
+    'ping_probe_batch',
     'ssh_probe'
 ]
 
@@ -34,6 +36,22 @@ def autodisable_cloud(cloud):
     notify_user(cloud.owner, title=cloud, message=message, email_notify=True)
 
 
+def poll(sched, list_resources):
+    """Run a listing of the schedule's resources and record it
+
+    The listed resources and the duration of the run are used to adapt the
+    interval of the schedule, see `PollingSchedule.record_run`.
+
+    """
+    start = time.time()
+    resources = list_resources(persist=False)
+    try:
+        sched.record_run(resources, time.time() - start)
+    except Exception as exc:
+        log.error('Error recording run of %s: %r', sched.name, exc)
+    return resources
+
+
 @dramatiq.actor
 def debug(schedule_id):
     # FIXME: Resolve circular imports
@@ -55,7 +73,7 @@ def list_machines(schedule_id):
     from mist.api.poller.models import ListMachinesPollingSchedule
     sched = ListMachinesPollingSchedule.objects.get(id=schedule_id)
     try:
-        sched.cloud.ctl.compute.list_machines(persist=False)
+        poll(sched, sched.cloud.ctl.compute.list_machines)
     except (PeriodicTaskLockTakenError, PeriodicTaskTooRecentLastRun) as exc:
         list_machines.logger.warning(
             '%s failed with %r',
@@ -71,7 +89,7 @@ def list_clusters(schedule_id):
     from mist.api.poller.models import ListClustersPollingSchedule
     sched = ListClustersPollingSchedule.objects.get(id=schedule_id)
     try:
-        sched.cloud.ctl.container.list_clusters(persist=False)
+        poll(sched, sched.cloud.ctl.container.list_clusters)
     except (PeriodicTaskLockTakenError, PeriodicTaskTooRecentLastRun) as exc:
         list_clusters.logger.warning(
             '%s failed with %r',
@@ -85,7 +103,7 @@ def list_locations(schedule_id):
     from mist.api.poller.models import ListLocationsPollingSchedule
     sched = ListLocationsPollingSchedule.objects.get(id=schedule_id)
     try:
-        sched.cloud.ctl.compute.list_locations(persist=False)
+        poll(sched, sched.cloud.ctl.compute.list_locations)
     except (PeriodicTaskLockTakenError, PeriodicTaskTooRecentLastRun) as exc:
         list_locations.logger.warning(
             '%s failed with %r',
@@ -99,7 +117,7 @@ def list_sizes(schedule_id):
     from mist.api.poller.models import ListSizesPollingSchedule
     sched = ListSizesPollingSchedule.objects.get(id=schedule_id)
     try:
-        sched.cloud.ctl.compute.list_sizes(persist=False)
+        poll(sched, sched.cloud.ctl.compute.list_sizes)
     except (PeriodicTaskLockTakenError, PeriodicTaskTooRecentLastRun) as exc:
         list_sizes.logger.warning(
             '%s failed with %r',
@@ -113,7 +131,7 @@ def list_images(schedule_id):
     from mist.api.poller.models import ListImagesPollingSchedule
     sched = ListImagesPollingSchedule.objects.get(id=schedule_id)
     try:
-        sched.cloud.ctl.compute.list_images(persist=False)
+        poll(sched, sched.cloud.ctl.compute.list_images)
     except (PeriodicTaskLockTakenError, PeriodicTaskTooRecentLastRun) as exc:
         list_images.logger.warning(
             '%s failed with %r',
@@ -128,7 +146,7 @@ def list_networks(schedule_id):
     from mist.api.poller.models import ListNetworksPollingSchedule
     sched = ListNetworksPollingSchedule.objects.get(id=schedule_id)
     try:
-        sched.cloud.ctl.network.list_networks(persist=False)
+        poll(sched, sched.cloud.ctl.network.list_networks)
     except (PeriodicTaskLockTakenError, PeriodicTaskTooRecentLastRun) as exc:
         list_networks.logger.warning(
             '%s failed with %r',
@@ -144,7 +162,7 @@ def list_zones(schedule_id):
     from mist.api.poller.models import ListZonesPollingSchedule
     sched = ListZonesPollingSchedule.objects.get(id=schedule_id)
     try:
-        sched.cloud.ctl.dns.list_zones(persist=False)
+        poll(sched, sched.cloud.ctl.dns.list_zones)
     except (PeriodicTaskLockTakenError, PeriodicTaskTooRecentLastRun) as exc:
         list_zones.logger.warning(
             '%s failed with %r',
@@ -158,7 +176,7 @@ def list_volumes(schedule_id):
     from mist.api.poller.models import ListVolumesPollingSchedule
     sched = ListVolumesPollingSchedule.objects.get(id=schedule_id)
     try:
-        sched.cloud.ctl.storage.list_volumes(persist=False)
+        poll(sched, sched.cloud.ctl.storage.list_volumes)
     except (PeriodicTaskLockTakenError, PeriodicTaskTooRecentLastRun) as exc:
         list_volumes.logger.warning(
             '%s failed with %r',
@@ -175,7 +193,7 @@ def list_buckets(schedule_id):
     from mist.api.poller.models import ListBucketsPollingSchedule
     sched = ListBucketsPollingSchedule.objects.get(id=schedule_id)
     try:
-        sched.cloud.ctl.objectstorage.list_buckets(persist=False)
+        poll(sched, sched.cloud.ctl.objectstorage.list_buckets)
     except (PeriodicTaskLockTakenError, PeriodicTaskTooRecentLastRun) as exc:
         list_buckets.logger.warning(
             '%s failed with %r',
@@ -200,6 +218,29 @@ def ping_probe(schedule_id):
             sched.machine, exc)
 
 
+@dramatiq.actor(queue_name='ping_probe', time_limit=280_000, max_age=30_000)
+def ping_probe_batch(schedule_ids):
+    """Perform the ping probes of many schedules at once"""
+
+    from mist.api.poller.models import PingProbeMachinePollingSchedule
+    from mist.api.machines.models import Machine
+    from mist.api.machines.methods import ping_probe_machines
+    machine_ids = PingProbeMachinePollingSchedule.objects(
+        id__in=schedule_ids).distinct('machine_id')
+    machines = Machine.objects(id__in=machine_ids, missing_since=None,
+                               state__nin=['stopped', 'error'],
+                               machine_type__ne='container')
+    try:
+        probed = ping_probe_machines(machines)
+    except Exception as exc:
+        ping_probe_batch.logger.warning(
+            "Error while ping-probing %d machines: %r",
+            len(machine_ids), exc)
+    else:
+        ping_probe_batch.logger.info(
+            "Ping-probed %d out of %d machines", probed, len(machine_ids))
+
+
 @dramatiq.actor(queue_name='ssh_probe', time_limit=45_000, max_age=30_000)
 def ssh_probe(schedule_id):
     """Perform ssh probe"""
@@ -0,0 +1,259 @@
+"""Pooled publisher of messages to the exchanges of owners
+
+`amqp_publish_user` used to open a new connection to RabbitMQ for every
+message and then wait for half a second, to find out whether the broker
+closed the channel because the owner's exchange doesn't exist, ie. nobody is
+listening. When `config.AMQP_USER_PUBLISHER_POOLED` is enabled, messages are
+instead published on a pool of up to `config.AMQP_PUBLISHER_POOL_SIZE` long
+lived connections per process, using publisher confirms, so that a missing
+exchange is reported as soon as the broker handles the message. Threads
+only wait for each other when all pooled connections are in use.
+
+Whether an owner's exchange exists is cached for
+`config.AMQP_OWNER_LISTENING_TTL` seconds and no messages are published to
+owners known not to be listening.
+
+Patches published to the same owner, with the same routing key and for the
+same resource, within `config.AMQP_PUBLISH_COALESCE_WINDOW_MS` milliseconds
+are coalesced into a single message by a background thread. The same goes
+for session updates, whose sections are merged.
+
+"""
+import os
+import time
+import atexit
+import logging
+import threading
+import collections
+
+import kombu
+import kombu.pools
+from amqp.exceptions import NotFound as AmqpNotFound
+
+from mist.api import config
+
+
+log = logging.getLogger(__name__)
+
+
+def coalesce_key(exchange, routing_key, data):
+    """Return the key of messages that can be merged with this one, or None
+
+    Only patches, ie. dicts with a list under the 'patch' key whose other
+    values identify the patched resources, and session updates, ie. lists of
+    sections, are coalesced.
+
+    """
+    if routing_key == 'update' and isinstance(data, list):
+        return (exchange, routing_key)
+    if isinstance(data, dict) and isinstance(data.get('patch'), list):
+        key = (exchange, routing_key, tuple(sorted(
+            (k, v) for k, v in data.items() if k != 'patch')))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+    return None
+
+
+def merge_messages(data, other):
+    """Merge message `other` into `data`, which was published earlier"""
+    if isinstance(data, list):
+        data.extend(section for section in other if section not in data)
+    else:
+        data['patch'].extend(other['patch'])
+
+
+class OwnerPublisher(object):
+
+    def __init__(self):
+        # Guards the creation of the pool of producers.
+        self.lock = threading.Lock()
+        # Guards the pending messages and the cache of listening owners.
+        self.condition = threading.Condition()
+        self.pending = collections.OrderedDict()
+        self.listening = {}
+        self.producers = None
+        self.flusher = None
+        self.pid = None
+
+    def is_listening(self, exchange, retries=3):
+        """Return whether the exchange exists, caching the result"""
+        cached = self._get_cached_listening(exchange)
+        if cached is not None:
+            return cached
+        for i in range(retries + 1):
+            producer = self._acquire_producer()
+            try:
+                kombu.Exchange(exchange, type='fanout')(
+                    producer.channel).declare(passive=True)
+            except AmqpNotFound:
+                # The broker closes the channel if the exchange is missing.
+                self._close_connection(producer)
+                listening = False
+                break
+            except Exception as exc:
+                self._close_connection(producer)
+                log.warning('Error checking exchange %s: %r',
+                            exchange, exc)
+            else:
+                listening = True
+                break
+            finally:
+                producer.release()
+        else:
+            log.error('Failed multiple times to connect to RabbitMQ')
+            return False
+        self._set_cached_listening(exchange, listening)
+        return listening
+
+    def publish(self, exchange, routing_key, data):
+        """Publish a message to an exchange, merging it with pending ones
+
+        Returns False if the exchange is known not to exist. Coalesced
+        messages are published later, so True is returned for them.
+
+        """
+        if self._get_cached_listening(exchange) is False:
+            return False
+        key = None
+        if config.AMQP_PUBLISH_COALESCE_WINDOW_MS > 0:
+            key = coalesce_key(exchange, routing_key, data)
+        if key is None:
+            # Publish pending messages of this exchange first, to preserve
+            # ordering.
+            self.flush(exchange=exchange)
+            return self._publish(exchange, routing_key, data)
+        self._start_flusher()
+        with self.condition:
+            if key in self.pending:
+                merge_messages(self.pending[key][2], data)
+            else:
+                if isinstance(data, list):
+                    data = list(data)
+                else:
+                    data = dict(data, patch=list(data['patch']))
+                window = config.AMQP_PUBLISH_COALESCE_WINDOW_MS / 1000.0
+                due = time.time() + window
+                self.pending[key] = (exchange, routing_key, data, due)
+                self.condition.notify()
+        return True
+
+    def flush(self, exchange=None, due=None):
+        """Publish pending messages
+
+        Only messages of the given exchange, or messages that were due by
+        the given time, are published if either is specified.
+
+        """
+        with self.condition:
+            messages = []
+            for key, message in list(self.pending.items()):
+                if exchange is not None and message[0] != exchange:
+                    continue
+                if due is not None and message[3] > due:
+                    continue
+                messages.append(self.pending.pop(key))
+        for exchange, routing_key, data, _ in messages:
+            self._publish(exchange, routing_key, data)
+
+    def _publish(self, exchange, routing_key, data):
+        producer = self._acquire_producer()
+        try:
+            producer.publish(
+                data, exchange=kombu.Exchange(exchange),
+                routing_key=routing_key, serializer='json', retry=True
+            )
+        except AmqpNotFound:
+            # The broker closes the channel if the exchange is missing.
+            self._close_connection(producer)
+            listening = False
+        except Exception as exc:
+            self._close_connection(producer)
+            log.error('Error publishing %s to %s: %r',
+                      routing_key, exchange, exc)
+            return False
+        else:
+            listening = True
+        finally:
+            producer.release()
+        self._set_cached_listening(exchange, listening)
+        return listening
+
+    def _acquire_producer(self):
+        """Return a producer of the pool, waiting for one to be released"""
+        # Connections don't survive forking, so create a new pool in each
+        # process.
+        with self.lock:
+            if self.pid != os.getpid():
+                limit = config.AMQP_PUBLISHER_POOL_SIZE
+                connection = kombu.Connection(
+                    config.BROKER_URL,
+                    transport_options={'confirm_publish': True})
+                self.producers = kombu.pools.ProducerPool(
+                    connection.Pool(limit=limit), limit=limit)
+                self.pid = os.getpid()
+            producers = self.producers
+        return producers.acquire(block=True)
+
+    def _close_connection(self, producer):
+        # Closed connections reconnect with a new channel when next used.
+        try:
+            producer.__connection__.close()
+        except Exception:
+            pass
+
+    def _get_cached_listening(self, exchange):
+        with self.condition:
+            listening, expires = self.listening.get(exchange, (None, 0))
+            if expires < time.time():
+                self.listening.pop(exchange, None)
+                return None
+            return listening
+
+    def _set_cached_listening(self, exchange, listening):
+        if config.AMQP_OWNER_LISTENING_TTL <= 0:
+            return
+        expires = time.time() + config.AMQP_OWNER_LISTENING_TTL
+        with self.condition:
+            self.listening[exchange] = (listening, expires)
+            if len(self.listening) > 10000:
+                now = time.time()
+                for key, (_, expires) in list(self.listening.items()):
+                    if expires < now:
+                        del self.listening[key]
+
+    def _start_flusher(self):
+        # The flusher thread doesn't survive forking, so start a new one in
+        # each process.
+        if self.flusher is not None and self.flusher.is_alive():
+            return
+        with self.condition:
+            if self.flusher is not None and self.flusher.is_alive():
+                return
+            self.pending.clear()
+            self.flusher = threading.Thread(target=self._flush_forever,
+                                            name='OwnerPublisherFlusher')
+            self.flusher.daemon = True
+            self.flusher.start()
+
+    def _flush_forever(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                timeout = min(message[3] for message in
+                              self.pending.values()) - time.time()
+                if timeout > 0:
+                    self.condition.wait(timeout)
+            try:
+                self.flush(due=time.time())
+            except Exception as exc:
+                log.error('Error flushing pending messages: %r', exc)
+
+
+owner_publisher = OwnerPublisher()
+
+# Don't lose coalesced messages when the process exits.
+atexit.register(owner_publisher.flush)
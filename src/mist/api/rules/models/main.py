@@ -7,6 +7,7 @@ from mist.api.exceptions import BadRequestError
 
 from mist.api.users.models import Organization
 from mist.api.selectors.models import SelectorClassMixin
+from mist.api.mongoengine_extras import touch_updated_at
 
 from mist.api.rules.base import NoDataRuleController
 from mist.api.rules.base import ResourceRuleController
@@ -111,12 +112,16 @@ class Rule(me.Document):
     # Field updated by dramatiq workers. This is where workers keep state.
     states = me.MapField(field=me.EmbeddedDocumentField(RuleState))
 
+    # Last time the rule's definition changed.
+    updated_at = me.DateTimeField()
+
     meta = {
         'strict': False,
         'collection': 'rules',
         'allow_inheritance': True,
         'indexes': [
             'owner_id',
+            'updated_at',
             {
                 'fields': ['owner_id', 'title'],
                 'sparse': False,
@@ -268,6 +273,9 @@ class Rule(me.Document):
         # have to change in the future due to uniqueness constrains.
         if not self.title:
             self.title = 'rule%d' % self.owner.rule_counter
+        touch_updated_at(self, ('last_run_at', 'run_immediately',
+                                'total_run_count', 'total_check_count',
+                                'states'))
 
     def as_dict(self):
         return {
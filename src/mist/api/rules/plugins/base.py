@@ -3,6 +3,7 @@ import copy
 import logging
 import datetime
 
+from mist.api import config
 from mist.api.rules.models import RuleState
 from mist.api.rules.plugins import methods
 
@@ -29,6 +30,9 @@ class BaseBackendPlugin(object):
 
     """
 
+    # Set to True by plugins that implement `execute_batch`.
+    batch = False
+
     def __init__(self, rule, rids=None):
         """Initialize the plugin given a Rule instance.
 
@@ -45,6 +49,7 @@ class BaseBackendPlugin(object):
         if self.rids is None:
             self.rids = rule.get_ids() if not rule.is_arbitrary() else [None]
         self.rtype = None if rule.is_arbitrary() else rule.resource_model_name
+        self.batch_results = {}
 
     def run(self, update_state=False, trigger_actions=False):
         """Run a single evaluation cycle.
@@ -57,7 +62,9 @@ class BaseBackendPlugin(object):
 
         This method evaluates `self.rule` for each one of the `self.rids`
         sequentially. Each evaluation returns a (triggered, incident, state)
-        tuple that describes the state of the resource with id `rid`.
+        tuple that describes the state of the resource with id `rid`. If the
+        plugin supports batched queries, all queries are executed in advance
+        for chunks of `self.rids` and each evaluation uses their results.
 
         At the end of the evaluation cycle, `self.rule.states` are updated
         given the currently `active_states`. As active we consider states
@@ -76,6 +83,8 @@ class BaseBackendPlugin(object):
         active_states = {}
         remove_states = set()
 
+        self.batch_results = self.execute_batched()
+
         for rid in self.rids:
             try:
                 _, incident, state = self.evaluate(rid, trigger_actions)
@@ -131,9 +140,16 @@ class BaseBackendPlugin(object):
         else:
             incident, state = uuid.uuid4().hex, None
 
-        for query in self.rule.queries:
-            # Execute the query for the given resource, if specified.
-            triggered, retval = self.execute(query, rid)
+        for index, query in enumerate(self.rule.queries):
+            # Execute the query for the given resource, if specified, unless
+            # it has already been executed in a batch.
+            if index in self.batch_results:
+                result = self.batch_results[index].get(rid, (None, None))
+                if isinstance(result, Exception):
+                    raise result
+                triggered, retval = result
+            else:
+                triggered, retval = self.execute(query, rid)
 
             # In case the query returned no series, we set triggered
             # equal to None and stop the evaluation, since we cannot
@@ -198,6 +214,51 @@ class BaseBackendPlugin(object):
         """
         raise NotImplementedError()
 
+    def execute_batched(self):
+        """Execute all queries of `self.rule` for all of `self.rids`.
+
+        Resource ids are split in chunks of `CILIA_EVALUATION_BATCH_SIZE`
+        and each query is executed once per chunk by `self.execute_batch`.
+        If a chunk fails, the exception is kept as the result of each one of
+        its resources, so that it's logged during their evaluation.
+
+        Returns a dict of query indexes to dicts of resource ids to results.
+        An empty dict is returned, if the plugin doesn't support batching.
+
+        Subclasses SHOULD NOT override this method.
+
+        """
+        if not self.batch or self.rids == [None]:
+            return {}
+        size = config.CILIA_EVALUATION_BATCH_SIZE
+        chunks = [self.rids[i:i + size]
+                  for i in range(0, len(self.rids), size)]
+        results = {}
+        for index, query in enumerate(self.rule.queries):
+            results[index] = {}
+            for chunk in chunks:
+                try:
+                    results[index].update(self.execute_batch(query, chunk))
+                except Exception as exc:
+                    results[index].update({rid: exc for rid in chunk})
+        return results
+
+    def execute_batch(self, query, rids):
+        """Execute the provided query for multiple resources at once.
+
+        This method may be implemented by plugins whose backend is able to
+        select the series of multiple resources with a single query, along
+        with setting `batch` to True. It must return a dict of resource ids
+        to (triggered, retval) tuples, which follow the same conventions as
+        the ones of `self.execute`. Resources missing from the dict are
+        considered to have no data. An exception may be returned instead of
+        a tuple, if the evaluation for a specific resource failed.
+
+        Subclasses MAY override this method.
+
+        """
+        raise NotImplementedError()
+
     def trigger(self, triggered, incident, state):
         """Send an alert/trigger.
 
@@ -251,3 +312,12 @@ class NoDataMixin(object):
     def execute(self, query, rid=None):
         _, retval = super(NoDataMixin, self).execute(query, rid)
         return True if retval is None else False, retval
+
+    def execute_batch(self, query, rids):
+        results = super(NoDataMixin, self).execute_batch(query, rids)
+        for rid in rids:
+            result = results.get(rid, (None, None))
+            if not isinstance(result, Exception):
+                _, retval = result
+                results[rid] = True if retval is None else False, retval
+        return results
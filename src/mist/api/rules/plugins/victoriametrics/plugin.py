@@ -10,6 +10,8 @@ log = logging.getLogger(__name__)
 
 class VictoriaMetricsBackendPlugin(base.BaseBackendPlugin):
 
+    batch = True
+
     def execute(self, query, rid=None):
         # Request data given a simple target expression.
         from mist.api.models import Machine
@@ -18,7 +20,31 @@ class VictoriaMetricsBackendPlugin(base.BaseBackendPlugin):
                                           start=self.start,
                                           stop=self.stop,
                                           metrics=[query.target])
+        return self.compute(query, rid, data)
 
+    def execute_batch(self, query, rids):
+        # Request data of all machines given a simple target expression.
+        from mist.api.models import Machine
+        machines = Machine.objects(id__in=rids, owner=self.rule.owner_id)
+        machines = {machine.id: machine for machine in machines}
+        data = victoria_methods.get_stats_batch(self.rule.owner_id,
+                                                list(machines.values()),
+                                                start=self.start,
+                                                stop=self.stop,
+                                                metric=query.target)
+        results = {}
+        for rid in rids:
+            if rid not in machines:
+                results[rid] = Machine.DoesNotExist(
+                    'Machine %s does not exist' % rid)
+                continue
+            try:
+                results[rid] = self.compute(query, rid, data.get(rid, {}))
+            except Exception as exc:
+                results[rid] = exc
+        return results
+
+    def compute(self, query, rid, data):
         # If response is empty, then data is absent for the given interval.
         if not len(data):
             log.warning('No datapoints for %s.%s', rid, query.target)
@@ -14,7 +14,9 @@ from apscheduler.jobstores.base import JobLookupError
 from mist.api import config
 from mist.api.models import Schedule
 from mist.api.poller.models import PollingSchedule
+from mist.api.poller.models import PingProbeMachinePollingSchedule
 from mist.api.rules.models import Rule
+from mist.api.sharding.methods import do_consistent_sharding
 
 log = logging.getLogger(__name__)
 log.setLevel('DEBUG')
@@ -22,6 +24,65 @@ log.setLevel('DEBUG')
 RELOAD_INTERVAL = 5
 
 
+class BatchSender(object):
+    """Send the ids of due schedules to an actor in batches
+
+    Used in place of the `send` method of an actor that takes a single
+    schedule id. Ids are sent to the batch actor once `size` of them have
+    been collected, or `window` seconds after the first of them.
+
+    """
+
+    def __init__(self, actor, size, window):
+        self.actor = actor
+        self.size = size
+        self.window = window
+        self.lock = threading.Lock()
+        self.ids = []
+        self.timer = None
+
+    def send(self, schedule_id):
+        with self.lock:
+            self.ids.append(schedule_id)
+            if len(self.ids) < self.size:
+                if self.timer is None:
+                    self.timer = threading.Timer(self.window, self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+                return
+            ids = self._pop()
+        self.actor.send(ids)
+
+    def flush(self):
+        with self.lock:
+            ids = self._pop()
+        if ids:
+            self.actor.send(ids)
+
+    def _pop(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        ids, self.ids = self.ids, []
+        return ids
+
+
+_batch_senders = {}
+
+
+def get_batch_sender(schedule):
+    """Return the BatchSender of a schedule's type, if batching is enabled"""
+    if not isinstance(schedule, PingProbeMachinePollingSchedule) or \
+            not config.PING_PROBE_BATCHING:
+        return None
+    if 'ping_probe' not in _batch_senders:
+        from mist.api.poller.tasks import ping_probe_batch
+        _batch_senders['ping_probe'] = BatchSender(
+            ping_probe_batch, config.PING_PROBE_BATCH_SIZE,
+            config.PING_PROBE_BATCH_WINDOW)
+    return _batch_senders['ping_probe']
+
+
 def schedule_to_actor(schedule):
     if isinstance(schedule, PollingSchedule) or isinstance(schedule, Rule):
         task_path = schedule.task.split('.')
@@ -76,7 +137,9 @@ def add_job(scheduler, schedule, actor, first_run=False):
         else:
             log.error('Invalid task type: %s' % schedule.task_type._cls)
 
-    new_job = scheduler.add_job(actor.send, **job)
+    batch_sender = get_batch_sender(schedule)
+    func = batch_sender.send if batch_sender is not None else actor.send
+    new_job = scheduler.add_job(func, **job)
     if not first_run and schedule.run_immediately:
         new_job.modify(next_run_time=datetime.datetime.now())
     return new_job
@@ -187,6 +250,169 @@ def load_schedules_from_db(scheduler, schedules, first_run=False,
     return new_schedule_ids
 
 
+class IncrementalScheduleLoader(object):
+    """Keep the jobs of a schedule collection in sync incrementally
+
+    Instead of reloading every schedule on every iteration, only documents
+    that have been inserted, updated or deleted since the last sync are
+    (re)loaded. Changes are read from a mongo change stream if the database
+    supports them. Otherwise, documents whose `updated_at` is past a
+    high-water mark are reloaded, and inserted or deleted documents are
+    detected by comparing ids.
+
+    Polling schedules may also change because an override interval expired,
+    so these are reloaded when their earliest override interval expires.
+
+    A full resync is performed every `config.SCHEDULER_FULL_RESYNC_INTERVAL`
+    seconds as a safety net, eg. for resource rules whose resources change.
+
+    """
+
+    # Updates touching only these fields don't affect the scheduled jobs.
+    ignored_fields = ('last_run_at', 'run_immediately', 'total_run_count',
+                      'total_check_count', 'states', 'shard_update_at',
+                      'adaptive_stats')
+
+    def __init__(self, scheduler, schedule_cls, **query):
+        self.scheduler = scheduler
+        self.schedule_cls = schedule_cls
+        self.query = query
+        self.job_ids = set()
+        self.expiring = {}
+        self.stream = None
+        self.high_water_mark = None
+        self.last_full_sync = None
+
+    def get_schedules(self, ids=None):
+        if ids is None:
+            return self.schedule_cls.objects(**self.query)
+        return self.schedule_cls.objects(id__in=list(ids), **self.query)
+
+    def sync(self, first_run=False):
+        now = datetime.datetime.utcnow()
+        interval = datetime.timedelta(
+            seconds=config.SCHEDULER_FULL_RESYNC_INTERVAL)
+        if self.last_full_sync is None or now - self.last_full_sync > interval:
+            self.full_sync(first_run=first_run)
+            return
+        if self.stream is not None:
+            try:
+                changed_ids = self._read_stream()
+            except Exception as exc:
+                log.error('Error reading change stream of %s: %r',
+                          self.schedule_cls.__name__, exc)
+                self._close_stream()
+                self.full_sync()
+                return
+            removed_ids = set()
+        else:
+            changed_ids, removed_ids = self._poll_changes(now)
+        changed_ids |= {sid for sid, expires in self.expiring.items()
+                        if expires <= datetime.datetime.now()}
+        if not (changed_ids or removed_ids):
+            return
+        log.info('Reloading %d changed and %d removed %s docs',
+                 len(changed_ids), len(removed_ids),
+                 self.schedule_cls.__name__)
+        self._apply(self.get_schedules(changed_ids),
+                    changed_ids | removed_ids)
+
+    def full_sync(self, first_run=False):
+        log.info('Reloading all %s docs', self.schedule_cls.__name__)
+        # Open the change stream before reading, so that no change is lost.
+        if self.stream is None:
+            self._open_stream()
+        self.high_water_mark = datetime.datetime.utcnow() - \
+            datetime.timedelta(seconds=RELOAD_INTERVAL)
+        self.expiring = {}
+        schedules = list(self.get_schedules())
+        self.job_ids = set(load_schedules_from_db(
+            self.scheduler, schedules, first_run=first_run,
+            old_schedule_ids=list(self.job_ids)))
+        for schedule in schedules:
+            self._track_expiring(schedule)
+        self.last_full_sync = datetime.datetime.utcnow()
+
+    def _apply(self, schedules, ids):
+        """Reload the jobs of `ids`, given the docs that still match"""
+        ids = {str(sid) for sid in ids}
+        schedules = list(schedules)
+        active_ids = load_schedules_from_db(
+            self.scheduler, schedules,
+            old_schedule_ids=list(ids & self.job_ids))
+        self.job_ids = (self.job_ids - ids) | set(active_ids)
+        for sid in ids:
+            self.expiring.pop(sid, None)
+        for schedule in schedules:
+            self._track_expiring(schedule)
+
+    def _track_expiring(self, schedule):
+        expires = [interval.expires
+                   for interval in getattr(schedule, 'override_intervals', [])
+                   if interval.expires and not interval.expired()]
+        if expires:
+            self.expiring[str(schedule.id)] = min(expires)
+
+    def _open_stream(self):
+        pipeline = [{'$match': {'$or': [
+            {'operationType': {'$ne': 'update'}},
+            {'updateDescription.updatedFields.shard_update_at': {
+                '$exists': False}},
+            {'updateDescription.updatedFields.shard_id': {'$exists': True}},
+        ]}}]
+        try:
+            self.stream = self.schedule_cls._get_collection().watch(
+                pipeline, max_await_time_ms=100)
+        except Exception as exc:
+            log.warning('Change streams unavailable for %s, will poll for '
+                        'changes instead: %r', self.schedule_cls.__name__, exc)
+            self.stream = None
+
+    def _close_stream(self):
+        try:
+            self.stream.close()
+        except Exception:
+            pass
+        self.stream = None
+
+    def _read_stream(self):
+        changed_ids = set()
+        while True:
+            change = self.stream.try_next()
+            if change is None:
+                return changed_ids
+            if change['operationType'] == 'update':
+                description = change.get('updateDescription', {})
+                fields = set(
+                    field.split('.')[0]
+                    for field in list(description.get('updatedFields', {})) +
+                    list(description.get('removedFields', []))
+                )
+                if not fields - set(self.ignored_fields):
+                    continue
+            elif change['operationType'] in ('drop', 'invalidate'):
+                raise me.OperationError('Change stream invalidated')
+            elif change['operationType'] not in ('insert', 'replace',
+                                                 'delete'):
+                continue
+            changed_ids.add(str(change['documentKey']['_id']))
+
+    def _poll_changes(self, now):
+        since = self.high_water_mark
+        self.high_water_mark = now - datetime.timedelta(
+            seconds=RELOAD_INTERVAL)
+        changed_ids = {str(sid) for sid in self.schedule_cls.objects(
+            updated_at__gt=since).scalar('id')}
+        current_ids = {str(sid) for sid in self.schedule_cls.objects(
+            **self.query).scalar('id')}
+        # Documents that started or stopped matching the query, eg. polling
+        # schedules assigned to or released from this shard.
+        known_ids = self.job_ids | set(self.expiring)
+        changed_ids |= current_ids - known_ids
+        removed_ids = self.job_ids - current_ids
+        return changed_ids, removed_ids
+
+
 def _start_shard_manager(schedule_cls, current_shard_id):
     """Start the sharding process."""
 
@@ -212,13 +438,15 @@ def _start_shard_manager(schedule_cls, current_shard_id):
     assert manager_interval < max_shard_period
 
     # Perform the sharding in a separate thread.
-    t = threading.Thread(target=_do_sharding,
-                         args=(schedule_cls,
-                               current_shard_id,
-                               max_shard_period,
-                               max_shard_claims,
-                               manager_interval),
-                         daemon=True)
+    if config.SHARD_MANAGER_CONSISTENT_HASHING:
+        target = do_consistent_sharding
+        args = (schedule_cls, current_shard_id, max_shard_period,
+                manager_interval)
+    else:
+        target = _do_sharding
+        args = (schedule_cls, current_shard_id, max_shard_period,
+                max_shard_claims, manager_interval)
+    t = threading.Thread(target=target, args=args, daemon=True)
 
     t.start()
 
@@ -282,7 +510,28 @@ def start(**kwargs):
         scheduler.start()
         first_run = True
         old_schedules = {}
+        loaders = {}
         while True:  # Start main loop
+            if config.SCHEDULER_INCREMENTAL_RELOAD:
+                if first_run:
+                    if kwargs.get('user'):
+                        loaders['user'] = IncrementalScheduleLoader(
+                            scheduler, Schedule, deleted=False)
+                    if kwargs.get('polling'):
+                        current_shard_id = os.getenv('HOSTNAME', '')
+                        _start_shard_manager(PollingSchedule,
+                                             current_shard_id)
+                        loaders['polling'] = IncrementalScheduleLoader(
+                            scheduler, PollingSchedule,
+                            shard_id=current_shard_id)
+                    if kwargs.get('rules'):
+                        loaders['rules'] = IncrementalScheduleLoader(
+                            scheduler, Rule)
+                for kind, loader in loaders.items():
+                    loader.sync(first_run=first_run and kind != 'rules')
+                sleep(RELOAD_INTERVAL)
+                first_run = False
+                continue
             if kwargs.get('user'):
                 log.info('Reloading user schedules')
                 if not old_schedules.get('user', None):
@@ -11,6 +11,7 @@ from mist.api.exceptions import ScheduleNameExistsError
 from mist.api.exceptions import RequiredParameterMissingError
 from mist.api.selectors.models import SelectorClassMixin
 from mist.api.ownership.mixins import OwnershipMixin
+from mist.api.mongoengine_extras import touch_updated_at
 
 log = logging.getLogger(__name__)
 
@@ -211,6 +212,7 @@ class Schedule(OwnershipMixin, me.Document, SelectorClassMixin):
                 'unique': True,
                 'cls': False,
             },
+            'updated_at',
         ],
     }
 
@@ -240,6 +242,9 @@ class Schedule(OwnershipMixin, me.Document, SelectorClassMixin):
     total_run_count = me.IntField(min_value=0, default=0)
     max_run_count = me.IntField(min_value=0, default=0)
 
+    # Last time the schedule's definition changed.
+    updated_at = me.DateTimeField()
+
     reminder = me.ReferenceField('Schedule', required=False,
                                  reverse_delete_rule=me.NULLIFY)
 
@@ -366,6 +371,7 @@ class Schedule(OwnershipMixin, me.Document, SelectorClassMixin):
     def clean(self):
         if self.resource_model_name != 'machine':
             self.resource_model_name = 'machine'
+        touch_updated_at(self, ('last_run_at', 'total_run_count'))
 
     def delete(self):
         if self.reminder:
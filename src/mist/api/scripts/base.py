@@ -1,4 +1,5 @@
 import logging
+import hashlib
 import requests
 import datetime
 import io
@@ -189,12 +190,23 @@ class BaseScriptController(object):
                                 pragma='no-cache',
                                 body=r.content)
 
-    def run_script(self, shell, params=None, job_id=None):
+    def run_script(self, shell, params=None, job_id=None, cache=False):
+        """Upload an inline script and return the command to run it
+
+        If `cache` is True, inline scripts are uploaded to a path named
+        after the hash of their source, unless already there, so that they
+        are uploaded once per host and SSH user instead of once per run.
+        """
         if self.script.location.type == 'inline':
-            path = "/tmp/mist_script_%s" % job_id
             source = self.script.location.source_code
-            sftp = shell.ssh.open_sftp()
-            sftp.putfo(io.StringIO(source), path)
+            path = None
+            if cache:
+                path = self._upload_cached_script(shell, source, job_id)
+            if path is None:
+                path = "/tmp/mist_script_%s" % job_id
+                sftp = shell.ssh.open_sftp()
+                sftp.putfo(io.StringIO(source), path)
+                sftp.close()
         else:
             path = self._url()
 
@@ -207,5 +219,36 @@ class BaseScriptController(object):
         wparams += " %s" % path
         return path, params, wparams
 
+    def _upload_cached_script(self, shell, source, job_id):
+        """Upload a script to the SSH user's script cache, unless already there
+
+        Scripts are cached in `~/.cache/mist/scripts`, which must be owned by
+        the SSH user and is only accessible by them, so that cached scripts
+        can't be planted or swapped by other users of the host. Returns the
+        path of the cached script, or None if it can't be cached.
+        """
+        exit_code, out = shell.command(
+            "mkdir -p -m 700 ~/.cache/mist/scripts && "
+            "cd ~/.cache/mist/scripts && test -O . && chmod 700 . && pwd")
+        if exit_code:
+            log.warning("Failed to create script cache directory: %s", out)
+            return None
+        directory = out.strip().splitlines()[-1]
+        digest = hashlib.sha256(source.encode()).hexdigest()
+        path = "%s/%s" % (directory, digest[:32])
+        _, out = shell.command("test -O %s && sha256sum %s" % (path, path))
+        if not out.startswith(digest):
+            # Upload to a temp file and rename it, to avoid running a
+            # partially uploaded script from a concurrent run.
+            tmp_path = "%s.%s" % (path, job_id)
+            sftp = shell.ssh.open_sftp()
+            sftp.putfo(io.StringIO(source), tmp_path)
+            sftp.close()
+            exit_code, out = shell.command("mv -f %s %s" % (tmp_path, path))
+            if exit_code:
+                log.warning("Failed to move script to %s: %s", path, out)
+                return tmp_path
+        return path
+
     def _preparse_file(self):
         return
@@ -0,0 +1,180 @@
+import time
+import bisect
+import hashlib
+import logging
+import datetime
+
+from mongoengine import Q
+
+from mist.api.sharding.models import ShardMember
+
+
+log = logging.getLogger(__name__)
+
+# Number of points each member occupies on the hash ring. More points make
+# the distribution of documents across members more even.
+RING_REPLICAS = 100
+
+# Maximum number of ids passed in a single `$in` query.
+UPDATE_BATCH_SIZE = 1000
+
+
+def _hash(key):
+    # 63 bits, so that positions fit in a signed 64-bit LongField.
+    return int(hashlib.md5(key.encode()).hexdigest()[:16], 16) >> 1
+
+
+class HashRing(object):
+    """A consistent hash ring of shard ids
+
+    Each key is owned by the first member found clockwise from the key's
+    position on the ring. Adding or removing a member only moves the keys
+    between that member and its neighbours, which is about 1/N of them.
+
+    """
+
+    def __init__(self, members, replicas=RING_REPLICAS):
+        self.members = sorted(members)
+        points = sorted(
+            (_hash('%s#%d' % (member, i)), member)
+            for member in self.members for i in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._members = [member for _, member in points]
+
+    @staticmethod
+    def get_position(key):
+        return _hash(str(key))
+
+    def get_member(self, key):
+        if not self._members:
+            return None
+        index = bisect.bisect(self._hashes, self.get_position(key))
+        return self._members[index % len(self._members)]
+
+    def get_ranges(self, member):
+        """Return the ranges of positions owned by `member`
+
+        Ranges are sorted `(start, end)` tuples, including start and
+        excluding end. A start or end of None is unbounded.
+
+        """
+        ranges = []
+        for index, owner in enumerate(self._members):
+            if owner != member:
+                continue
+            start = self._hashes[index - 1] if index else None
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], self._hashes[index])
+            else:
+                ranges.append((start, self._hashes[index]))
+        if self._members and self._members[0] == member:
+            ranges.append((self._hashes[-1], None))
+        return ranges
+
+
+def _complement(ranges):
+    """Return the ranges of positions not in the sorted `ranges`"""
+    complement = []
+    start = None
+    for range_start, range_end in ranges:
+        if range_start is not None and range_start != start:
+            complement.append((start, range_start))
+        start = range_end
+        if start is None:
+            break
+    else:
+        complement.append((start, None))
+    return complement
+
+
+def _ranges_query(ranges):
+    """Return a query matching the documents positioned in `ranges`"""
+    query = None
+    for start, end in ranges:
+        bounds = {}
+        if start is not None:
+            bounds['shard_hash__gte'] = start
+        if end is not None:
+            bounds['shard_hash__lt'] = end
+        query = Q(**bounds) if query is None else query | Q(**bounds)
+    return query
+
+
+def _set_positions(schedule_cls):
+    """Set the ring position of documents that don't have one yet
+
+    Only new documents are written, so this is cheap after the first run.
+
+    """
+    from pymongo import UpdateOne
+    ids = list(schedule_cls.objects(shard_hash=None).scalar('id'))
+    for i in range(0, len(ids), UPDATE_BATCH_SIZE):
+        schedule_cls._get_collection().bulk_write([
+            UpdateOne({'_id': doc_id},
+                      {'$set': {'shard_hash': HashRing.get_position(doc_id)}})
+            for doc_id in ids[i:i + UPDATE_BATCH_SIZE]
+        ], ordered=False)
+    return len(ids)
+
+
+def rebalance_shards(schedule_cls, current_shard_id, max_shard_period,
+                     now=None):
+    """Claim the documents that hash to the current shard
+
+    Sends a heartbeat for the current shard, builds the hash ring out of all
+    members that are alive and then claims the documents owned by the
+    current shard and releases the ones it no longer owns, with a few
+    multi-document updates. Documents store their position on the ring in
+    `shard_hash`, so these updates only match the ranges of positions owned
+    by the current shard, instead of hashing every document's id. Documents
+    already assigned to the current shard are just renewed. Documents
+    assigned to another shard are only claimed once released, or once that
+    shard hasn't renewed them within `max_shard_period`, so that no two
+    shards own a document at once.
+
+    """
+    now = now or datetime.datetime.utcnow()
+    group = schedule_cls._get_collection_name()
+    ShardMember.heartbeat(group, current_shard_id, now=now)
+    ring = HashRing(ShardMember.get_alive(group, max_shard_period, now=now))
+    positioned = _set_positions(schedule_cls)
+
+    owned = ring.get_ranges(current_shard_id)
+    unowned = _complement(owned)
+    released = claimed = 0
+    if unowned:
+        released = schedule_cls.objects(
+            Q(shard_id=current_shard_id) & _ranges_query(unowned)
+        ).update(shard_id=None, shard_update_at=None)
+    if owned:
+        stale = now - datetime.timedelta(seconds=max_shard_period)
+        claimed = schedule_cls.objects(
+            _ranges_query(owned) & Q(shard_id__ne=current_shard_id) &
+            (Q(shard_id=None) | Q(shard_update_at=None) |
+             Q(shard_update_at__lt=stale))
+        ).update(shard_id=current_shard_id, shard_update_at=now)
+    renewed = schedule_cls.objects(shard_id=current_shard_id).update(
+        shard_update_at=now)
+    log.debug('%s positioned %s, claimed %s, released %s and renewed %s '
+              'docs among %d members', current_shard_id, positioned, claimed,
+              released, renewed, len(ring.members))
+
+
+def do_consistent_sharding(schedule_cls, current_shard_id, max_shard_period,
+                           manager_interval):
+    """Shard the schedules' collection on a consistent hash ring
+
+    This function is executed in a separate thread. Unlike the claiming
+    based sharding, shard ids are not reset on startup. Each scheduler owns
+    the documents that hash to it, so a membership change only moves the
+    documents of the members next to it on the ring.
+
+    """
+    while True:
+        try:
+            rebalance_shards(schedule_cls, current_shard_id, max_shard_period)
+        except Exception as exc:
+            log.error('%s failed to rebalance shards: %r',
+                      current_shard_id, exc)
+        time.sleep(manager_interval)
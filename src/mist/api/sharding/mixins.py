@@ -7,6 +7,8 @@ import mongoengine as me
 
 import mist.api.config as config
 
+from mist.api.sharding.methods import do_consistent_sharding
+
 
 log = logging.getLogger(__name__)
 
@@ -21,6 +23,8 @@ class ShardedScheduleMixin(object):
     """
     shard_id = me.StringField()
     shard_update_at = me.DateTimeField()
+    # Position of the document on the hash ring of consistent sharding.
+    shard_hash = me.LongField()
 
 
 class ShardManagerMixin(object):
@@ -82,7 +86,13 @@ class ShardManagerMixin(object):
         assert self.manager_interval < self.UPDATE_INTERVAL.total_seconds()
 
         # Perform the sharding in a separate thread.
-        t = threading.Thread(target=self._do_sharding)
+        if config.SHARD_MANAGER_CONSISTENT_HASHING:
+            t = threading.Thread(target=do_consistent_sharding,
+                                 args=(self.Model, self.current_shard_id,
+                                       self.max_shard_period,
+                                       self.manager_interval))
+        else:
+            t = threading.Thread(target=self._do_sharding)
         t.daemon = True
         t.start()
 
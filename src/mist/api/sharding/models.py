@@ -0,0 +1,46 @@
+import datetime
+
+import mongoengine as me
+
+
+class ShardMember(me.Document):
+    """A scheduler process taking part in the sharding of a collection
+
+    Every scheduler process periodically renews its `heartbeat_at`. Members
+    that have not sent a heartbeat within the shard period are considered
+    gone and their share of the collection is taken over by the rest.
+
+    """
+    # Unique per group and shard id, see `ShardMember.get_id`.
+    id = me.StringField(primary_key=True)
+    # The name of the sharded collection.
+    group = me.StringField(required=True)
+    shard_id = me.StringField(required=True)
+    heartbeat_at = me.DateTimeField()
+
+    meta = {
+        'collection': 'shard_members',
+        'indexes': [
+            'group',
+            # Remove members that have been gone for a day.
+            {'fields': ['heartbeat_at'], 'expireAfterSeconds': 24 * 60 * 60},
+        ],
+    }
+
+    @staticmethod
+    def get_id(group, shard_id):
+        return '%s:%s' % (group, shard_id)
+
+    @classmethod
+    def heartbeat(cls, group, shard_id, now=None):
+        cls.objects(id=cls.get_id(group, shard_id)).update_one(
+            upsert=True, set__group=group, set__shard_id=shard_id,
+            set__heartbeat_at=now or datetime.datetime.utcnow())
+
+    @classmethod
+    def get_alive(cls, group, max_period, now=None):
+        """Return the sorted shard ids of the members that are alive"""
+        now = now or datetime.datetime.utcnow()
+        since = now - datetime.timedelta(seconds=max_period)
+        return sorted(cls.objects(group=group,
+                                  heartbeat_at__gte=since).scalar('shard_id'))
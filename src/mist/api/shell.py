@@ -13,6 +13,7 @@ import tempfile
 import logging
 import base64
 import json
+import codecs
 
 from time import sleep
 from io import StringIO
@@ -26,6 +27,7 @@ from mist.api.exceptions import RequiredParameterMissingError
 from mist.api.exceptions import ServiceUnavailableError
 
 from mist.api.helpers import trigger_session_update
+from mist.api.ssh_pool import ssh_pool, credentials_fingerprint
 from mist.api.logs.methods import get_story
 
 from mist.api import config
@@ -77,6 +79,8 @@ class ParamikoShell(object):
             raise RequiredParameterMissingError('host not given')
         self.host = host
         self.sudo = False
+        # Transport borrowed from the ssh pool, if any.
+        self.pooled_transport = None
 
         self.ssh = paramiko.SSHClient()
         self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
@@ -97,13 +101,37 @@ class ParamikoShell(object):
 
         Raises MachineUnauthorizedError if it fails to connect.
 
+        If `config.SSH_CONNECTION_POOL` is enabled, an authenticated
+        connection to the same host, port and user with the same credentials
+        is reused if available, otherwise the new connection is added to the
+        pool.
+
         """
 
         if not key and not password:
             raise RequiredParameterMissingError("neither key nor password "
                                                 "provided.")
 
-        if key:
+        pool_key = None
+        if config.SSH_CONNECTION_POOL:
+            if self.pooled_transport is not None:
+                self.disconnect()
+            if not (isinstance(key, SignedSSHKey) and cert_file):
+                cert_file = None
+            pool_key = (self.host, port, username, credentials_fingerprint(
+                key.private if key else None, cert_file, password))
+            transport = ssh_pool.acquire(pool_key, self)
+            if transport is not None:
+                log.debug("Reusing ssh connection to %s@%s:%s",
+                          username, self.host, port)
+                # SSHClient has no public way to set its transport.
+                self.ssh._transport = transport
+                self.pooled_transport = transport
+                return
+
+        if key and pool_key:
+            rsa_key = ssh_pool.load_key(key.private, cert_file)
+        elif key:
             private = key.private
             if isinstance(key, SignedSSHKey) and cert_file:
                 # signed ssh key, use RSACert
@@ -146,8 +174,21 @@ class ParamikoShell(object):
                 if not attempts:
                     raise ServiceUnavailableError(repr(exc))
 
+        if pool_key:
+            self.pooled_transport = self.ssh.get_transport()
+            ssh_pool.add(pool_key, self.pooled_transport, self)
+
     def disconnect(self):
-        """Close the SSH connection."""
+        """Close the SSH connection.
+
+        Pooled connections are returned to the pool instead.
+
+        """
+        if self.pooled_transport is not None:
+            ssh_pool.release(self.pooled_transport, self)
+            self.pooled_transport = None
+            self.ssh._transport = None
+            return
         try:
             log.info("Closing ssh connection to %s", self.host)
             self.ssh.close()
@@ -181,7 +222,7 @@ class ParamikoShell(object):
         channel.exec_command(cmd)
         return stdout, stderr, channel
 
-    def command(self, cmd, pty=True):
+    def command(self, cmd, pty=True, on_output=None):
         """Run command and return output.
 
         If pty is True, then it returns a string object that contains the
@@ -190,28 +231,51 @@ class ParamikoShell(object):
         If pty is False, then it returns a two string tuple, consisting of
         stdout and stderr.
 
+        If `on_output` is given, it is called with each chunk of stdout as
+        soon as it is received.
+
         """
         log.info("running command: '%s'", cmd)
         stdout, stderr, channel = self._command(cmd, pty)
-        line = stdout.readline()
-        out = ''
-        while line:
-            out += line
-            line = stdout.readline()
+        if on_output is not None:
+            out = self._stream_all(channel, on_output)
+        else:
+            out = self._read_all(stdout)
 
         if pty:
             retval = channel.recv_exit_status()
             return retval, out
         else:
-            line = stderr.readline()
-            err = ''
-            while line:
-                err += line
-                line = stderr.readline()
+            err = self._read_all(stderr)
             retval = channel.recv_exit_status()
 
             return retval, out, err
 
+    @staticmethod
+    def _read_all(fobj, size=65536):
+        """Read a channel file to the end, in chunks, and decode it"""
+        chunks = []
+        chunk = fobj.read(size)
+        while chunk:
+            chunks.append(chunk)
+            chunk = fobj.read(size)
+        return b''.join(chunks).decode('utf-8', 'replace')
+
+    @staticmethod
+    def _stream_all(channel, on_output, size=65536):
+        """Read a channel's stdout to the end, passing on each chunk"""
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        chunks = []
+        data = channel.recv(size)
+        while True:
+            text = decoder.decode(data, final=not data)
+            if text:
+                chunks.append(text)
+                on_output(text)
+            if not data:
+                return ''.join(chunks)
+            data = channel.recv(size)
+
     def command_stream(self, cmd):
         """Run command and stream output line by line.
 
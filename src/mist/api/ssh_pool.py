@@ -0,0 +1,168 @@
+"""Per process pool of authenticated SSH transports
+
+Connecting a `ParamikoShell` takes a TCP and SSH handshake, authentication and
+the parsing of the private key. When `config.SSH_CONNECTION_POOL` is enabled,
+authenticated transports are kept in this pool, keyed by host, port, username
+and a fingerprint of the credentials, and reused by later shells, each of
+which opens its own channels over the shared transport. A transport is used
+by at most `config.SSH_POOL_MAX_SESSIONS` shells at a time and is closed once
+it has been idle for `config.SSH_POOL_IDLE_TTL` seconds, by a reaper thread
+that runs in the background. Shells are tracked with weak references, so a
+shell that is garbage collected without disconnecting stops holding its
+transport.
+
+Parsed private keys are cached as well, in a bounded LRU cache of
+`config.SSH_KEY_CACHE_SIZE` keys.
+
+"""
+import os
+import time
+import weakref
+import hashlib
+import logging
+import threading
+import collections
+
+from io import StringIO
+
+import paramiko
+
+from mist.api import config
+
+
+log = logging.getLogger(__name__)
+
+
+def credentials_fingerprint(private=None, cert_file=None, password=None):
+    """Return a hash of the given credentials, to use in pool keys"""
+    digest = hashlib.sha256()
+    for value in (private, cert_file, password):
+        digest.update((value or '').encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class PooledTransport(object):
+
+    def __init__(self, transport, shell):
+        self.transport = transport
+        self.shells = weakref.WeakSet([shell])
+        self.last_used = time.time()
+
+    def is_healthy(self):
+        if not (self.transport.is_active() and
+                self.transport.is_authenticated()):
+            return False
+        try:
+            # Fails if the connection has been closed by the other end.
+            self.transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+
+class SSHTransportPool(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.transports = collections.defaultdict(list)
+        self.keys = collections.OrderedDict()
+        self.pid = None
+        self.reaper = None
+
+    def _check_pid(self):
+        # Transports and threads don't survive forking, start over in each
+        # process.
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.transports.clear()
+            self.keys.clear()
+            self.reaper = threading.Thread(target=self._run_reaper,
+                                           name='SSHPoolReaper')
+            self.reaper.daemon = True
+            self.reaper.start()
+
+    def _run_reaper(self):
+        while True:
+            time.sleep(config.SSH_POOL_IDLE_TTL)
+            try:
+                with self.lock:
+                    self._reap()
+            except Exception as exc:
+                log.error('Failed to close idle ssh connections: %r', exc)
+
+    def load_key(self, private, cert_file=None):
+        """Return the parsed private key, from the cache if possible"""
+        fingerprint = credentials_fingerprint(private, cert_file)
+        with self.lock:
+            self._check_pid()
+            pkey = self.keys.pop(fingerprint, None)
+            if pkey is not None:
+                self.keys[fingerprint] = pkey
+                return pkey
+        if cert_file:
+            pkey = paramiko.RSACert(privkey_file_obj=StringIO(private),
+                                    cert_file_obj=StringIO(cert_file))
+        else:
+            pkey = paramiko.RSAKey.from_private_key(StringIO(private))
+        with self.lock:
+            self.keys[fingerprint] = pkey
+            while len(self.keys) > config.SSH_KEY_CACHE_SIZE:
+                self.keys.popitem(last=False)
+        return pkey
+
+    def acquire(self, key, shell):
+        """Return a healthy transport of the given key for `shell`, or None"""
+        with self.lock:
+            self._check_pid()
+            self._reap()
+            for pooled in list(self.transports.get(key, [])):
+                if len(pooled.shells) >= config.SSH_POOL_MAX_SESSIONS:
+                    continue
+                if not pooled.is_healthy():
+                    self._remove(key, pooled)
+                    continue
+                pooled.shells.add(shell)
+                pooled.last_used = time.time()
+                return pooled.transport
+        return None
+
+    def add(self, key, transport, shell):
+        """Add a newly authenticated transport, in use by `shell`"""
+        with self.lock:
+            self._check_pid()
+            self.transports[key].append(PooledTransport(transport, shell))
+
+    def release(self, transport, shell):
+        """Mark that `shell` no longer uses a transport"""
+        with self.lock:
+            for key, pooled_transports in list(self.transports.items()):
+                for pooled in pooled_transports:
+                    if pooled.transport is transport:
+                        pooled.shells.discard(shell)
+                        pooled.last_used = time.time()
+                        if not transport.is_active():
+                            self._remove(key, pooled)
+                        break
+            self._reap()
+
+    def _remove(self, key, pooled):
+        self.transports[key].remove(pooled)
+        if not self.transports[key]:
+            del self.transports[key]
+        try:
+            pooled.transport.close()
+        except Exception:
+            pass
+
+    def _reap(self):
+        """Close transports that have been idle for too long"""
+        expired = time.time() - config.SSH_POOL_IDLE_TTL
+        for key, pooled_transports in list(self.transports.items()):
+            for pooled in list(pooled_transports):
+                if not pooled.shells and pooled.last_used < expired:
+                    log.info('Closing idle ssh connection to %s', key[0])
+                    self._remove(key, pooled)
+
+
+ssh_pool = SSHTransportPool()
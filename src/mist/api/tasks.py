@@ -787,7 +787,8 @@ def send_email(subject, body, recipients, sender=None, bcc=None,
     return True
 
 
-@dramatiq.actor(queue_name='schedules', store_results=True)
+@dramatiq.actor(queue_name='schedules', store_results=True,
+                time_limit=3_600_000)
 def group_machines_actions(owner_id, action, name, machines_uuids):
     """
     Accepts a list of lists in form  cloud_id,machine_id and pass them
@@ -819,6 +820,7 @@ def group_machines_actions(owner_id, action, name, machines_uuids):
     log_event(action='schedule_started', **log_dict)
     log.info('Schedule action started: %s', log_dict)
     tasks = []
+    actions = []
     for machine_uuid in machines_uuids:
         found = False
         _action = action
@@ -837,6 +839,9 @@ def group_machines_actions(owner_id, action, name, machines_uuids):
                 # change action to be executed now
                 _action = 'stop'
 
+            if config.SCHEDULES_GROUP_MACHINE_ACTIONS:
+                actions.append((machine, _action))
+                continue
             try:
                 task = run_machine_action.message(owner_id, _action, name,
                                                   machine_uuid)
@@ -844,10 +849,23 @@ def group_machines_actions(owner_id, action, name, machines_uuids):
             except Exception as exc:
                 log_dict['error'] = '%s %r\n' % (log_dict.get('error', ''),
                                                  exc)
-    # Apply all tasks in parallel
-    from dramatiq import group
-    g = group(tasks).run()
-    g.wait(timeout=3600_000)
+    if config.SCHEDULES_GROUP_MACHINE_ACTIONS:
+        results = run_grouped_machine_actions(
+            Owner.objects.get(id=owner_id), schedule, actions)
+        errors = [result['error'] for result in results
+                  if result.get('error')]
+        if errors:
+            previous = [log_dict['error']] if log_dict['error'] else []
+            log_dict['error'] = '\n'.join(previous + errors)
+        log_dict.update({
+            'machines_succeeded': len(results) - len(errors),
+            'machines_failed': len(errors),
+        })
+    else:
+        # Apply all tasks in parallel
+        from dramatiq import group
+        g = group(tasks).run()
+        g.wait(timeout=3600_000)
     log_dict.update({
         'last_run_at': str(schedule.last_run_at or ''),
         'total_run_count': schedule.total_run_count or 0,
@@ -881,9 +899,18 @@ def run_machine_action(owner_id, action, name, machine_uuid):
     """
 
     schedule = Schedule.objects.get(owner=owner_id, name=name, deleted=None)
+    owner = Owner.objects.get(id=owner_id)
+    _run_machine_action(owner, schedule, action, machine_uuid)
+
 
+def _run_machine_action(owner, schedule, action, machine_uuid, refresh=True):
+    """Run `action` on a machine of `schedule` and return the log_dict
+
+    Unless `refresh` is False, the machine's cloud is listed first, in order
+    to update the machine's state.
+    """
     log_dict = {
-        'owner_id': owner_id,
+        'owner_id': owner.id,
         'event_type': 'job',
         'machine_uuid': machine_uuid,
         'schedule_id': schedule.id,
@@ -891,7 +918,6 @@ def run_machine_action(owner_id, action, name, machine_uuid):
 
     external_id = ''
     cloud_id = ''
-    owner = Owner.objects.get(id=owner_id)
     started_at = time()
     try:
         machine = Machine.objects.get(id=machine_uuid, state__ne='terminated')
@@ -916,12 +942,13 @@ def run_machine_action(owner_id, action, name, machine_uuid):
             from mist.api.machines.methods import list_machines
             from mist.api.machines.methods import destroy_machine
             # TODO change this to compute.ctl.list_machines
-            list_machines(owner, cloud_id)
+            if refresh:
+                list_machines(owner, cloud_id)
 
             if action == 'start':
                 log_event(action='Start', **log_dict)
                 try:
-                    machine.ctl.start()
+                    _retry_rate_limited(machine.ctl.start)
                 except Exception as exc:
                     log_dict['error'] = '%s Machine in %s state' % (
                         exc, machine.state)
@@ -931,7 +958,7 @@ def run_machine_action(owner_id, action, name, machine_uuid):
             elif action == 'stop':
                 log_event(action='Stop', **log_dict)
                 try:
-                    machine.ctl.stop()
+                    _retry_rate_limited(machine.ctl.stop)
                 except Exception as exc:
                     log_dict['error'] = '%s Machine in %s state' % (
                         exc, machine.state)
@@ -941,7 +968,7 @@ def run_machine_action(owner_id, action, name, machine_uuid):
             elif action == 'reboot':
                 log_event(action='Reboot', **log_dict)
                 try:
-                    machine.ctl.reboot()
+                    _retry_rate_limited(machine.ctl.reboot)
                 except Exception as exc:
                     log_dict['error'] = '%s Machine in %s state' % (
                         exc, machine.state)
@@ -951,7 +978,8 @@ def run_machine_action(owner_id, action, name, machine_uuid):
             elif action == 'destroy':
                 log_event(action='Destroy', **log_dict)
                 try:
-                    destroy_machine(owner, cloud_id, external_id)
+                    _retry_rate_limited(destroy_machine, owner, cloud_id,
+                                        external_id)
                 except Exception as exc:
                     log_dict['error'] = '%s Machine in %s state' % (
                         exc, machine.state)
@@ -1009,6 +1037,242 @@ def run_machine_action(owner_id, action, name, machine_uuid):
             duration=log_dict['finished_at'] - log_dict['started_at'],
             error=log_dict.get('error'),
         )
+    return log_dict
+
+
+def _retry_rate_limited(func, *args, **kwargs):
+    """Call `func`, retrying when the provider's rate limit is reached"""
+    from libcloud.common.exceptions import RateLimitReachedError
+    for attempt in range(config.SCHEDULES_RATE_LIMIT_RETRIES + 1):
+        try:
+            return func(*args, **kwargs)
+        except RateLimitReachedError as exc:
+            if attempt == config.SCHEDULES_RATE_LIMIT_RETRIES:
+                raise
+            delay = getattr(exc, 'retry_after', None) or 2 ** attempt
+            log.warning('Rate limit reached, retrying in %ss: %r',
+                        delay, exc)
+            sleep(delay)
+
+
+def run_grouped_machine_actions(owner, schedule, actions):
+    """Run the actions of a schedule on multiple machines at once
+
+    `actions` is a list of (machine, action) tuples. Each distinct cloud is
+    listed once, instead of once per machine, and then actions are run from
+    a thread pool. At most `config.SCHEDULES_MAX_ACTIONS_PER_CLOUD` actions
+    run concurrently on each cloud and `SCHEDULES_MAX_ACTIONS_PER_PROVIDER`
+    on each provider, in order to respect their rate limits.
+
+    Returns a list of the actions' log_dicts.
+    """
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from mist.api.machines.methods import list_machines
+
+    if not actions:
+        return []
+
+    clouds = {}
+    for machine, action in actions:
+        if action in ('start', 'stop', 'reboot', 'destroy', 'notify'):
+            clouds[machine.cloud.id] = machine.cloud
+    for cloud_id, cloud in clouds.items():
+        try:
+            list_machines(owner, cloud_id)
+        except Exception as exc:
+            log.error('Failed to list machines of %s: %r', cloud, exc)
+
+    cloud_semaphores = {
+        cloud.id: threading.BoundedSemaphore(
+            config.SCHEDULES_MAX_ACTIONS_PER_CLOUD)
+        for cloud in (machine.cloud for machine, _ in actions)
+    }
+    provider_semaphores = {
+        provider: threading.BoundedSemaphore(
+            config.SCHEDULES_MAX_ACTIONS_PER_PROVIDER)
+        for provider in set(machine.cloud.provider for machine, _ in actions)
+    }
+
+    def _run(machine_action):
+        machine, action = machine_action
+        # Take the cloud slot first, so that actions waiting for a slot of
+        # their cloud don't hold slots of the whole provider.
+        with cloud_semaphores[machine.cloud.id]:
+            with provider_semaphores[machine.cloud.provider]:
+                try:
+                    return _run_machine_action(owner, schedule, action,
+                                               machine.id, refresh=False)
+                except Exception as exc:
+                    log.error('Failed to %s %s: %r', action, machine, exc)
+                    return {'machine_uuid': machine.id, 'error': str(exc)}
+
+    workers = min(len(actions), config.SCHEDULES_MAX_CONCURRENT_ACTIONS)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_run, actions))
+
+
+def _get_machine_host(machine):
+    """Return the first IPv4 address of a machine, preferably a public one"""
+    ips = [ip for ip in machine.public_ips if ip and ':' not in ip]
+    # get private IPs if no public IP is available
+    if not ips:
+        ips = [ip for ip in machine.private_ips if ip and ':' not in ip]
+    return ips[0] if ips else ''
+
+
+def _run_script_on_machine(owner, script, machine, host, params, job_id):
+    """Run a script on a machine over SSH, logging its output as it comes
+
+    Like `run_script`, but the host is given, inline scripts are uploaded
+    once per host and content, and failures are notified once per group
+    run by `run_grouped_script` instead of once per machine.
+    """
+    import mist.api.shell
+
+    cloud_id = machine._data['cloud'].id
+    ret = {
+        'owner_id': owner.id,
+        'job_id': job_id,
+        'job': 'schedule',
+        'script_id': script.id,
+        'cloud_id': cloud_id,
+        'machine_id': machine.id,
+        'external_id': machine.machine_id,
+        'params': params,
+        'host': host,
+        'key_id': '',
+        'ssh_user': '',
+        'command': '',
+        'stdout': '',
+        'exit_code': '',
+        'error': False,
+    }
+    started_at = time()
+    shell = None
+    try:
+        if not host:
+            raise MistError("No host provided and none could be discovered.")
+        shell = mist.api.shell.ParamikoShell(host)
+        ret['key_id'], ret['ssh_user'] = shell.autoconfigure(
+            owner, cloud_id, machine.id)
+        path, params, wparams = script.ctl.run_script(
+            shell, params=params, job_id=job_id, cache=True)
+        ret['command'] = "chmod +x %s && %s %s" % (path, path, params)
+    except Exception as exc:
+        ret['error'] = str(exc)
+    log_event(event_type='job', action='script_started', **ret)
+    command = ret.pop('command')
+
+    pending = []
+    flushed_at = [time()]
+
+    def log_output(force=False):
+        if pending and (force or time() - flushed_at[0] >=
+                        config.SCHEDULES_SCRIPT_OUTPUT_INTERVAL):
+            log_event(event_type='job', action='script_output',
+                      owner_id=owner.id, job_id=job_id, job='schedule',
+                      script_id=script.id, cloud_id=cloud_id,
+                      machine_id=machine.id, output=''.join(pending))
+            pending.clear()
+            flushed_at[0] = time()
+
+    def on_output(text):
+        pending.append(text)
+        log_output()
+
+    if not ret['error']:
+        try:
+            exit_code, wstdout = shell.command(command, on_output=on_output)
+            log_output(force=True)
+            wstdout = wstdout.replace('\r\n', '\n').replace('\r', '\n')
+            ret['exit_code'] = exit_code
+            ret['stdout'] = wstdout
+            if exit_code > 0:
+                ret['error'] = 'Script exited with return code %s' % exit_code
+        except Exception as exc:
+            ret['error'] = str(exc)
+    if shell is not None:
+        shell.disconnect()
+    log_event(event_type='job', action='script_finished', **ret)
+    ret['started_at'] = started_at
+    ret['finished_at'] = time()
+    return ret
+
+
+def run_grouped_script(owner, script, machines, params, job_id):
+    """Run a script on multiple machines at once
+
+    Hosts are resolved from the stored machines, instead of listing their
+    clouds, and scripts are run from a thread pool. At most
+    `config.SCHEDULES_MAX_SCRIPTS_PER_CLOUD` scripts run concurrently on
+    each cloud and `config.SCHEDULES_MAX_SCRIPTS_PER_HOST` on each host.
+    Ansible scripts are run by `run_script`, other scripts' failures are
+    notified in a single notification.
+
+    Returns a list of the runs' results.
+    """
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    if not machines:
+        return []
+
+    hosts = {machine.id: _get_machine_host(machine) for machine in machines}
+    cloud_semaphores = {
+        cloud_id: threading.BoundedSemaphore(
+            config.SCHEDULES_MAX_SCRIPTS_PER_CLOUD)
+        for cloud_id in set(machine._data['cloud'].id for machine in machines)
+    }
+    host_semaphores = {
+        host: threading.BoundedSemaphore(config.SCHEDULES_MAX_SCRIPTS_PER_HOST)
+        for host in set(hosts.values()) if host
+    }
+
+    def _run_script(machine, host):
+        try:
+            if script.exec_type == 'ansible':
+                return run_script(owner, script.id, machine.id,
+                                  params=params, host=host,
+                                  job_id=job_id, job='schedule')
+            return _run_script_on_machine(owner, script, machine,
+                                          host, params, job_id)
+        except Exception as exc:
+            log.error('Failed to run script %s on %s: %r',
+                      script.id, machine, exc)
+            return {'machine_id': machine.id, 'error': str(exc)}
+
+    def _run(machine):
+        host = hosts[machine.id]
+        if not host:
+            # Reported as failed right away, without taking any slots.
+            return _run_script_on_machine(owner, script, machine, host,
+                                          params, job_id)
+        # Take the host slot first, so that scripts waiting for a busy host
+        # don't hold slots of the whole cloud.
+        with host_semaphores[host]:
+            with cloud_semaphores[machine._data['cloud'].id]:
+                return _run_script(machine, host)
+
+    workers = min(len(machines), config.SCHEDULES_MAX_CONCURRENT_SCRIPTS)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_run, machines))
+
+    failed = [(machine, result) for machine, result in zip(machines, results)
+              if result.get('error')]
+    if failed and script.exec_type != 'ansible':
+        from mist.api.methods import notify_user, notify_admin
+        title = "Execution of '%s' script failed on %d of %d machines" % (
+            script.name, len(failed), len(machines))
+        message = '\n\n'.join(
+            "%s (%s): %s\n%s" % (machine.name, machine.id, result['error'],
+                                 result.get('stdout', ''))
+            for machine, result in failed)
+        notify_user(owner, title, message, job_id=job_id,
+                    machine_ids=[machine.id for machine, _ in failed])
+        notify_admin("%s for user %s" % (title, str(owner)), message,
+                     team='dev')
+    return results
 
 
 @dramatiq.actor(queue_name='schedules', store_results=True)
@@ -1045,19 +1309,49 @@ def group_run_script(owner_id, script_id, name, machines_uuids, params=''):
 
     log_event(action='schedule_started', **log_dict)
     log.info('Schedule started: %s', log_dict)
-    tasks = []
-    for machine_uuid in machines_uuids:
+    if config.SCHEDULES_GROUP_RUN_SCRIPT:
+        errors = []
+        results = []
         try:
-            task = run_script.message(owner_id, script_id, machine_uuid,
-                                      params=params, job_id=job_id,
-                                      job='schedule')
-            tasks.append(task)
+            owner = Owner.objects.get(id=owner_id)
+            script = Script.objects.get(owner=owner, id=script_id,
+                                        deleted=None)
+            machines = list(Machine.objects(id__in=machines_uuids,
+                                            state__ne='terminated'))
         except Exception as exc:
-            log_dict['error'] = "%s %r\n" % (log_dict.get('error', ''), exc)
-    # Apply all tasks in parallel
-    from dramatiq import group
-    g = group(tasks).run()
-    g.wait(timeout=3_600_000)
+            errors.append(repr(exc))
+        else:
+            found = set(machine.id for machine in machines)
+            errors.extend('Machine with id %s does not exist.' % machine_id
+                          for machine_id in machines_uuids
+                          if machine_id not in found)
+            results = run_grouped_script(owner, script, machines, params,
+                                         job_id)
+        errors.extend('%s: %s' % (result['machine_id'], result['error'])
+                      for result in results if result.get('error'))
+        if errors:
+            log_dict['error'] = '\n'.join(errors)
+        log_dict.update({
+            'machines_succeeded': len(
+                [result for result in results if not result.get('error')]),
+            'machines_failed': len(machines_uuids) - len(
+                [result for result in results if not result.get('error')]),
+        })
+    else:
+        tasks = []
+        for machine_uuid in machines_uuids:
+            try:
+                task = run_script.message(owner_id, script_id, machine_uuid,
+                                          params=params, job_id=job_id,
+                                          job='schedule')
+                tasks.append(task)
+            except Exception as exc:
+                log_dict['error'] = "%s %r\n" % (
+                    log_dict.get('error', ''), exc)
+        # Apply all tasks in parallel
+        from dramatiq import group
+        g = group(tasks).run()
+        g.wait(timeout=3_600_000)
     log_dict.update({'last_run_at': str(schedule.last_run_at or ''),
                      'total_run_count': schedule.total_run_count or 0,
                      'error': log_dict['error']}
@@ -1252,25 +1546,31 @@ def update_poller(org_id):
     log.info("Updating poller for %s", org)
     for cloud in Cloud.objects(owner=org, deleted=None, enabled=True):
         log.info("Updating poller for cloud %s", cloud)
-        ListMachinesPollingSchedule.add(cloud=cloud, interval=10, ttl=120)
+        # Override intervals named 'session' don't reset the backoff of
+        # adaptive polling intervals.
+        session = {'ttl': 120, 'name': 'session'}
+        ListMachinesPollingSchedule.add(cloud=cloud, interval=10, **session)
         ListLocationsPollingSchedule.add(cloud=cloud, interval=60 * 60 * 24,
-                                         ttl=120)
+                                         **session)
         ListSizesPollingSchedule.add(cloud=cloud, interval=60 * 60 * 24,
-                                     ttl=120)
+                                     **session)
         ListImagesPollingSchedule.add(cloud=cloud, interval=60 * 60 * 24,
-                                      ttl=120)
+                                      **session)
         if hasattr(cloud.ctl, 'network'):
-            ListNetworksPollingSchedule.add(cloud=cloud, interval=60, ttl=120)
+            ListNetworksPollingSchedule.add(cloud=cloud, interval=60,
+                                            **session)
         if hasattr(cloud.ctl, 'dns') and cloud.dns_enabled:
-            ListZonesPollingSchedule.add(cloud=cloud, interval=60, ttl=120)
+            ListZonesPollingSchedule.add(cloud=cloud, interval=60, **session)
         if hasattr(cloud.ctl, 'storage'):
-            ListVolumesPollingSchedule.add(cloud=cloud, interval=60, ttl=120)
+            ListVolumesPollingSchedule.add(cloud=cloud, interval=60,
+                                           **session)
         if hasattr(cloud.ctl, 'container') and cloud.container_enabled:
-            ListClustersPollingSchedule.add(cloud=cloud, interval=60, ttl=120)
+            ListClustersPollingSchedule.add(cloud=cloud, interval=60,
+                                            **session)
         if hasattr(cloud.ctl, 'objectstorage') and \
                 cloud.object_storage_enabled:
             ListBucketsPollingSchedule.add(cloud=cloud, interval=60 * 60 * 24,
-                                           ttl=120)
+                                           **session)
         if config.ACCELERATE_MACHINE_POLLING:
             for machine in cloud.ctl.compute.list_cached_machines():
                 if machine.machine_type != 'container':
@@ -191,6 +191,12 @@ class Owner(me.Document):
         'strict': False,
     }
 
+    # Changes of fields other than these invalidate cached sessions of the
+    # owner, see `mist.api.auth.cache`.
+    session_ignored_fields = ('activation_date', 'rule_counter',
+                              'total_machine_count', 'total_cluster_count',
+                              'last_active')
+
     def count_mon_machines(self):
         from mist.api.clouds.models import Cloud
         from mist.api.machines.models import Machine
@@ -224,6 +230,21 @@ class Owner(me.Document):
                 self.emails = emails
         super(Owner, self).clean()
 
+    def save(self, *args, **kwargs):
+        changed = set(field.split('.')[0]
+                      for field in self._get_changed_fields())
+        created = self._created
+        result = super(Owner, self).save(*args, **kwargs)
+        if not created and changed - set(self.session_ignored_fields):
+            from mist.api.auth.cache import invalidate_sessions
+            invalidate_sessions(owners=[self.id])
+        return result
+
+    def delete(self, *args, **kwargs):
+        super(Owner, self).delete(*args, **kwargs)
+        from mist.api.auth.cache import invalidate_sessions
+        invalidate_sessions(owners=[self.id])
+
     def get_rules_dict(self):
         from mist.api.rules.models import Rule
         return {rule.id: rule.as_dict()
@@ -287,6 +308,8 @@ class User(Owner):
             'email', 'first_name', 'last_name', 'username', 'last_login']
     }
 
+    session_ignored_fields = Owner.session_ignored_fields + ('last_login', )
+
     def __str__(self):
         return 'User %s' % self.email
 
@@ -488,6 +511,9 @@ class Organization(Owner):
 
     meta = {'indexes': ['name']}
 
+    session_ignored_fields = Owner.session_ignored_fields + (
+        'members_count', 'teams_count', 'clouds_count', 'poller_updated')
+
     @property
     def mapper(self):
         """Returns the `PermissionMapper` for the current Org context."""
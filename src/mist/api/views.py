@@ -11,6 +11,7 @@ be performed inside the corresponding method functions.
 
 import os
 import hashlib
+import secrets
 import html
 
 import urllib.request
@@ -2441,6 +2442,29 @@ def version(request):
     return {'version': config.VERSION}
 
 
+@view_config(route_name='metrics', request_method='GET')
+def metrics(request):
+    """Return provider API and polling metrics in the Prometheus format
+
+    Requires `config.METRICS_TOKEN` as a bearer token, if set, or an admin
+    user.
+
+    """
+    if not config.PROVIDER_METRICS:
+        raise NotFoundError()
+    auth_value = request.headers.get('Authorization', '')
+    if not (config.METRICS_TOKEN and auth_value.startswith('Bearer ') and
+            secrets.compare_digest(auth_value[len('Bearer '):].encode(),
+                                   config.METRICS_TOKEN.encode())):
+        user_from_request(request, admin=True)
+    from mist.api.instrumentation import render_metrics
+    body, content_type = render_metrics()
+    response = Response(body)
+    response.content_type = content_type.split(';')[0]
+    response.charset = 'utf-8'
+    return response
+
+
 @view_config(route_name='api_v1_section', request_method='GET')
 def section(request):
     '''
@@ -0,0 +1,130 @@
+""" Benchmark of the image update modes of _list_images
+
+Compares storing every image one by one with the bulk reconciliation of
+images, using the images of all providers in the list_images.json fixture.
+Each image is repeated BENCHMARK_IMAGES_REPEAT times, defaulting to 10.
+
+It needs a real MongoDB, so this is not part of the unit tests. It is
+skipped unless the MIST_BENCHMARKS env variable is set and MONGO_URI is
+reachable. Run it with:
+
+    MIST_BENCHMARKS=1 python -m unittest tests.benchmarks.list_images
+"""
+import os
+import json
+import time
+import uuid
+import unittest
+from unittest import mock
+
+from libcloud.compute.base import NodeImage
+from pymongo.collection import Collection
+
+from mist.api import config
+from mist.api.clouds.models import MaxihostCloud
+from mist.api.clouds.controllers.compute import base
+from mist.api.clouds.controllers.compute.controllers import \
+    MaxihostComputeController
+from mist.api.images.models import CloudImage
+from mist.api.users.models import Organization, User
+
+from tests.benchmarks.process_pool import mongo_reachable
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                       'list_images.json')
+
+REPEAT = int(os.getenv('BENCHMARK_IMAGES_REPEAT', 10))
+
+MODES = {
+    'per image': {'IMAGES_BULK_RECONCILIATION': False},
+    'bulk': {'IMAGES_BULK_RECONCILIATION': True},
+}
+
+WRITES = ('insert_one', 'update_one', 'replace_one', 'bulk_write')
+
+
+def fixture_images():
+    with open(FIXTURE) as fobj:
+        fixture = json.load(fobj)
+    images = {}
+    for provider, provider_images in fixture.items():
+        for image in provider_images:
+            for i in range(REPEAT):
+                image_id = '%s-%s-%d' % (provider, image['id'], i)
+                images[image_id] = NodeImage(
+                    id=image_id, name=image['name'], driver=None,
+                    extra=image.get('extra') or {})
+    return list(images.values())
+
+
+@unittest.skipUnless(os.getenv('MIST_BENCHMARKS'),
+                     'MIST_BENCHMARKS env variable not set')
+class TestListImagesBenchmark(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        if not mongo_reachable():
+            raise unittest.SkipTest('MongoDB at %s is not reachable' %
+                                    config.MONGO_URI)
+        name = uuid.uuid4().hex
+        cls.user = User(email='%s@example.com' % name)
+        cls.user.save()
+        cls.org = Organization(name=name)
+        cls.org.add_member_to_team('Owners', cls.user)
+        cls.org.save()
+        cls.cloud = MaxihostCloud(owner=cls.org, title=name, token='dummy')
+        cls.cloud.save()
+        cls.images = fixture_images()
+
+    @classmethod
+    def tearDownClass(cls):
+        CloudImage.objects(cloud=cls.cloud).delete()
+        cls.cloud.delete()
+        cls.org.remove_member_from_members(cls.user)
+        cls.user.delete()
+        cls.org.delete()
+
+    def poll(self):
+        originals = {method: getattr(Collection, method) for method in WRITES}
+        mocks = {method: mock.DEFAULT for method in WRITES}
+        with mock.patch.multiple(Collection, autospec=True, **mocks) as calls:
+            for method, call in calls.items():
+                call.side_effect = originals[method]
+            start = time.time()
+            images = self.cloud.ctl.compute._list_images()
+            elapsed = time.time() - start
+        self.assertEqual(len(images), len(self.images))
+        writes = sum(call.call_count for call in calls.values())
+        return elapsed, writes
+
+    def stored_images(self):
+        return sorted((image.external_id, image.name, image.extra)
+                      for image in CloudImage.objects(cloud=self.cloud))
+
+    def test_benchmark(self):
+        results = {}
+        stored = {}
+        with mock.patch.object(MaxihostComputeController,
+                               '_list_images__fetch_images',
+                               return_value=self.images):
+            for mode, settings in MODES.items():
+                CloudImage.objects(cloud=self.cloud).delete()
+                base._image_constraints_fingerprints.clear()
+                with mock.patch.multiple(config, **settings):
+                    # First poll inserts all images, second poll finds
+                    # nothing changed.
+                    results[mode] = (self.poll(), self.poll())
+                stored[mode] = self.stored_images()
+
+        for mode, (first, second) in results.items():
+            print("%s: %d images, first poll %.2fs with %d writes, "
+                  "unchanged poll %.2fs with %d writes" % (
+                      mode, len(self.images), first[0], first[1],
+                      second[0], second[1]))
+
+        # Both modes store the same images.
+        self.assertEqual(stored['bulk'], stored['per image'])
+        self.assertEqual(results['bulk'][0][1], 1)
+        self.assertEqual(results['bulk'][1][1], 0)
+        self.assertLess(results['bulk'][1][0], results['per image'][1][0])
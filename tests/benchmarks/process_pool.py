@@ -0,0 +1,138 @@
+""" Benchmark of the machine update modes of _list_machines
+
+Compares serial updates, a process pool started on every poll and the
+persistent process pool on a synthetic fixture of nodes. The number of nodes
+defaults to 10000 and can be set with the BENCHMARK_NODES env variable.
+
+The pool processes need a real MongoDB, so this is not part of the unit
+tests. It is skipped unless the MIST_BENCHMARKS env variable is set and
+MONGO_URI is reachable. Run it with:
+
+    MIST_BENCHMARKS=1 python -m unittest tests.benchmarks.process_pool
+"""
+import os
+import time
+import uuid
+import unittest
+from unittest import mock
+
+import pymongo
+
+from mist.api import config
+from mist.api.clouds.models import MaxihostCloud, CloudLocation
+from mist.api.clouds.controllers.compute.controllers import \
+    MaxihostComputeController
+from mist.api.machines.models import Machine
+from mist.api.users.models import Organization, User
+
+
+NUM_NODES = int(os.getenv('BENCHMARK_NODES', 10000))
+
+MODES = {
+    'serial': {'PROCESS_POOL_WORKERS': 0},
+    'per-poll pool': {'PROCESS_POOL_WORKERS': 4,
+                      'PROCESS_POOL_PERSISTENT': False},
+    'persistent pool': {'PROCESS_POOL_WORKERS': 4,
+                        'PROCESS_POOL_PERSISTENT': True},
+}
+
+
+def mongo_reachable():
+    client = pymongo.MongoClient(config.MONGO_URI,
+                                 serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command('ping')
+    except pymongo.errors.PyMongoError:
+        return False
+    finally:
+        client.close()
+    return True
+
+
+def synthetic_nodes(num):
+    return [{
+        'id': 'node-%d' % i,
+        'name': 'node-%d' % i,
+        'state': 'running',
+        'public_ips': ['10.%d.%d.%d' % (i >> 16 & 255, i >> 8 & 255,
+                                        i & 255)],
+        'private_ips': [],
+        'size': 'size-%d' % (i % 10),
+        'image': 'image-%d' % (i % 10),
+        'created_at': None,
+        'extra': {'location': {'facility_code': 'ams'}, 'ips': []},
+    } for i in range(num)]
+
+
+@unittest.skipUnless(os.getenv('MIST_BENCHMARKS'),
+                     'MIST_BENCHMARKS env variable not set')
+class TestProcessPoolBenchmark(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        if not mongo_reachable():
+            raise unittest.SkipTest('MongoDB at %s is not reachable' %
+                                    config.MONGO_URI)
+        name = uuid.uuid4().hex
+        cls.user = User(email='%s@example.com' % name)
+        cls.user.save()
+        cls.org = Organization(name=name)
+        cls.org.add_member_to_team('Owners', cls.user)
+        cls.org.save()
+        cls.cloud = MaxihostCloud(owner=cls.org, title=name, token='dummy')
+        cls.cloud.save()
+        cls.location = CloudLocation(cloud=cls.cloud, owner=cls.org,
+                                     external_id='ams', name='ams').save()
+        cls.nodes = synthetic_nodes(NUM_NODES)
+
+    @classmethod
+    def tearDownClass(cls):
+        Machine.objects(cloud=cls.cloud).delete()
+        cls.location.delete()
+        cls.cloud.delete()
+        cls.org.remove_member_from_members(cls.user)
+        cls.user.delete()
+        cls.org.delete()
+
+    def poll(self):
+        start = time.time()
+        machines = self.cloud.ctl.compute._list_machines()
+        elapsed = time.time() - start
+        self.assertEqual(len(machines), NUM_NODES)
+        return elapsed
+
+    def stored_machines(self):
+        return sorted(
+            (m.machine_id, m.name, m.state, m.public_ips,
+             m._data['location'].id if m._data.get('location') else None)
+            for m in Machine.objects(cloud=self.cloud, missing_since=None))
+
+    def test_benchmark(self):
+        results = {}
+        stored = {}
+        with mock.patch.object(MaxihostComputeController,
+                               '_list_machines__fetch_machines',
+                               return_value=self.nodes):
+            for mode, settings in MODES.items():
+                Machine.objects(cloud=self.cloud).delete()
+                with mock.patch.multiple(config, **settings):
+                    # First poll inserts all machines, second poll finds
+                    # nothing changed.
+                    first = self.poll()
+                    stored[mode] = self.stored_machines()
+                    results[mode] = (first, self.poll())
+                self.assertEqual(self.stored_machines(), stored[mode])
+
+        for mode, (first, second) in results.items():
+            print("%s: %d nodes, first poll %.2fs (%.2fx serial), "
+                  "unchanged poll %.2fs (%.2fx serial)" % (
+                      mode, NUM_NODES, first,
+                      first / results['serial'][0], second,
+                      second / results['serial'][1]))
+
+        # All modes store the same machines.
+        self.assertEqual(len(stored['serial']), NUM_NODES)
+        self.assertEqual(stored['per-poll pool'], stored['serial'])
+        self.assertEqual(stored['persistent pool'], stored['serial'])
+        self.assertLess(results['persistent pool'][1],
+                        results['per-poll pool'][1])
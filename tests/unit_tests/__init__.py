@@ -0,0 +1,11 @@
+import mongomock
+import mongoengine as me
+
+
+def connect_mongomock():
+    """Connect mongoengine to an in-memory mongomock database"""
+    me.disconnect()
+    if me.VERSION >= (0, 27):
+        me.connect('mist_test', mongo_client_class=mongomock.MongoClient)
+    else:
+        me.connect('mist_test', host='mongomock://localhost')
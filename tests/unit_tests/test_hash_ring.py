@@ -0,0 +1,65 @@
+import uuid
+import unittest
+
+from mist.api.sharding.methods import HashRing, _complement
+
+
+class TestHashRing(unittest.TestCase):
+
+    keys = [uuid.uuid4().hex for _ in range(10000)]
+
+    def assign(self, ring):
+        return {key: ring.get_member(key) for key in self.keys}
+
+    def test_empty_ring(self):
+        self.assertIsNone(HashRing([]).get_member('key'))
+
+    def test_deterministic(self):
+        members = ['scheduler-%d' % i for i in range(4)]
+        self.assertEqual(self.assign(HashRing(members)),
+                         self.assign(HashRing(reversed(members))))
+
+    def test_balanced(self):
+        members = ['scheduler-%d' % i for i in range(4)]
+        assigned = list(self.assign(HashRing(members)).values())
+        for member in members:
+            share = assigned.count(member) / len(self.keys)
+            self.assertGreater(share, 0.15)
+            self.assertLess(share, 0.35)
+
+    def test_membership_change_moves_few_keys(self):
+        members = ['scheduler-%d' % i for i in range(4)]
+        before = self.assign(HashRing(members))
+        after = self.assign(HashRing(members + ['scheduler-4']))
+        moved = [key for key in self.keys if before[key] != after[key]]
+        # About 1/5 of the keys should move, all to the new member.
+        self.assertLess(len(moved) / len(self.keys), 0.3)
+        self.assertTrue(all(after[key] == 'scheduler-4' for key in moved))
+
+        after = self.assign(HashRing(members[1:]))
+        moved = [key for key in self.keys if before[key] != after[key]]
+        self.assertTrue(all(before[key] == 'scheduler-0' for key in moved))
+
+    def test_ranges_match_members(self):
+        members = ['scheduler-%d' % i for i in range(4)]
+        ring = HashRing(members)
+
+        def in_ranges(position, ranges):
+            return any((start is None or position >= start) and
+                       (end is None or position < end)
+                       for start, end in ranges)
+
+        for member in members:
+            ranges = ring.get_ranges(member)
+            unowned = _complement(ranges)
+            for key in self.keys[:1000]:
+                position = ring.get_position(key)
+                owned = ring.get_member(key) == member
+                self.assertEqual(in_ranges(position, ranges), owned)
+                self.assertEqual(in_ranges(position, unowned), not owned)
+
+    def test_single_member_owns_everything(self):
+        ring = HashRing(['scheduler-0'])
+        self.assertEqual(_complement(ring.get_ranges('scheduler-0')), [])
+        self.assertEqual(ring.get_ranges('scheduler-1'), [])
+        self.assertEqual(_complement([]), [(None, None)])
@@ -0,0 +1,57 @@
+""" Tests of the incremental patch of machines published on polls """
+import copy
+import unittest
+
+import jsonpatch
+
+from mist.api.clouds.controllers.compute.base import _incremental_patch
+
+
+def machine(machine_id, **kwargs):
+    machine = {
+        'id': machine_id,
+        'machine_id': 'node-%s' % machine_id,
+        'name': 'machine-%s' % machine_id,
+        'state': 'running',
+        'public_ips': ['10.0.0.1'],
+        'private_ips': [],
+        'extra': {'tags': {'env': 'prod'}, 'ports': []},
+        'cost': {'hourly': 0.1, 'monthly': 73},
+    }
+    machine.update(kwargs)
+    return machine
+
+
+class TestIncrementalPatch(unittest.TestCase):
+
+    def assert_patches_apply(self, old, new):
+        patch = _incremental_patch(old, new)
+        self.assertEqual(jsonpatch.apply_patch(copy.deepcopy(old), patch),
+                         new)
+        self.assertEqual(
+            jsonpatch.JsonPatch.from_diff(old, new).apply(copy.deepcopy(old)),
+            new)
+        return patch
+
+    def test_unchanged(self):
+        old = {key: machine(key) for key in ('a', 'b', 'c')}
+        self.assertEqual(_incremental_patch(old, copy.deepcopy(old)), [])
+
+    def test_added_removed_and_changed(self):
+        old = {key: machine(key) for key in ('a', 'b', 'c', 'x/y~z')}
+        new = copy.deepcopy(old)
+        del new['b']
+        new['d'] = machine('d')
+        new['e/f'] = machine('e/f')
+        new['c']['state'] = 'stopped'
+        new['c']['public_ips'] = []
+        new['c']['extra']['tags']['team'] = 'web'
+        new['x/y~z']['name'] = 'renamed'
+        patch = self.assert_patches_apply(old, new)
+        # The unchanged machine is not part of the patch.
+        self.assertFalse([operation for operation in patch
+                          if operation['path'].startswith('/a')])
+
+    def test_all_added_and_removed(self):
+        self.assert_patches_apply({}, {'a': machine('a')})
+        self.assert_patches_apply({'a': machine('a')}, {})
@@ -0,0 +1,83 @@
+""" Tests of the batch serialization of machines, on mongomock """
+import unittest
+from unittest import mock
+
+import mongomock
+import mongoengine as me
+
+from mist.api import config
+from mist.api.clouds.models import OtherCloud, CloudLocation, CloudSize
+from mist.api.keys.models import SSHKey
+from mist.api.machines.models import Machine, KeyMachineAssociation
+from mist.api.machines.models import machines_as_dict
+from mist.api.tag.models import Tag
+from mist.api.users.models import Organization
+
+from tests.unit_tests import connect_mongomock
+
+
+def count_queries(func):
+    """Call `func` and return its result along with the number of queries"""
+    find = mongomock.collection.Collection.find
+    with mock.patch.object(mongomock.collection.Collection, 'find',
+                           autospec=True, side_effect=find) as mocked:
+        result = func()
+    return result, mocked.call_count
+
+
+class TestMachinesAsDict(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        connect_mongomock()
+        cls.org = Organization(name='org').save(validate=False)
+        cls.cloud = OtherCloud(owner=cls.org, title='cloud').save(
+            validate=False)
+        cls.location = CloudLocation(cloud=cls.cloud, owner=cls.org,
+                                     external_id='loc', name='loc').save()
+        cls.size = CloudSize(cloud=cls.cloud, external_id='size',
+                             name='size').save()
+        cls.key = SSHKey(owner=cls.org, name='key').save(validate=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        me.disconnect()
+        me.connect(db=config.MONGO_DB, host=config.MONGO_URI)
+
+    def create_machines(self, num):
+        machine_ids = []
+        for i in range(num):
+            machine = Machine(cloud=self.cloud, owner=self.org,
+                              machine_id='%d-%d' % (num, i),
+                              name='machine-%d' % i, location=self.location,
+                              size=self.size).save(validate=False)
+            Tag(owner=self.org, resource_type='machine',
+                resource_id=machine.id, key='index', value=str(i)).save()
+            KeyMachineAssociation(key=self.key, machine=machine).save()
+            machine_ids.append(machine.id)
+        return machine_ids
+
+    def test_same_as_as_dict(self):
+        machine_ids = self.create_machines(3)
+        single = [m.as_dict() for m in Machine.objects(id__in=machine_ids)]
+        batch = machines_as_dict(Machine.objects(id__in=machine_ids))
+        self.assertEqual(batch, single)
+        self.assertEqual([m['tags'] for m in batch],
+                         [{'index': str(i)} for i in range(3)])
+        self.assertEqual([len(m['key_associations']) for m in batch],
+                         [1, 1, 1])
+
+    def test_query_count_is_constant(self):
+        counts = {}
+        for num in (5, 20):
+            machine_ids = self.create_machines(num)
+            _, single_count = count_queries(
+                lambda: [m.as_dict()
+                         for m in Machine.objects(id__in=machine_ids)])
+            _, counts[num] = count_queries(
+                lambda: machines_as_dict(Machine.objects(id__in=machine_ids)))
+            self.assertGreater(single_count, num)
+        self.assertEqual(counts[5], counts[20])
+
+    def test_empty(self):
+        self.assertEqual(machines_as_dict([]), [])
@@ -0,0 +1,106 @@
+""" Tests of the locks of periodic tasks, on mongomock """
+import datetime
+import unittest
+
+import mongoengine as me
+
+from mist.api import config
+from mist.api.concurrency.models import PeriodicTaskInfo
+from mist.api.concurrency.models import PeriodicTaskLockTakenError
+from mist.api.concurrency.models import PeriodicTaskTooRecentLastRun
+
+from tests.unit_tests import connect_mongomock
+
+
+KEY = 'test:periodic_task'
+
+
+class TestPeriodicTaskLock(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        connect_mongomock()
+
+    @classmethod
+    def tearDownClass(cls):
+        me.disconnect()
+        me.connect(db=config.MONGO_DB, host=config.MONGO_URI)
+
+    def setUp(self):
+        PeriodicTaskInfo.objects.delete()
+
+    def age_lock(self, seconds):
+        """Make the current lock of the task `seconds` old"""
+        created_at = datetime.datetime.now() - datetime.timedelta(
+            seconds=seconds)
+        PeriodicTaskInfo.objects(key=KEY).update(
+            set__lock__created_at=created_at)
+
+    def test_get_or_add_creates_one_document(self):
+        task = PeriodicTaskInfo.get_or_add(KEY)
+        again = PeriodicTaskInfo.get_or_add(KEY)
+        self.assertEqual(task.key, again.key)
+        self.assertEqual(task.failures_count, 0)
+        self.assertEqual(PeriodicTaskInfo.objects(key=KEY).count(), 1)
+
+    def test_held_lock_is_not_acquired(self):
+        PeriodicTaskInfo.get_or_add(KEY).acquire_lock()
+        with self.assertRaises(PeriodicTaskLockTakenError):
+            PeriodicTaskInfo.get_or_add(KEY).acquire_lock()
+
+    def test_stale_lock_is_taken_over(self):
+        first = PeriodicTaskInfo.get_or_add(KEY)
+        first.acquire_lock()
+        self.age_lock(
+            PeriodicTaskInfo.break_lock_after.total_seconds() + 10)
+        second = PeriodicTaskInfo.get_or_add(KEY)
+        second.acquire_lock()
+        self.assertNotEqual(second.lock.id, first.lock.id)
+        self.assertEqual(PeriodicTaskInfo.objects.get(key=KEY).lock.id,
+                         second.lock.id)
+
+    def test_too_soon(self):
+        task = PeriodicTaskInfo.get_or_add(KEY)
+        task.update(set__last_success=datetime.datetime.now())
+        task.reload()
+        with self.assertRaises(PeriodicTaskTooRecentLastRun):
+            task.check_too_soon()
+        with self.assertRaises(PeriodicTaskTooRecentLastRun):
+            task.acquire_lock(check_too_soon=True)
+        self.assertIsNone(PeriodicTaskInfo.objects.get(key=KEY).lock)
+
+    def test_release_broken_lock_applies_update(self):
+        first = PeriodicTaskInfo.get_or_add(KEY)
+        first.acquire_lock()
+        self.age_lock(
+            PeriodicTaskInfo.break_lock_after.total_seconds() + 10)
+        second = PeriodicTaskInfo.get_or_add(KEY)
+        second.acquire_lock()
+
+        now = datetime.datetime.now()
+        first.release_lock(set__last_failure=now, inc__failures_count=1)
+        stored = PeriodicTaskInfo.objects.get(key=KEY)
+        self.assertEqual(stored.failures_count, 1)
+        self.assertIsNotNone(stored.last_failure)
+        # The lock of the run that broke it is kept.
+        self.assertEqual(stored.lock.id, second.lock.id)
+
+        second.release_lock(set__last_success=now, set__failures_count=0)
+        stored = PeriodicTaskInfo.objects.get(key=KEY)
+        self.assertIsNone(stored.lock)
+        self.assertEqual(stored.failures_count, 0)
+
+    def test_task_runner(self):
+        task = PeriodicTaskInfo.get_or_add(KEY)
+        with self.assertRaises(ValueError):
+            with task.task_runner():
+                self.assertIsNotNone(
+                    PeriodicTaskInfo.objects.get(key=KEY).lock)
+                raise ValueError()
+        stored = PeriodicTaskInfo.objects.get(key=KEY)
+        self.assertIsNone(stored.lock)
+        self.assertEqual(stored.failures_count, 1)
+        # It has just failed, so it's too soon to run again.
+        with self.assertRaises(PeriodicTaskTooRecentLastRun):
+            with PeriodicTaskInfo.get_or_add(KEY).task_runner():
+                pass
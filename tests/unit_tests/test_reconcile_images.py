@@ -0,0 +1,136 @@
+""" Tests of the bulk reconciliation of images, on mongomock """
+import os
+import json
+import unittest
+from unittest import mock
+
+import mongomock
+import mongoengine as me
+from libcloud.compute.base import NodeImage
+
+from mist.api import config
+from mist.api.clouds.models import MaxihostCloud, CloudLocation
+from mist.api.clouds.controllers.compute import base
+from mist.api.clouds.controllers.compute.controllers import \
+    MaxihostComputeController
+from mist.api.images.models import CloudImage
+from mist.api.users.models import Organization
+
+from tests.unit_tests import connect_mongomock
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                       'list_images.json')
+
+WRITES = ('insert_one', 'update_one', 'replace_one', 'bulk_write')
+
+
+def fixture_images():
+    with open(FIXTURE) as fobj:
+        fixture = json.load(fobj)
+    images = {}
+    for provider, provider_images in fixture.items():
+        for image in provider_images:
+            image_id = '%s-%s' % (provider, image['id'])
+            images[image_id] = NodeImage(id=image_id, name=image['name'],
+                                         driver=None,
+                                         extra=image.get('extra') or {})
+    return list(images.values())
+
+
+class TestReconcileImages(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        connect_mongomock()
+        cls.org = Organization(name='org').save(validate=False)
+        cls.cloud = MaxihostCloud(owner=cls.org, title='cloud',
+                                  token='dummy').save(validate=False)
+        cls.images = fixture_images()
+
+    @classmethod
+    def tearDownClass(cls):
+        me.disconnect()
+        me.connect(db=config.MONGO_DB, host=config.MONGO_URI)
+
+    def setUp(self):
+        CloudImage.objects(cloud=self.cloud).delete()
+        CloudLocation.objects(cloud=self.cloud).delete()
+        base._image_constraints_fingerprints.clear()
+        patcher = mock.patch.object(MaxihostComputeController,
+                                    '_list_images__fetch_images',
+                                    side_effect=lambda *a, **kw: self.images)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def poll(self, bulk=True):
+        """Poll images and return them along with the number of writes"""
+        collection = mongomock.collection.Collection
+        originals = {method: getattr(collection, method)
+                     for method in WRITES}
+        mocks = {method: mock.DEFAULT for method in WRITES}
+        with mock.patch.multiple(collection, autospec=True,
+                                 **mocks) as calls:
+            for method, call in calls.items():
+                call.side_effect = originals[method]
+            with mock.patch.object(config, 'IMAGES_BULK_RECONCILIATION',
+                                   bulk):
+                images = self.cloud.ctl.compute._list_images()
+        return images, sum(call.call_count for call in calls.values())
+
+    def stored_images(self):
+        return sorted((image.external_id, image.name, image.extra)
+                      for image in CloudImage.objects(cloud=self.cloud))
+
+    def test_same_as_per_image(self):
+        self.poll(bulk=False)
+        per_image = self.stored_images()
+        CloudImage.objects(cloud=self.cloud).delete()
+        images, writes = self.poll()
+        self.assertEqual(len(images), len(self.images))
+        self.assertEqual(self.stored_images(), per_image)
+        self.assertEqual(writes, 1)
+
+    def test_unchanged_poll_writes_nothing(self):
+        self.poll()
+        images, writes = self.poll()
+        self.assertEqual(len(images), len(self.images))
+        self.assertEqual(writes, 0)
+
+    def test_concurrent_changes_are_kept(self):
+        self.poll()
+        image = self.images[0]
+        self.images[0] = NodeImage(id=image.id, name='renamed', driver=None,
+                                   extra=image.extra)
+        self.addCleanup(self.images.__setitem__, 0, image)
+        update_fields = MaxihostComputeController.\
+            _list_images__update_image_fields
+
+        def star_and_update(controller, _image, *args, **kwargs):
+            # The image is starred after it has been loaded by the poll.
+            if _image.external_id == image.id:
+                CloudImage.objects(id=_image.id).update(starred=True)
+            return update_fields(controller, _image, *args, **kwargs)
+
+        with mock.patch.object(MaxihostComputeController,
+                               '_list_images__update_image_fields',
+                               autospec=True, side_effect=star_and_update):
+            _, writes = self.poll()
+        stored = CloudImage.objects.get(cloud=self.cloud,
+                                        external_id=image.id)
+        self.assertEqual(writes, 1)
+        self.assertEqual(stored.name, 'renamed')
+        self.assertTrue(stored.starred)
+
+    def test_constraints_refreshed_when_locations_change(self):
+        with mock.patch.object(MaxihostComputeController,
+                               '_list_images__update_constraints') as update:
+            self.poll()
+            self.assertEqual(update.call_count, len(self.images))
+            update.reset_mock()
+            self.poll()
+            self.assertEqual(update.call_count, 0)
+            CloudLocation(cloud=self.cloud, owner=self.org,
+                          external_id='ams', name='ams').save()
+            self.poll()
+            self.assertEqual(update.call_count, len(self.images))
@@ -0,0 +1,88 @@
+""" Tests of the bulk reconciliation of DNS records, on mongomock """
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import mongoengine as me
+
+from mist.api import config
+from mist.api.clouds.models import AmazonCloud
+from mist.api.clouds.controllers.dns.controllers import AmazonDNSController
+from mist.api.dns.models import Zone, Record
+from mist.api.users.models import Organization
+
+from tests.unit_tests import connect_mongomock
+
+
+def provider_record(record_id, data, type='NS'):
+    return SimpleNamespace(id=record_id, name='example.com', type=type,
+                           ttl=300, extra={}, data=data)
+
+
+class TestReconcileRecords(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        connect_mongomock()
+        cls.org = Organization(name='org').save(validate=False)
+        cls.cloud = AmazonCloud(owner=cls.org, title='cloud', apikey='key',
+                                apisecret='secret').save(validate=False)
+        cls.zone = Zone(owner=cls.org, cloud=cls.cloud, zone_id='zone',
+                        domain='example.com.', type='master').save(
+                            validate=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        me.disconnect()
+        me.connect(db=config.MONGO_DB, host=config.MONGO_URI)
+
+    def setUp(self):
+        Record.objects(zone=self.zone).delete()
+
+    def list_records(self, pr_records, batch_size=1000):
+        mapper = mock.Mock()
+        with mock.patch.object(AmazonDNSController,
+                               '_list_records__iterate_records',
+                               return_value=iter(pr_records)), \
+                mock.patch.object(Organization, 'mapper', mapper), \
+                mock.patch.object(config, 'DNS_RECORDS_BATCH_SIZE',
+                                  batch_size):
+            records = self.cloud.ctl.dns._list_records__reconcile_records(
+                self.zone)
+        return records, mapper
+
+    def test_duplicate_new_records(self):
+        records, mapper = self.list_records([
+            provider_record('ns', 'ns1.example.com'),
+            provider_record('a', '10.0.0.1', type='A'),
+            provider_record('ns', 'ns2.example.com'),
+        ])
+        self.assertEqual(sorted(r.record_id for r in records), ['a', 'ns'])
+        stored = Record.objects.get(zone=self.zone, record_id='ns')
+        self.assertEqual(stored.rdata, ['ns1.example.com', 'ns2.example.com'])
+        self.assertEqual(Record.objects(zone=self.zone).count(), 2)
+        new_records = mapper.update.call_args[0][0]
+        self.assertEqual(sorted(r.record_id for r in new_records),
+                         ['a', 'ns'])
+
+    def test_duplicate_records_across_batches(self):
+        records, _ = self.list_records([
+            provider_record('ns', 'ns1.example.com'),
+            provider_record('a', '10.0.0.1', type='A'),
+            provider_record('ns', 'ns2.example.com'),
+        ], batch_size=1)
+        self.assertEqual(len(records), 2)
+        stored = Record.objects.get(zone=self.zone, record_id='ns')
+        self.assertEqual(stored.rdata, ['ns1.example.com', 'ns2.example.com'])
+
+    def test_duplicate_existing_records(self):
+        self.list_records([provider_record('ns', 'ns1.example.com')])
+        records, mapper = self.list_records([
+            provider_record('ns', 'ns2.example.com'),
+            provider_record('ns', 'ns3.example.com'),
+        ])
+        self.assertEqual([r.record_id for r in records], ['ns'])
+        self.assertEqual(mapper.update.call_args[0][0], [])
+        stored = Record.objects.get(zone=self.zone, record_id='ns')
+        self.assertEqual(stored.rdata, ['ns1.example.com', 'ns2.example.com',
+                                        'ns3.example.com'])
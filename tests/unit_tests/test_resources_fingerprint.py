@@ -0,0 +1,45 @@
+""" Tests of the fingerprint of listed resources used by adaptive polling """
+import datetime
+import unittest
+
+from mist.api.machines.models import Machine, PingProbe, SSHProbe
+from mist.api.poller.models import resources_fingerprint
+
+
+class TestResourcesFingerprint(unittest.TestCase):
+
+    def machines(self):
+        return [Machine(id='machine-%d' % i, machine_id='node-%d' % i,
+                        name='machine-%d' % i, state='running')
+                for i in range(3)]
+
+    def test_probes_are_ignored(self):
+        machines = self.machines()
+        fingerprint = resources_fingerprint(machines)
+        now = datetime.datetime.utcnow()
+        for i, machine in enumerate(machines):
+            machine.last_seen = now
+            machine.ping_probe = PingProbe()
+            machine.ping_probe.update_from_dict({
+                'packets_tx': 3, 'packets_rx': 3 - i,
+                'packets_loss': 100.0 * i / 3, 'rtt_avg': 0.1 * i})
+            machine.ssh_probe = SSHProbe(uptime=1000 + i, loadavg=[0.1 * i],
+                                         updated_at=now)
+            machine.unreachable_since = now if i == 2 else None
+        self.assertEqual(resources_fingerprint(machines), fingerprint)
+
+    def test_changes_are_detected(self):
+        machines = self.machines()
+        fingerprint = resources_fingerprint(machines)
+        machines[1].state = 'stopped'
+        self.assertNotEqual(resources_fingerprint(machines), fingerprint)
+        self.assertNotEqual(resources_fingerprint(machines[:2]),
+                            resources_fingerprint(machines))
+
+    def test_dicts(self):
+        machines = [{'id': 'machine-%d' % i, 'name': 'machine-%d' % i,
+                     'probe': {}} for i in range(3)]
+        fingerprint = resources_fingerprint(machines)
+        machines[0]['probe'] = {'ping': {'rtt_avg': 0.1}}
+        machines[0]['last_seen'] = str(datetime.datetime.utcnow())
+        self.assertEqual(resources_fingerprint(machines), fingerprint)
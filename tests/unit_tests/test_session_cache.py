@@ -0,0 +1,100 @@
+""" Tests of the in-process cache of auth tokens, on mongomock """
+import os
+import uuid
+import unittest
+from unittest import mock
+
+import mongoengine as me
+
+from mist.api import config
+from mist.api.auth.cache import session_cache
+from mist.api.auth.methods import session_from_request
+from mist.api.auth.models import AuthToken, ApiToken, SessionToken
+
+from tests.unit_tests import connect_mongomock
+
+
+def random_token():
+    # Authorization headers are lowercased, so are the tokens.
+    return uuid.uuid4().hex + uuid.uuid4().hex
+
+
+class FakeRequest(object):
+
+    def __init__(self, headers=None, cookies=None):
+        self.headers = headers or {}
+        self.cookies = cookies or {}
+        self.environ = {}
+        self.user_agent = 'test'
+
+
+class TestSessionCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        connect_mongomock()
+
+    @classmethod
+    def tearDownClass(cls):
+        me.disconnect()
+        me.connect(db=config.MONGO_DB, host=config.MONGO_URI)
+
+    def setUp(self):
+        AuthToken.objects.delete()
+        session_cache.clear()
+        # Pretend to listen for invalidations, without a broker.
+        for attr, value in (('pid', os.getpid()), ('listening', True)):
+            patcher = mock.patch.object(session_cache, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(config, 'AUTH_SESSION_CACHE_TTL', 60)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(session_cache.clear)
+
+        self.api_token = ApiToken(token=random_token(), name='api').save()
+        self.session_token = SessionToken(token=random_token()).save()
+
+    def test_cache_hit(self):
+        for request in (
+            FakeRequest(headers={'Authorization': self.api_token.token}),
+            FakeRequest(cookies={'session.id': self.session_token.token}),
+        ):
+            session = session_from_request(request)
+            self.assertIn(session.token, (self.api_token.token,
+                                          self.session_token.token))
+            with mock.patch.object(ApiToken, 'objects') as api_objects, \
+                    mock.patch.object(SessionToken, 'objects') as objects:
+                cached = session_from_request(
+                    FakeRequest(request.headers, request.cookies))
+            api_objects.get.assert_not_called()
+            objects.get.assert_not_called()
+            self.assertEqual(cached.token, session.token)
+            self.assertIs(type(cached), type(session))
+
+    def test_session_token_not_accepted_as_api_token(self):
+        session_from_request(
+            FakeRequest(cookies={'session.id': self.session_token.token}))
+        self.assertIsNotNone(
+            session_cache.get(self.session_token.token, SessionToken))
+        session = session_from_request(
+            FakeRequest(headers={'Authorization': self.session_token.token}))
+        self.assertIsInstance(session, ApiToken)
+        self.assertEqual(session.name, 'dummy_token')
+        self.assertNotEqual(session.token, self.session_token.token)
+
+    def test_api_token_not_accepted_as_session_cookie(self):
+        session_from_request(
+            FakeRequest(headers={'Authorization': self.api_token.token}))
+        self.assertIsNotNone(
+            session_cache.get(self.api_token.token, ApiToken))
+        session = session_from_request(
+            FakeRequest(cookies={'session.id': self.api_token.token}))
+        # A new anonymous session is started instead.
+        self.assertIsInstance(session, SessionToken)
+        self.assertNotEqual(session.token, self.api_token.token)
+        self.assertIsNone(session.user_id)
+
+
+if __name__ == '__main__':
+    unittest.main()